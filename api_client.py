@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+api_client.py
+
+Yhteinen HTTP-asiakas hinta-API:eille (api.spot-hinta.fi, sahkotin.fi).
+
+* Yksi requests.Session-yhteyspooli: TLS-yhteys avataan kerran ja käytetään uudelleen.
+* Ajokohtainen muistiinpano URL:n mukaan: sama URL haetaan ajon aikana vain kerran,
+  myös silloin kun samaa URL:ia pyydetään rinnakkain useasta säikeestä.
+* Pieni säiepooli (MAX_WORKERS), jolla toisistaan riippumattomat pyynnöt ajetaan rinnakkain.
+* Token bucket -nopeusrajoitin, joka estää suurta pinnijoukkoa aiheuttamasta HTTP 429 -virheitä.
+* Jokaisen kutsun kesto ja tulos kirjataan mittareihin (metrics.py).
+
+Virheet (requests.exceptions.*) välitetään kutsujalle sellaisenaan, joten
+olemassa oleva virheenkäsittely toimii ennallaan.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+
+# --- Konfiguraatio ---
+MAX_WORKERS = 4                # Rinnakkaisten pyyntöjen enimmäismäärä
+POOL_SIZE = 8                  # Yhteyspoolin koko isäntää kohden
+RATE_LIMIT_PER_SECOND = 4.0    # Token bucket: keskimääräinen pyyntönopeus
+RATE_LIMIT_BURST = 4           # Token bucket: sallittu purske
+DEFAULT_TIMEOUT = 15
+
+class TokenBucket:
+    """Säieturvallinen token bucket -nopeusrajoitin."""
+
+    def __init__(self, rate_per_second, capacity):
+        self.rate = float(rate_per_second)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Odottaa, kunnes yksi tokeni on saatavilla, ja kuluttaa sen. Palauttaa odotusajan sekunteina."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return waited
+                wait_s = (1.0 - self.tokens) / self.rate
+            time.sleep(wait_s); waited += wait_s
+
+# --- Moduulin tila (yksi asiakas prosessia kohden) ---
+_lock = threading.Lock()
+_session = None
+_executor = None
+_run_cache = {}   # url -> Future (ajokohtainen muistiinpano)
+_rate_limiter = TokenBucket(RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST)
+
+def get_session():
+    """Palauttaa jaetun requests.Session-olion (luodaan ensimmäisellä kutsulla)."""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None: _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='api')
+        return _executor
+
+def _fetch(url, timeout, headers):
+    waited = _rate_limiter.acquire()
+    if waited: metrics.inc('api_throttle_seconds_total', waited)
+    started = time.monotonic()
+    try: response = get_session().get(url, timeout=timeout, headers=headers)
+    except requests.exceptions.RequestException as e: metrics.record_api_call(url, time.monotonic() - started, error=type(e).__name__); raise
+    elapsed = time.monotonic() - started
+    metrics.record_api_call(url, elapsed, status=response.status_code)
+    logging.debug(f"HTTP {response.status_code} {url} ({elapsed * 1000:.0f} ms)")
+    return response
+
+def submit(url, timeout=DEFAULT_TIMEOUT, headers=None):
+    """Käynnistää haun taustalla (tai palauttaa jo käynnissä olevan/valmiin). Palauttaa Future-olion."""
+    executor = _get_executor()
+    with _lock:
+        future = _run_cache.get(url)
+        if future is None:
+            future = executor.submit(_fetch, url, timeout, headers)
+            _run_cache[url] = future
+        else: metrics.inc('api_cache_hits_total')
+        return future
+
+def get(url, timeout=DEFAULT_TIMEOUT, headers=None):
+    """Hakee URL:n (muistiinpanolla). Palauttaa requests.Response tai nostaa requests-poikkeuksen."""
+    return submit(url, timeout=timeout, headers=headers).result()
+
+def prefetch(urls, timeout=DEFAULT_TIMEOUT, headers=None):
+    """Käynnistää erilliset URL:t rinnakkain ja odottaa niiden valmistumista. Virheet jätetään get()-kutsujalle."""
+    unique_urls = list(dict.fromkeys(urls))
+    futures = [submit(url, timeout=timeout, headers=headers) for url in unique_urls]
+    for future in futures:
+        try: future.result()
+        except Exception: pass
+    return len(unique_urls)
+
+def reset_run_cache():
+    """Tyhjentää ajokohtaisen muistiinpanon (esim. jatkuvan ajon uuden jakson alussa)."""
+    with _lock: _run_cache.clear()
+
+def close():
+    """Sulkee säiepoolin ja yhteydet."""
+    global _session, _executor
+    with _lock:
+        executor, session = _executor, _session
+        _executor = None; _session = None
+        _run_cache.clear()
+    if executor is not None: executor.shutdown(wait=True)
+    if session is not None: session.close()
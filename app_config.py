@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+app_config.py
+
+Sovelluksen yleiset asetukset (ei pinnikohtaisia, ne ovat settings.json:ssa).
+Arvot luetaan järjestyksessä: oletukset (DEFAULTS) < skriptihakemiston
+config.json < ympäristömuuttujat. Ympäristömuuttujan nimi on avain isoilla
+kirjaimilla GPIO_VASALLI_-etuliitteellä, esim.
+GPIO_VASALLI_SAHKOTIN_API_URL=http://127.0.0.1:8080/prices. Asetustiedoston
+polun voi vaihtaa muuttujalla GPIO_VASALLI_CONFIG.
+
+Esim. paikallinen testipalvelin (fake_price_server.py):
+  {"spot_hinta_api_url": "http://127.0.0.1:8080",
+   "sahkotin_api_url": "http://127.0.0.1:8080/prices"}
+"""
+
+import json
+import logging
+import os
+
+# --- Konfiguraatio ja Polut ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ENV_PREFIX = 'GPIO_VASALLI_'
+CONFIG_FILE = os.environ.get(f'{ENV_PREFIX}CONFIG', os.path.join(SCRIPT_DIR, 'config.json'))
+
+DEFAULTS = {
+    "spot_hinta_api_url": "https://api.spot-hinta.fi",
+    "sahkotin_api_url": "https://sahkotin.fi/prices",
+    "gpio_backend": "rpi",            # rpi, gpiod tai memory (ks. gpio_backends.py)
+    "gpio_chip": "/dev/gpiochip0",    # gpiod-ajurin merkkilaite
+    "metrics_textfile": "",           # Prometheus-tiedoston polku (tyhjä = DATA_DIR/gpio_vasalli.prom)
+    "spool_dir": "auto",              # Kirjoituspuskuri (io_spool.py): auto = /dev/shm, tyhjä = ei puskurointia
+    "flush_interval_minutes": 60,     # Puskurin tyhjennysväli = suurin historian menetys sähkökatkossa
+    "price_sources": "sahkotin,spot_hinta",  # Hintalähteet ensisijaisuusjärjestyksessä (price_provider.py)
+    "price_hedge_delay_seconds": 0.3, # Odotus ennen varalähteen kutsua
+    "price_deadline_seconds": 1.0,    # Hintahaun ja varapolun API-kutsujen aikaraja
+    "switch_on_stagger_seconds": 0.0, # Kytkentäsarja (transition_sequencer.py): vähimmäisväli peräkkäisten ON-kytkentöjen välillä
+    "max_concurrent_inrush": 0,       # Samanaikaiset käynnistysvirrat, 0 = ei rajaa
+    "inrush_seconds": 0.5,            # Käynnistysvirran oletuskesto (pinnikohtainen inrush_seconds)
+    "max_power_kw": 0,                # Sivuston tehoraja kW (pääsulake/sopimusteho), 0 = ei rajaa (schedule_builder.py)
+    "fleet_price_areas": {},          # fleet_scheduler.py: hinta-alue -> Sahkotin /prices -yhteensopiva URL (FI = sahkotin_api_url)
+}
+
+def load_config(config_file=CONFIG_FILE, environ=None):
+    """Palauttaa asetukset dictinä (oletukset, config.json ja ympäristömuuttujat yhdistettynä)."""
+    environ = os.environ if environ is None else environ
+    config = dict(DEFAULTS)
+    if os.path.exists(config_file):
+        try:
+            with open(config_file, 'r', encoding='utf-8') as f: file_config = json.load(f)
+            if isinstance(file_config, dict): config.update(file_config)
+            else: logging.error(f"Asetustiedosto '{config_file}' ei ole JSON-objekti, käytetään oletuksia.")
+        except (json.JSONDecodeError, IOError) as e: logging.error(f"Asetustiedoston '{config_file}' lukeminen epäonnistui: {e}")
+    for key in config:
+        env_value = environ.get(f"{ENV_PREFIX}{key.upper()}")
+        if env_value is not None: config[key] = env_value
+    return config
+
+CONFIG = load_config()
+
+def get(key, default=None):
+    """Palauttaa asetuksen arvon (ks. moduulin kuvaus)."""
+    return CONFIG.get(key, default)
+
+def get_number(key, default, cast=float):
+    """Palauttaa numeerisen asetuksen (cast: float tai int). Virheellinen arvo kirjataan lokiin ja korvataan oletuksella."""
+    value = CONFIG.get(key, default)
+    try: return cast(value)
+    except (TypeError, ValueError):
+        logging.warning(f"Asetuksen '{key}' arvo {value!r} ei ole luku, käytetään oletusta {default}."); return default
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+backtest.py
+
+Takautuva laskelma: ajaa settings.json-tiedoston pinnien säännöt (hintarajat,
+N halvinta jaksoa ja hystereesi) hintahistoriaa vasten ja raportoi
+pinnikohtaiset ON-tunnit, energian, kustannuksen ja kytkentämäärät.
+
+Hinnat luetaan hinta-arkistosta (price_archive.py) ja hintavälimuistista
+(price_cache.json) matriisiksi päivät × jaksot, ja säännöt lasketaan koko
+matriisille kerralla NumPy-taulukko-operaatioina. Päätöslogiikka on sama kuin
+price_logic.decide_slot_with_hysteresis (ks. evaluate_pin). Pinneille, joilla on
+vähimmäis-ON/OFF-aika tai kytkentäbudjetti, sääntöjen tulos rajoitetaan päivä
+kerrallaan samalla funktiolla kuin aikataulussa (price_logic.limit_switching).
+Käynnistyskertoimen (startup_factor > 1) pinnit lasketaan päivä kerrallaan, koska
+päivän N halvimman valinta riippuu edellisen päivän viimeisestä tilasta.
+Verkkokutsuja ei tehdä.
+
+Vaatii numpy-kirjaston (pip install numpy).
+
+Ajo: python3 backtest.py --from 2022-01-01 [--to 2024-12-31] [--resolution 15]
+"""
+
+import os
+import sys
+import time
+import datetime
+import argparse
+import pin_settings
+import price_archive
+import price_cache
+from price_logic import cheapest_slot_count, find_cheapest_intervals_with_startup_cost, limit_switching, minutes_to_slots, trailing_run_minutes
+try:
+    import numpy as np
+except ImportError:
+    print("VIRHE: numpy-kirjastoa ei löydy. Asenna: pip install numpy", file=sys.stderr)
+    sys.exit(1)
+
+# --- Konfiguraatio ja Polut ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SETTINGS_FILE = os.path.join(SCRIPT_DIR, 'settings.json')
+
+# --- Hintamatriisi ---
+
+def load_price_days(start_date, end_date):
+    """Yhdistää arkiston ja välimuistin päivät väliltä [start_date, end_date]. Palauttaa {päivä_str: DayPrices}."""
+    local_tz = price_cache.ZoneInfo(price_cache.LOCAL_TIMEZONE_STR)
+    days = price_archive.load_days(start_date, end_date, local_tz=local_tz)
+    cache = price_cache.load_cache()
+    start_str, end_str = start_date.isoformat(), end_date.isoformat()
+    for day_str in cache['days']:
+        if not start_str <= day_str <= end_str: continue
+        day_prices = price_cache.get_day(cache, datetime.date.fromisoformat(day_str), local_tz)
+        if day_prices is not None and day_prices.valid_count(): days[day_str] = day_prices
+    return days
+
+def build_price_matrix(days, start_date, end_date, resolution_minutes=60):
+    """
+    Muodostaa hintamatriisin (päivät × jaksot) väliltä [start_date, end_date].
+    Tunnin hinnat levitetään tarvittaessa 15 min jaksoille ja 15 min hinnat
+    keskiarvoistetaan tunneiksi. Talviaikasiirtymän toistuvan tunnin hinnat
+    keskiarvoistetaan samaan sarakkeeseen. Puuttuvat jaksot ja päivät ovat NaN.
+    """
+    local_tz = price_cache.ZoneInfo(price_cache.LOCAL_TIMEZONE_STR)
+    day_count = (end_date - start_date).days + 1
+    slots_per_day = 24 * 60 // resolution_minutes
+    rows, cols, values = [], [], []
+    for day_str, day_prices in days.items():
+        row = (datetime.date.fromisoformat(day_str) - start_date).days
+        if not 0 <= row < day_count or day_prices is None: continue
+        span = max(1, day_prices.resolution_minutes // resolution_minutes)
+        for slot, price in zip(day_prices.labels(local_tz), day_prices.prices):
+            if price != price: continue
+            first_col = (int(slot[:2]) * 60 + int(slot[3:5])) // resolution_minutes
+            for col in range(first_col, min(first_col + span, slots_per_day)):
+                rows.append(row); cols.append(col); values.append(price)
+    sums = np.zeros((day_count, slots_per_day))
+    counts = np.zeros((day_count, slots_per_day))
+    np.add.at(sums, (rows, cols), values)
+    np.add.at(counts, (rows, cols), 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+def daily_ranks(price_matrix):
+    """Jaksojen hintajärjestys päivän sisällä (0 = halvin). Tasahinnoissa aiempi jakso ensin kuten find_cheapest_slots."""
+    order = np.argsort(np.where(np.isnan(price_matrix), np.inf, price_matrix), axis=1, kind='stable')
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(price_matrix.shape[1])[None, :], axis=1)
+    return ranks
+
+def startup_cheapest_row(day_prices, n, startup_factor, initially_on=False):
+    """Yhden päivän (hintalista, NaN = puuttuu) N halvimman jakson maski käynnistyskertoimella (price_logic)."""
+    mask = np.zeros(len(day_prices), dtype=bool)
+    prices_by_slot = {col: (None if price != price else price) for col, price in enumerate(day_prices)}
+    selected = find_cheapest_intervals_with_startup_cost(prices_by_slot, n, startup_factor, initially_on)
+    if selected: mask[sorted(selected)] = True
+    return mask
+
+def startup_cheapest_mask(price_matrix, n, startup_factor):
+    """
+    N halvimman jakson maski käynnistyskertoimella (startup_factor > 1). Valinta on
+    päiväkohtainen dynaaminen ohjelmointi (price_logic), joten se lasketaan
+    päivä kerrallaan ja kerran jokaista (N, kerroin) -paria kohden. Jokainen päivä
+    alkaa OFF-tilasta (optimoijan likiarvo; backtest käyttää startup_pin_states-funktiota).
+    """
+    return np.stack([startup_cheapest_row(day_prices, n, startup_factor) for day_prices in price_matrix.tolist()]).ravel()
+
+# --- Säännöt taulukko-operaatioina ---
+
+def _base_states(prices, valid, lower_limit, upper_limit, cheapest_mask, n):
+    """decide_slot taulukkona: ON, jos hinta <= alaraja tai (alaraja < hinta <= yläraja ja jakso N halvimpien joukossa)."""
+    lower_limit = min(lower_limit, upper_limit)
+    with np.errstate(invalid='ignore'):
+        below = prices <= lower_limit
+        between = (prices > lower_limit) & (prices <= upper_limit)
+    if n <= 0: return valid & below
+    return valid & (below | (between & cheapest_mask))
+
+def evaluate_pin(prices, valid, cheapest_mask, lower_limit, upper_limit, n, hysteresis, initial_state=False):
+    """
+    Laskee pinnin tilat litistetylle hintasarjalle. Hystereesi: tila on ON, jos
+    perustila on ON tai (nostetuilla rajoilla ON ja edellinen tila ON). Jaksoissa,
+    joissa nämä eroavat, tila on edellisen ratkaistun jakson tila, joten sarja
+    lasketaan eteenpäin täyttönä ilman jaksokohtaista silmukkaa. initial_state on
+    sarjaa edeltävä tila (ennen ensimmäistä ratkaistua jaksoa).
+    """
+    base = _base_states(prices, valid, lower_limit, upper_limit, cheapest_mask, n)
+    if hysteresis <= 0: return base
+    raised = _base_states(prices, valid, lower_limit + hysteresis, upper_limit + hysteresis, cheapest_mask, n)
+    resolved = base | ~raised
+    last_resolved = np.maximum.accumulate(np.where(resolved, np.arange(base.size), -1))
+    return np.where(last_resolved >= 0, base[np.maximum(last_resolved, 0)], bool(initial_state))
+
+def limit_daily(states, price_matrix, rule, resolution_minutes):
+    """
+    Rajoittaa litistetyn tilasarjan kytkennät päivä kerrallaan (price_logic.limit_switching),
+    tila ja sen kesto jatkuvat päivän rajan yli. Palauttaa uuden bool-taulukon.
+    """
+    day_count, slots_per_day = price_matrix.shape
+    min_on_slots = minutes_to_slots(rule.min_on_minutes, resolution_minutes)
+    min_off_slots = minutes_to_slots(rule.min_off_minutes, resolution_minutes)
+    limited = states.reshape(day_count, slots_per_day).copy()
+    previous_state, run_slots = False, None
+    for row in range(day_count):
+        day_prices = [None if price != price else float(price) for price in price_matrix[row]]
+        day_states = limit_switching(limited[row].tolist(), day_prices, min_on_slots, min_off_slots, rule.max_toggles_per_day, previous_state, run_slots)
+        limited[row] = day_states
+        previous_state, run_slots = day_states[-1], trailing_run_minutes(day_states, resolution_minutes) // resolution_minutes
+    return limited.ravel()
+
+def startup_pin_states(price_matrix, rule, n, resolution_minutes, row_masks):
+    """
+    Pinnin tilat käynnistyskertoimella (startup_factor > 1) päivä kerrallaan kuten aikataulussa:
+    N halvimman valinta, hystereesi ja kytkentärajoitukset jatkavat edellisen päivän viimeisestä
+    tilasta. row_masks: pinnien yhteinen välimuisti {(N, kerroin, rivi, alkutila): päivän maski}.
+    Palauttaa litistetyn bool-taulukon.
+    """
+    min_on_slots = minutes_to_slots(rule.min_on_minutes, resolution_minutes)
+    min_off_slots = minutes_to_slots(rule.min_off_minutes, resolution_minutes)
+    states = np.zeros(price_matrix.shape, dtype=bool)
+    previous_state, run_slots = False, None
+    for row, day_prices in enumerate(price_matrix.tolist()):
+        mask_key = (n, rule.startup_factor, row, previous_state)
+        if mask_key not in row_masks: row_masks[mask_key] = startup_cheapest_row(day_prices, n, rule.startup_factor, previous_state)
+        day_states = evaluate_pin(price_matrix[row], ~np.isnan(price_matrix[row]), row_masks[mask_key], float(rule.lower_limit_ct_kwh),
+                                  float(rule.upper_limit_ct_kwh), n, rule.hysteresis_ct_kwh, previous_state).tolist()
+        if rule.has_switching_limits():
+            day_states = limit_switching(day_states, [None if price != price else price for price in day_prices], min_on_slots, min_off_slots,
+                                         rule.max_toggles_per_day, previous_state, run_slots)
+        states[row] = day_states
+        previous_state, run_slots = bool(day_states[-1]), trailing_run_minutes(day_states, resolution_minutes) // resolution_minutes
+    return states.ravel()
+
+def run_backtest(settings_list, price_matrix, resolution_minutes=60):
+    """Ajaa kaikkien pinnien säännöt hintamatriisia vasten. Palauttaa listan tulosdictejä pinneittäin."""
+    prices = price_matrix.ravel()
+    valid = ~np.isnan(prices)
+    ranks = daily_ranks(price_matrix)
+    cheapest_masks, startup_rows = {}, {}
+    slot_hours = resolution_minutes / 60
+    results = []
+    for rule in settings_list:
+        n, startup_factor = cheapest_slot_count(rule.cheapest_hours_n, resolution_minutes), rule.startup_factor
+        if startup_factor > 1.0 and n > 0: states = startup_pin_states(price_matrix, rule, n, resolution_minutes, startup_rows)
+        else:
+            if n not in cheapest_masks: cheapest_masks[n] = (ranks < n).ravel()
+            states = evaluate_pin(prices, valid, cheapest_masks[n], float(rule.lower_limit_ct_kwh),
+                                   float(rule.upper_limit_ct_kwh), n, rule.hysteresis_ct_kwh)
+            if rule.has_switching_limits(): states = limit_daily(states, price_matrix, rule, resolution_minutes)
+        power_kw = rule.power_kw
+        on_hours = float(np.count_nonzero(states) * slot_hours)
+        energy_kwh = on_hours * power_kw
+        cost_eur = float(np.sum(prices[states])) * slot_hours * power_kw / 100
+        results.append({"identifier": rule.identifier, "on_hours": on_hours, "energy_kwh": energy_kwh, "cost_eur": cost_eur,
+                        "avg_ct_kwh": cost_eur * 100 / energy_kwh if energy_kwh else None,
+                        "toggles": int(np.count_nonzero(np.diff(states.view(np.int8))))})
+    return results
+
+# --- Itsenäinen ajo ---
+
+def main():
+    parser = argparse.ArgumentParser(description="Takautuva laskelma pinnien säännöille hintahistoriasta (NumPy).")
+    parser.add_argument("--from", dest="date_from", type=str, required=True, help="Alkupäivä (VVVV-KK-PP)")
+    parser.add_argument("--to", dest="date_to", type=str, help="Loppupäivä (VVVV-KK-PP, oletus tänään)")
+    parser.add_argument("--resolution", type=int, choices=(15, 60), default=60, help="Jakson pituus minuutteina (N on aina tunteja)")
+    args = parser.parse_args()
+    try:
+        start_date = datetime.date.fromisoformat(args.date_from)
+        end_date = datetime.date.fromisoformat(args.date_to) if args.date_to else datetime.date.today()
+    except ValueError: print("VIRHE: Päivämäärämuoto? Käytä VVVV-KK-PP.", file=sys.stderr); sys.exit(1)
+    if end_date < start_date: print("VIRHE: --to on ennen --from-päivää.", file=sys.stderr); sys.exit(1)
+    settings_list = pin_settings.load_settings(SETTINGS_FILE)
+    if not settings_list: print(f"VIRHE: Ei kelvollisia asetuksia tiedostossa '{os.path.abspath(SETTINGS_FILE)}'.", file=sys.stderr); sys.exit(1)
+
+    load_started = time.perf_counter()
+    days = load_price_days(start_date, end_date)
+    price_matrix = build_price_matrix(days, start_date, end_date, args.resolution)
+    load_seconds = time.perf_counter() - load_started
+    if not days: print(f"VIRHE: Hintahistoriaa ei löytynyt väliltä {start_date} - {end_date}. Aja: python3 price_archive.py --backfill --from {start_date}", file=sys.stderr); sys.exit(1)
+
+    eval_started = time.perf_counter()
+    results = run_backtest(settings_list, price_matrix, args.resolution)
+    eval_seconds = time.perf_counter() - eval_started
+
+    print("-" * 78)
+    print(f"Backtest {start_date.isoformat()} - {end_date.isoformat()}: {len(days)} päivää hinnoilla, "
+          f"{np.count_nonzero(~np.isnan(price_matrix))} jaksoa ({args.resolution} min)")
+    print("-" * 78)
+    print(f"{'Tunniste':<20}{'ON h':>10}{'kWh':>11}{'Kustannus €':>14}{'ka. ct/kWh':>12}{'Kytkennät':>11}")
+    for result in results:
+        avg_str = f"{result['avg_ct_kwh']:.2f}" if result['avg_ct_kwh'] is not None else "-"
+        print(f"{result['identifier']:<20}{result['on_hours']:>10.1f}{result['energy_kwh']:>11.1f}"
+              f"{result['cost_eur']:>14.2f}{avg_str:>12}{result['toggles']:>11}")
+    print("-" * 78)
+    print(f"Hintojen lataus {load_seconds * 1000:.0f} ms, sääntöjen laskenta {len(results)} pinnille {eval_seconds * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+benchmark.py
+
+Suorituskykytesti ohjauksen kuumalle polulle. Ajaa hourly_control.main()-
+kertaajon jokaiselle jaksolle (esim. vuosi tunti- tai 15 min jaksoja)
+virtuaalikellolla, muistissa olevalla GPIO:lla ja tallennetuilla hinnoilla
+1, 10 ja 100 pinnille, ja raportoi vaihekohtaiset ajat (asetukset,
+aikataulu/hinnat, päätös, GPIO-kirjoitus, tilavälimuisti, historia,
+JSON-status) sekä kokonaisajan.
+
+Lisäksi simulaattorin (simulate_schedule.simulate_day) tulosta verrataan
+ohjauksen tekemiin päätöksiin jakso jaksolta. Tulokset voi tallentaa
+vertailukohdaksi (--save-baseline); seuraavat ajot vertaavat jaksokohtaista
+aikaa siihen ja palauttavat virhekoodin, jos hidastuma ylittää --tolerance-
+rajan tai simulaattori ja ohjaus eroavat.
+
+Hinnat luetaan hinta-arkistosta (price_archive.py, oletuksena viimeiset
+--days arkistoitua päivää). Jos arkisto on tyhjä tai annetaan --synthetic,
+käytetään toistettavia synteettisiä hintoja. Ajo tehdään väliaikaisessa
+hakemistossa (HOME vaihdetaan ennen projektin moduulien latausta), joten
+oikeat datatiedostot ja GPIO-pinnit eivät muutu eikä verkkoa käytetä.
+
+Ajo: python3 benchmark.py [--pins 1,10,100] [--days 365] [--max-power-kw KW] [--save-baseline]
+"""
+
+import io
+import os
+import sys
+import json
+import math
+import time
+import types
+import random
+import shutil
+import datetime
+import argparse
+import tempfile
+import contextlib
+import functools
+from collections import defaultdict
+
+# --- Konfiguraatio ja Polut (oikea HOME, luetaan ennen HOME:n vaihtoa) ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REAL_DATA_DIR = os.path.expanduser('~/gpio_pricer_data')
+REAL_ARCHIVE_DIR = os.path.join(REAL_DATA_DIR, 'price_archive')
+BASELINE_FILE = os.path.join(REAL_DATA_DIR, 'benchmark_baseline.json')
+DEFAULT_TOLERANCE = 0.25   # Sallittu hidastuma vertailukohtaan nähden (25 %)
+SWITCHING_MAX_MS_PER_DAY = 20.0   # Kytkentärajoitusten (price_logic.limit_switching) yläraja ms/päivä
+SWITCHING_RULE = {"min_on_minutes": 120, "min_off_minutes": 60, "max_toggles_per_day": 6}
+
+PHASES = [("settings", "Asetukset"), ("price_lookup", "Aikataulu ja hinnat"), ("decision", "Päätös"),
+          ("gpio_write", "GPIO-kirjoitus"), ("pin_cache", "Tilavälimuisti"), ("history_write", "Historia"),
+          ("status_json", "JSON-status"), ("metrics", "Mittarit"),
+          ("spool_flush", "Puskurin tyhjennys"), ("other", "Muu")]
+
+# --- Virtuaalikello ja muistin GPIO ---
+
+class VirtualClock:
+    """Ajanhetki epoch-sekunteina; datetime_module() korvaa moduulien datetime.datetime.now- ja datetime.date.today-kutsut."""
+
+    def __init__(self, epoch=0.0):
+        self.epoch = epoch
+
+    def datetime_module(self):
+        """Palauttaa datetime-moduulin kaltaisen nimiavaruuden, jonka datetime.now() ja date.today() lukevat tätä kelloa."""
+        clock = self
+        class VirtualDatetime(datetime.datetime):
+            @classmethod
+            def now(cls, tz=None): return datetime.datetime.fromtimestamp(clock.epoch, tz)
+        class VirtualDate(datetime.date):
+            @classmethod
+            def today(cls): return datetime.date.fromtimestamp(clock.epoch)
+        return types.SimpleNamespace(datetime=VirtualDatetime, date=VirtualDate, time=datetime.time,
+                                     timedelta=datetime.timedelta, timezone=datetime.timezone)
+
+# --- Vaiheajastin ---
+
+class PhaseTimer:
+    """Mittaa käärittyjen funktioiden ajat vaiheittain. Sisäkkäisen vaiheen aika vähennetään ulommasta."""
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self._stack = []
+
+    def wrap(self, owner, name, phase):
+        original = getattr(owner, name)
+        timer = self
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            timer._stack.append(0.0)
+            started = time.perf_counter()
+            try: return original(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                timer.totals[phase] += elapsed - timer._stack.pop()
+                if timer._stack: timer._stack[-1] += elapsed
+        setattr(owner, name, timed)
+        return original
+
+    def reset(self):
+        self.totals.clear()
+
+# --- Hinnat ja asetukset ---
+
+def synthetic_days(start_date, day_count, resolution_minutes, local_tz):
+    """Toistettavat synteettiset hinnat (vuorokausi- ja vuodenaikavaihtelu + kohina). Palauttaa {päivä: DayPrices}."""
+    from price_slots import DayPrices
+    rng = random.Random(42)
+    days = {}
+    for offset in range(day_count):
+        day = start_date + datetime.timedelta(days=offset)
+        day_prices = DayPrices.empty(day, local_tz, resolution_minutes)
+        season = 1.0 + 0.5 * math.cos(2 * math.pi * day.timetuple().tm_yday / 365.0)
+        for index in range(len(day_prices)):
+            hour = (index * resolution_minutes / 60.0) % 24
+            daily = 4.0 + 6.0 * max(0.0, math.sin(math.pi * (hour - 6) / 14.0))
+            day_prices.prices[index] = round(season * daily + rng.gauss(0, 2.0), 3)
+        days[day] = day_prices
+    return days
+
+def recorded_days(start_date, end_date, local_tz):
+    """Hinta-arkiston päivät väliltä DayPrices-muodossa. Palauttaa {päivä: DayPrices}."""
+    import price_archive
+    return {datetime.date.fromisoformat(day_str): day_prices
+            for day_str, day_prices in price_archive.load_days(start_date, end_date, REAL_ARCHIVE_DIR, local_tz).items() if day_prices.valid_count()}
+
+def make_settings(pin_count, seed=1):
+    """Satunnaiset mutta toistettavat pinnien asetukset (pin_settings.py:n rajoissa)."""
+    rng = random.Random(seed)
+    settings_list = []
+    for i in range(pin_count):
+        lower = rng.randint(0, 6)
+        settings_list.append({"gpio_pin": 2 + i, "identifier": f"Pinni_{i + 1:03d}", "lower_limit_ct_kwh": lower,
+                              "upper_limit_ct_kwh": lower + rng.randint(1, 15), "cheapest_hours_n": rng.randint(0, 12),
+                              "hysteresis_ct_kwh": rng.choice([0, 0, 0.5, 1.0]), "startup_factor": rng.choice([1.0, 1.0, 1.5])})
+        if rng.random() < 0.3:   # Osalle pinneistä vähimmäisajat ja kytkentäbudjetti (price_logic.limit_switching)
+            settings_list[-1].update(min_on_minutes=rng.choice([0, 60, 120]), min_off_minutes=rng.choice([0, 60]), max_toggles_per_day=rng.choice([None, 4, 8]))
+        settings_list[-1].update(power_kw=rng.choice([0.5, 1.0, 2.0, 3.0]), priority=rng.choice([0, 0, 1, 2]))
+    return settings_list
+
+def recorded_fetch(price_days):
+    """Korvaa price_cache.fetch_prices_bulk-funktion: palauttaa alkupäivän ja seuraavan päivän hinnat tallenteesta."""
+    from price_slots import PriceSeries
+    def fetch_prices_bulk(start_date, local_tz, api_url=None, timeout=None):
+        series = PriceSeries()
+        for day in (start_date, start_date + datetime.timedelta(days=1)):
+            day_prices = price_days.get(day)
+            if day_prices is None: continue
+            for index in range(len(day_prices)):
+                price = day_prices.price(index)
+                if price is not None: series.append(day_prices.slot_start_epoch(index), price)
+        return series
+    return fetch_prices_bulk
+
+# --- Ajo ---
+
+def run_live(modules, price_days, settings_list, clock, timer, data_dir):
+    """
+    Ajaa hourly_control.main()-kertaajon jokaisen päivän jokaiselle jaksolle.
+    Palauttaa ({(päivä, jakso): {tunniste: tila}}, ajojen määrä, kokonaisaika s).
+    """
+    hourly_control = modules['hourly_control']
+    shutil.rmtree(data_dir, ignore_errors=True); os.makedirs(data_dir)
+    hourly_control._gpio_backend = None
+    shutil.rmtree(hourly_control.io_spool.get_spool().spool_dir, ignore_errors=True)
+    hourly_control.io_spool._spool = None
+    with open(hourly_control.SETTINGS_FILE, 'w', encoding='utf-8') as f: json.dump(settings_list, f)
+    live_states, captured = {}, {}
+    original_decide = hourly_control.decide_states
+    def capture_decide(*args, **kwargs):
+        decisions, slot_info = original_decide(*args, **kwargs)
+        captured['decisions'] = decisions
+        return decisions, slot_info
+    hourly_control.decide_states = capture_decide
+    timer.reset()
+    runs, total = 0, 0.0
+    try:
+        for day in sorted(price_days):
+            day_prices = price_days[day]
+            for index in range(len(day_prices)):
+                clock.epoch = day_prices.slot_start_epoch(index) + 1
+                started = time.perf_counter()
+                hourly_control.main()
+                total += time.perf_counter() - started
+                live_states[(day, index)] = {identifier: state for identifier, _pin, state, _reason in captured.get('decisions', [])}
+                runs += 1
+    finally: hourly_control.decide_states = original_decide
+    return live_states, runs, total
+
+def run_simulator(modules, price_days, settings_list, local_tz):
+    """Simuloi samat päivät simulate_schedule.simulate_day-funktiolla. Palauttaa ({(päivä, jakso): {tunniste: tila}}, aika s)."""
+    simulate_schedule = modules['simulate_schedule']
+    rules, _warnings = modules['pin_settings'].compile_settings(settings_list)
+    sim_states, last_states, last_runs, previous_day = {}, {}, {}, None
+    started = time.perf_counter()
+    for day in sorted(price_days):
+        if previous_day is None or day - previous_day != datetime.timedelta(days=1): last_states, last_runs = {}, {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            schedule, slot_labels = simulate_schedule.simulate_day(rules, price_days[day], local_tz, last_states, last_runs,
+                                                                   modules['schedule_builder'].site_max_power_kw())
+        for index in range(len(slot_labels)):
+            sim_states[(day, index)] = {identifier: bool(states.get(index)) for identifier, states in schedule.items()}
+        last_states, last_runs = simulate_schedule.carry_over(schedule, len(slot_labels), price_days[day].resolution_minutes)
+        previous_day = day
+    return sim_states, time.perf_counter() - started
+
+def run_switching(price_days):
+    """
+    Ajaa price_logic.limit_switching-funktion jokaiselle päivälle raskaimmalla tapauksella: toive on
+    jokainen päivän mediaania halvempi jakso (paljon lyhyitä ON-jaksoja) ja rajoitukset SWITCHING_RULE.
+    Tila jatkuu päivästä toiseen. Palauttaa (päivien määrä, kokonaisaika s).
+    """
+    import price_logic
+    price_logic._switch_cache.clear()
+    state, run_slots, total = False, None, 0.0
+    for day in sorted(price_days):
+        day_prices = price_days[day]
+        prices = [day_prices.price(index) for index in range(len(day_prices))]
+        known = sorted(price for price in prices if price is not None)
+        median = known[len(known) // 2] if known else 0.0
+        desired = [price is not None and price < median for price in prices]
+        min_on_slots = price_logic.minutes_to_slots(SWITCHING_RULE['min_on_minutes'], day_prices.resolution_minutes)
+        min_off_slots = price_logic.minutes_to_slots(SWITCHING_RULE['min_off_minutes'], day_prices.resolution_minutes)
+        started = time.perf_counter()
+        states = price_logic.limit_switching(desired, prices, min_on_slots, min_off_slots, SWITCHING_RULE['max_toggles_per_day'], state, run_slots)
+        total += time.perf_counter() - started
+        if states: state, run_slots = states[-1], price_logic.trailing_run_minutes(states, day_prices.resolution_minutes) // day_prices.resolution_minutes
+    return len(price_days), total
+
+def compare_states(live_states, sim_states):
+    """Palauttaa listan eroista (päivä, jakso, tunniste, ohjaus, simulaattori)."""
+    mismatches = []
+    for key in sorted(live_states):
+        sim_slot = sim_states.get(key, {})
+        for identifier, state in sorted(live_states[key].items()):
+            if bool(state) != sim_slot.get(identifier, False): mismatches.append((key[0], key[1], identifier, state, sim_slot.get(identifier)))
+    return mismatches
+
+def load_modules(temp_home):
+    """Vaihtaa HOME:n väliaikaiseen hakemistoon, valitsee muistissa toimivan GPIO-ajurin ja lataa projektin moduulit virtuaalikellolla."""
+    os.environ['HOME'] = temp_home
+    import logging
+    import app_config
+    app_config.CONFIG['gpio_backend'] = 'memory'
+    # Kirjoituspuskuri RAM-levylle kuten oikeassa ajossa (data-hakemisto on levyllä)
+    spool_parent = '/dev/shm' if os.path.isdir('/dev/shm') else temp_home
+    app_config.CONFIG['spool_dir'] = tempfile.mkdtemp(prefix='gpio_benchmark_spool_', dir=spool_parent)
+    import hourly_control, schedule_builder, price_cache, simulate_schedule, metrics, pin_settings
+    metrics.METRICS_PROM_FILE = os.path.join(temp_home, 'gpio_pricer_data', 'gpio_vasalli.prom')
+    logging.disable(logging.INFO)
+    clock = VirtualClock()
+    virtual_datetime = clock.datetime_module()
+    for module in (hourly_control, schedule_builder, price_cache): module.datetime = virtual_datetime
+    hourly_control.SETTINGS_FILE = os.path.join(temp_home, 'settings.json')
+    schedule_builder.load_overrides = lambda target_date, override_file=None: {}
+    return {'hourly_control': hourly_control, 'schedule_builder': schedule_builder, 'price_cache': price_cache,
+            'simulate_schedule': simulate_schedule, 'pin_settings': pin_settings}, clock
+
+def install_timers(modules, timer):
+    """Käärii ohjauksen vaiheet ajastimeen."""
+    hourly_control = modules['hourly_control']
+    timer.wrap(hourly_control, 'load_settings', 'settings')
+    timer.wrap(hourly_control, 'get_day_schedule', 'price_lookup')
+    timer.wrap(hourly_control, 'decide_states', 'decision')
+    timer.wrap(hourly_control, 'set_gpio_states', 'gpio_write')
+    timer.wrap(hourly_control.PinStateCache, 'save', 'pin_cache')
+    timer.wrap(hourly_control.io_spool.WriteSpool, 'append_history', 'history_write')
+    timer.wrap(hourly_control.io_spool.WriteSpool, 'flush', 'spool_flush')
+    timer.wrap(hourly_control, 'write_run_outputs', 'status_json')
+    timer.wrap(hourly_control.metrics, 'write_outputs', 'metrics')
+
+# --- Vertailukohta ---
+
+def load_baseline(baseline_file=BASELINE_FILE):
+    try:
+        with open(baseline_file, 'r', encoding='utf-8') as f: return json.load(f)
+    except (OSError, ValueError): return None
+
+def save_baseline(results, baseline_file=BASELINE_FILE):
+    os.makedirs(os.path.dirname(baseline_file), exist_ok=True)
+    tmp_path = f"{baseline_file}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(results, f, indent=2, ensure_ascii=False, sort_keys=True)
+    os.replace(tmp_path, baseline_file)
+
+def find_regressions(results, baseline, tolerance):
+    """Palauttaa listan (pinnimäärä, nykyinen ms/jakso, vertailu ms/jakso) hidastuneista ajoista; kytkentärajoituksilla ms/päivä."""
+    regressions = []
+    for pin_count, result in results['runs'].items():
+        reference = (baseline or {}).get('runs', {}).get(pin_count)
+        if reference and result['per_slot_ms'] > reference['per_slot_ms'] * (1 + tolerance):
+            regressions.append((pin_count, result['per_slot_ms'], reference['per_slot_ms']))
+    current, reference = results.get('switching'), (baseline or {}).get('switching')
+    if current and reference and current['per_day_ms'] > reference['per_day_ms'] * (1 + tolerance):
+        regressions.append(("kytkentärajoitukset", current['per_day_ms'], reference['per_day_ms']))
+    return regressions
+
+# --- Itsenäinen ajo ---
+
+def main():
+    parser = argparse.ArgumentParser(description="Ohjauksen suorituskykytesti virtuaalikellolla ja muistin GPIO:lla.")
+    parser.add_argument("--pins", type=str, default="1,10,100", help="Pinnimäärät pilkulla eroteltuna")
+    parser.add_argument("--days", type=int, default=365, help="Montako päivää ajetaan")
+    parser.add_argument("--from", dest="date_from", type=str, help="Alkupäivä (VVVV-KK-PP, oletus arkiston viimeiset --days päivää)")
+    parser.add_argument("--synthetic", action="store_true", help="Käytä synteettisiä hintoja arkiston sijaan")
+    parser.add_argument("--resolution", type=int, choices=(15, 60), default=15, help="Synteettisten hintojen jakso (min)")
+    parser.add_argument("--max-power-kw", type=float, default=0.0, help="Sivuston tehoraja kW (0 = ei rajaa)")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Sallittu hidastuma vertailukohtaan (osuus)")
+    parser.add_argument("--save-baseline", action="store_true", help=f"Tallenna tulokset vertailukohdaksi ({BASELINE_FILE})")
+    args = parser.parse_args()
+    try: pin_counts = [int(value) for value in args.pins.split(',') if value.strip()]
+    except ValueError: print("VIRHE: --pins on lista kokonaislukuja, esim. 1,10,100.", file=sys.stderr); sys.exit(1)
+
+    temp_home = tempfile.mkdtemp(prefix='gpio_benchmark_')
+    try:
+        modules, clock = load_modules(temp_home)
+        import app_config
+        app_config.CONFIG['max_power_kw'] = args.max_power_kw
+        local_tz = modules['price_cache'].ZoneInfo(modules['price_cache'].LOCAL_TIMEZONE_STR)
+        price_days, source = {}, "synteettinen"
+        if not args.synthetic:
+            import price_archive
+            _first, last, count = price_archive.archived_range(REAL_ARCHIVE_DIR)
+            if count:
+                start_date = datetime.date.fromisoformat(args.date_from) if args.date_from else datetime.date.fromisoformat(last) - datetime.timedelta(days=args.days - 1)
+                price_days = recorded_days(start_date, start_date + datetime.timedelta(days=args.days - 1), local_tz)
+                source = f"hinta-arkisto {start_date.isoformat()} -"
+        if not price_days:
+            start_date = datetime.date.fromisoformat(args.date_from) if args.date_from else datetime.date(2025, 1, 1)
+            price_days = synthetic_days(start_date, args.days, args.resolution, local_tz)
+        modules['price_cache'].fetch_prices_bulk = recorded_fetch(price_days)
+        slot_count = sum(len(day_prices) for day_prices in price_days.values())
+        print(f"Hinnat: {source} ({len(price_days)} päivää, {slot_count} jaksoa)")
+
+        timer = PhaseTimer()
+        install_timers(modules, timer)
+        results = {"created": datetime.datetime.now().isoformat(timespec='seconds'), "days": len(price_days), "slots": slot_count,
+                   "source": source, "runs": {}}
+        exit_code = 0
+        for pin_count in pin_counts:
+            settings_list = make_settings(pin_count)
+            live_states, runs, total = run_live(modules, price_days, settings_list, clock, timer, os.path.join(temp_home, 'gpio_pricer_data'))
+            sim_states, sim_seconds = run_simulator(modules, price_days, settings_list, local_tz)
+            mismatches = compare_states(live_states, sim_states)
+            memory_gpio = modules['hourly_control']._gpio_backend
+            phases = dict(timer.totals)
+            phases['other'] = max(0.0, total - sum(phases.values()))
+            results['runs'][str(pin_count)] = {"total_s": round(total, 4), "per_slot_ms": round(total / runs * 1000, 4) if runs else 0.0,
+                                               "phases_s": {key: round(phases.get(key, 0.0), 4) for key, _label in PHASES},
+                                               "simulator_s": round(sim_seconds, 4), "gpio_writes": memory_gpio.writes,
+                                               "gpio_operations": memory_gpio.operations, "mismatches": len(mismatches)}
+            print("-" * 60)
+            print(f"{pin_count} pinniä: {runs} ajoa, yhteensä {total:.2f} s ({total / runs * 1000:.3f} ms/jakso), GPIO-kirjoituksia {memory_gpio.writes} ({memory_gpio.operations} erässä)")
+            for key, label in PHASES:
+                seconds = phases.get(key, 0.0)
+                print(f"  {label:<22} {seconds:>8.3f} s  {seconds / runs * 1000:>8.3f} ms/jakso  {seconds / total * 100 if total else 0:>5.1f} %")
+            print(f"  Simulaattori (sama jakso)  {sim_seconds:.3f} s")
+            if mismatches:
+                exit_code = 1
+                print(f"  VIRHE: simulaattori ja ohjaus eroavat {len(mismatches)} kohdassa, esim.:")
+                for day, index, identifier, live_state, sim_state in mismatches[:5]: print(f"    {day.isoformat()} jakso {index} {identifier}: ohjaus {live_state}, simulaattori {sim_state}")
+            else: print("  Simulaattori ja ohjaus täsmäävät jakso jaksolta.")
+        days, switching_seconds = run_switching(price_days)
+        per_day_ms = switching_seconds / days * 1000 if days else 0.0
+        results['switching'] = {"total_s": round(switching_seconds, 4), "per_day_ms": round(per_day_ms, 4)}
+        print("-" * 60)
+        print(f"Kytkentärajoitukset (limit_switching, {SWITCHING_RULE}): {days} päivää, {switching_seconds:.3f} s ({per_day_ms:.3f} ms/päivä)")
+        if per_day_ms > SWITCHING_MAX_MS_PER_DAY:
+            exit_code = 1
+            print(f"REGRESSIO: kytkentärajoitukset {per_day_ms:.3f} ms/päivä, raja {SWITCHING_MAX_MS_PER_DAY:.0f} ms/päivä")
+        print("-" * 60)
+
+        baseline = load_baseline()
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for pin_count, current, reference in regressions:
+            exit_code = 1
+            unit = "ms/jakso" if isinstance(pin_count, str) and pin_count.isdigit() else "ms/päivä"
+            label = f"{pin_count} pinniä" if unit == "ms/jakso" else pin_count
+            print(f"REGRESSIO: {label} {current:.3f} {unit}, vertailukohta {reference:.3f} {unit} (raja +{args.tolerance * 100:.0f} %)")
+        if baseline and not regressions: print(f"Ei hidastumia vertailukohtaan ({baseline.get('created')}) nähden.")
+        if args.save_baseline: save_baseline(results); print(f"Vertailukohta tallennettu: {BASELINE_FILE}")
+    finally:
+        if 'modules' in locals(): shutil.rmtree(modules['hourly_control'].io_spool.get_spool().spool_dir, ignore_errors=True)
+        shutil.rmtree(temp_home, ignore_errors=True)
+    sys.exit(exit_code)
+
+if __name__ == "__main__":
+    main()
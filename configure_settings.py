@@ -12,6 +12,7 @@ skriptin omaan ajohakemistoon. Käyttää kokonaislukuja hintarajoille (ct/kWh).
 import json
 import os
 import sys
+import pin_settings
 
 # --- Konfiguraatio ja Polut ---
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__)) 
@@ -20,43 +21,15 @@ SETTINGS_FILE = os.path.join(SCRIPT_DIR, 'settings.json')
 # --- Funktiot ---
 
 def load_settings():
-    """Lataa asetukset JSON-tiedostosta dictionaryyn {pin_numero: asetukset}."""
+    """Lataa asetukset dictionaryyn {pin_numero: asetukset} (validointi pin_settings.py:ssä, sama kuin ohjauksessa)."""
     settings_path = os.path.abspath(SETTINGS_FILE) 
     if not os.path.exists(settings_path): print(f"Asetustiedostoa '{settings_path}' ei löytynyt."); return {} 
     print(f"Ladataan asetukset tiedostosta: {settings_path}")
-    # ...(Latauslogiikka sama kuin hourly_control.py:ssä, varmistaa kokonaisluvut)...
-    try:
-        with open(settings_path, 'r', encoding='utf-8') as f:
-            settings_list = json.load(f)
-            if not isinstance(settings_list, list): print(f"VAROITUS: Tiedosto '{settings_path}' ei sisältänyt listaa."); return {}
-            settings_dict = {}
-            valid_pins_found = 0
-            for i, item in enumerate(settings_list):
-                if isinstance(item, dict) and 'gpio_pin' in item:
-                    pin_num = item['gpio_pin']
-                    try:
-                        pin_num_int = int(pin_num); assert pin_num_int > 0
-                        upper_limit = int(item['upper_limit_ct_kwh']); assert upper_limit >= 0
-                        lower_limit = int(item['lower_limit_ct_kwh']); assert lower_limit >= 0
-                        n_value = int(item['cheapest_hours_n']); assert 0 <= n_value <= 12
-                        assert lower_limit <= upper_limit
-                        
-                        item['gpio_pin'] = pin_num_int
-                        item['upper_limit_ct_kwh'] = upper_limit
-                        item['lower_limit_ct_kwh'] = lower_limit
-                        item['cheapest_hours_n'] = n_value
-
-                        if 'identifier' not in item or not item['identifier']: item['identifier'] = f"Pin_{pin_num_int}"
-                        settings_dict[pin_num_int] = item
-                        valid_pins_found += 1
-                    except (ValueError, TypeError, KeyError, AssertionError) as e: print(f"VAROITUS: Ohitetaan virheellinen asetusrivi {i+1}: {item}, Virhe: {e}")
-                else: print(f"VAROITUS: Ohitetaan virheellinen asetusrivi {i+1}: {item}")
-            if valid_pins_found > 0: print(f"Ladattu {valid_pins_found} pinnin asetukset.")
-            else: print("Asetustiedosto tyhjä/ei kelvollisia asetuksia.")
-            return settings_dict
-    except json.JSONDecodeError: print(f"VIRHE: Asetustiedosto '{settings_path}' virheellinen."); return None 
-    except IOError as e: print(f"VIRHE: Asetustiedoston luku epäonnistui: {e}"); return None
-    except Exception as e: print(f"VIRHE: Odottamaton virhe: {e}"); return None
+    rules = pin_settings.load_settings(settings_path)
+    if rules is None: print(f"VIRHE: Asetustiedosto '{settings_path}' virheellinen."); return None
+    if rules: print(f"Ladattu {len(rules)} pinnin asetukset.")
+    else: print("Asetustiedosto tyhjä/ei kelvollisia asetuksia.")
+    return {rule.gpio_pin: rule.to_dict() for rule in rules}
 
 def save_settings(settings_dict):
     """Tallentaa asetukset JSON-tiedostoon."""
@@ -69,6 +42,11 @@ def save_settings(settings_dict):
         return True
     except Exception as e: print(f"VIRHE: Tallennus epäonnistui: {e}"); return False
 
+def _is_non_negative(value):
+    """Onko arvo luku >= 0 (tyhjä tai None ei ole)."""
+    try: return float(value) >= 0
+    except (ValueError, TypeError): return False
+
 def get_validated_input(prompt, default=None, value_type=str, condition=None, error_msg="Virheellinen syöte.", allow_empty=False):
     """Kysyy käyttäjältä syötettä, validoi sen ja käyttää oletusarvoa tarvittaessa."""
     # ...(sisältö sama kuin edellisessä versiossa)...
@@ -108,7 +86,7 @@ def display_settings(settings_dict):
     sorted_pins = sorted(settings_dict.keys())
     for pin_num in sorted_pins:
         setting = settings_dict[pin_num]
-        print(f" Pin {pin_num}:\n  Tunniste: {setting.get('identifier', 'N/A')}\n  Yläraja: {setting.get('upper_limit_ct_kwh', 'N/A')} ct/kWh\n  Alaraja: {setting.get('lower_limit_ct_kwh', 'N/A')} ct/kWh\n  N (halvimmat): {setting.get('cheapest_hours_n', 'N/A')} (0-12)\n" + "-" * 20)
+        print(f" Pin {pin_num}:\n  Tunniste: {setting.get('identifier', 'N/A')}\n  Yläraja: {setting.get('upper_limit_ct_kwh', 'N/A')} ct/kWh\n  Alaraja: {setting.get('lower_limit_ct_kwh', 'N/A')} ct/kWh\n  N (halvimmat): {setting.get('cheapest_hours_n', 'N/A')} (0-{pin_settings.MAX_CHEAPEST_HOURS_N})\n  Hystereesi: {setting.get('hysteresis_ct_kwh', 0)} ct/kWh\n  Käynnistyskerroin: {setting.get('startup_factor', 1.0)}\n  Teho: {setting.get('power_kw', pin_settings.DEFAULT_POWER_KW)} kW (prioriteetti {setting.get('priority', pin_settings.DEFAULT_PRIORITY)})\n  Vähimmäisajat ON/OFF: {setting.get('min_on_minutes', 0)}/{setting.get('min_off_minutes', 0)} min\n  Kytkentöjä enintään: {setting.get('max_toggles_per_day') if setting.get('max_toggles_per_day') is not None else 'ei rajaa'} /vrk\n  Käynnistysvirta: {str(setting.get('inrush_seconds')) + ' s' if setting.get('inrush_seconds') is not None else 'oletus'}\n" + "-" * 20)
 
 # ===== MUUTETUT FUNKTIOT: edit_or_add_pin & delete_pin =====
 def edit_or_add_pin(settings_dict):
@@ -129,30 +107,67 @@ def edit_or_add_pin(settings_dict):
         f"Anna hinnan yläraja (kokonaisluku, senttiä/kWh)",
         default=existing_setting.get('upper_limit_ct_kwh'), # Oletus voi olla vielä vanha float, int() hoitaa
         value_type=int,
-        condition=lambda x: x >= 0, 
-        error_msg="Rajahinnan tulee olla 0 tai positiivinen kokonaisluku."
+        error_msg="Rajahinnan tulee olla kokonaisluku (negatiivinen sallittu)."
     )
 
     lower_limit_int = get_validated_input(
         f"Anna hinnan alaraja (kokonaisluku, senttiä/kWh)",
         default=existing_setting.get('lower_limit_ct_kwh'), 
         value_type=int,
-        condition=lambda x: x >= 0 and x <= upper_limit_int, # Vertailu kokonaislukuihin
-        error_msg=f"Alarajan tulee olla >= 0 ja <= {upper_limit_int}."
+        condition=lambda x: x <= upper_limit_int, # Vertailu kokonaislukuihin
+        error_msg=f"Alarajan tulee olla <= {upper_limit_int}."
     )
     # --- MUUTOS LOPPUU ---
 
     print(f"\nHalvimpien tuntien ohjaus (N) aktivoituu, kun hinta on välillä ({lower_limit_int} - {upper_limit_int}] ct/kWh.")
-    print("HUOM: API tukee N arvoja vain välillä 1-12. N=0 ei käytä tätä toimintoa.")
+    print("HUOM: API-varapolku tukee N arvoja vain välillä 1-12 (aikataulu 0-24). N=0 ei käytä tätä toimintoa.")
+    max_n = pin_settings.MAX_CHEAPEST_HOURS_N
     cheapest_hours_n = get_validated_input( f"Anna N (halvimpien tuntien määrä)",
         default=existing_setting.get('cheapest_hours_n', 0), value_type=int,
-        condition=lambda x: 0 <= x <= 12, error_msg="Anna luku väliltä 0-12 (API-rajoitus)." )
+        condition=lambda x: 0 <= x <= max_n, error_msg=f"Anna luku väliltä 0-{max_n}." )
     
-    settings_dict[gpio_pin] = { "gpio_pin": gpio_pin, "identifier": identifier,
+    hysteresis = get_validated_input( "Anna hystereesi (ct/kWh, 0 = ei käytössä)",
+        default=existing_setting.get('hysteresis_ct_kwh', 0), value_type=float,
+        condition=lambda x: x >= 0, error_msg="Hystereesin tulee olla 0 tai positiivinen." )
+    startup_factor = get_validated_input( "Anna käynnistyskerroin (1.0 = ei käynnistyskustannusta, esim. 1.5 kompressorille)",
+        default=existing_setting.get('startup_factor', 1.0), value_type=float,
+        condition=lambda x: x >= 1.0, error_msg="Käynnistyskertoimen tulee olla vähintään 1.0." )
+    power_kw = get_validated_input( "Anna kuorman teho (kW, kustannusraportteja varten)",
+        default=existing_setting.get('power_kw', pin_settings.DEFAULT_POWER_KW), value_type=float,
+        condition=lambda x: x >= 0, error_msg="Tehon tulee olla 0 tai positiivinen." )
+    priority = get_validated_input( "Anna prioriteetti (kokonaisluku, suurempi saa tehorajan alla jaksot ensin ja kytketään ensin)",
+        default=existing_setting.get('priority', pin_settings.DEFAULT_PRIORITY), value_type=int,
+        error_msg="Prioriteetin tulee olla kokonaisluku." )
+    inrush = get_validated_input( "Anna käynnistysvirran kesto (s, kytkentäsarjan porrastukseen, tyhjä = config.json:n oletus)",
+        default=existing_setting.get('inrush_seconds'), value_type=str, allow_empty=True,
+        condition=lambda x: x == "" or _is_non_negative(x), error_msg="Anna 0 tai positiivinen luku, tai jätä tyhjäksi." )
+    inrush_seconds = float(inrush) if _is_non_negative(inrush) else None
+    min_on_minutes = get_validated_input( "Anna vähimmäispäälläoloaika (min, 0 = ei rajaa)",
+        default=existing_setting.get('min_on_minutes', 0), value_type=int,
+        condition=lambda x: x >= 0, error_msg="Ajan tulee olla 0 tai positiivinen kokonaisluku." )
+    min_off_minutes = get_validated_input( "Anna vähimmäistaukoaika (min, 0 = ei rajaa)",
+        default=existing_setting.get('min_off_minutes', 0), value_type=int,
+        condition=lambda x: x >= 0, error_msg="Ajan tulee olla 0 tai positiivinen kokonaisluku." )
+    max_toggles = get_validated_input( "Anna kytkentöjen enimmäismäärä vuorokaudessa (tyhjä = ei rajaa)",
+        default=existing_setting.get('max_toggles_per_day'), value_type=str, allow_empty=True,
+        condition=lambda x: x == "" or x.isdigit(), error_msg="Anna 0 tai positiivinen kokonaisluku, tai jätä tyhjäksi." )
+    max_toggles_per_day = int(max_toggles) if str(max_toggles).isdigit() else None
+
+    # Säilytetään muut (valinnaiset) avaimet
+    settings_dict[gpio_pin] = dict(existing_setting, **{ "gpio_pin": gpio_pin, "identifier": identifier,
         # Tallennetaan kokonaislukuina
         "upper_limit_ct_kwh": upper_limit_int, 
         "lower_limit_ct_kwh": lower_limit_int,
-        "cheapest_hours_n": cheapest_hours_n }
+        "cheapest_hours_n": cheapest_hours_n,
+        "hysteresis_ct_kwh": hysteresis,
+        "startup_factor": startup_factor,
+        "power_kw": power_kw,
+        "priority": priority,
+        "min_on_minutes": min_on_minutes,
+        "min_off_minutes": min_off_minutes })
+    for key, value in (('max_toggles_per_day', max_toggles_per_day), ('inrush_seconds', inrush_seconds)):
+        if value is None: settings_dict[gpio_pin].pop(key, None)
+        else: settings_dict[gpio_pin][key] = value
     print(f"Pinnin {gpio_pin} ({identifier}) tiedot päivitetty muistiin.")
 
 def delete_pin(settings_dict):
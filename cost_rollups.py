@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+cost_rollups.py
+
+Pinnikohtaiset kustannus- ja energiakoosteet tilahistoriasta (history_store.py)
+ja hinnoista (price_cache.py, vanhemmat päivät price_archive.py).
+
+Historiassa on jokaisen ajon tila jokaiselle pinnille. Pinnin tila on voimassa
+omasta tietueestaan saman pinnin seuraavaan tietueeseen asti, kuitenkin enintään
+MAX_INTERVAL_SECONDS, jottei ohjauksen katko kasvata ON-aikaa. ON-jaksot jaetaan
+hintajaksoille ja lisätään koosteisiin:
+
+* päivä- ja kuukausikoosteet (paikallinen aika): cost_rollups/VVVV-KK.json
+* pinnien kokonaissummat, historian lukukohta ja avoimet jaksot: cost_rollups/state.json
+
+Kustakin koosteesta tallennetaan ON-sekunnit, hinnoitellut ON-sekunnit,
+hinta × sekunnit (ON-ajan keskihintaa varten), kWh ja kustannus (ct).
+Päivitys on lisäävä: HistoryStore.read_since lukee vain edellisen päivityksen
+jälkeen lisätyt tietueet, ja vain muuttuneet kuukausitiedostot kirjoitetaan.
+Raportit lukevat pelkät koosteet, joten ne eivät hidastu historian kasvaessa.
+
+Teho luetaan asetuksen power_kw-arvosta (pin_settings.py, oletus 1,0 kW) silloin,
+kun jakso lisätään koosteisiin. Tehon muutoksen jälkeen vanhat koosteet voi
+laskea uudelleen: python3 cost_rollups.py --rebuild.
+
+Ohjausajo (hourly_control.py) päivittää koosteet, kun historia on kirjoitettu
+pysyvään tallennukseen (kirjoituspuskurin tyhjennys, io_spool.py). Pinnin
+viimeisin tila lasketaan mukaan vasta seuraavan tietueen myötä.
+
+Ajo: python3 cost_rollups.py [--month VVVV-KK] [--daily] [--pins] [--rebuild]
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import shutil
+import sys
+import pin_settings
+import price_archive
+import price_cache
+from history_store import HistoryStore, HISTORY_DIR
+from price_slots import local_day_bounds_utc
+from price_cache import DATA_DIR, LOCAL_TIMEZONE_STR, ZoneInfo
+
+# --- Konfiguraatio ja Polut ---
+ROLLUP_DIR = os.path.join(DATA_DIR, 'cost_rollups')
+STATE_NAME = 'state.json'
+STATE_VERSION = 1
+MAX_INTERVAL_SECONDS = 2 * 3600   # Tila on voimassa enintään näin kauan ilman uutta tietuetta
+ON_S, PRICED_S, PRICE_S, KWH, COST_CT = range(5)   # Koosteen kentät (ks. moduulin kuvaus)
+
+# --- Hinnat ---
+
+class PriceDays:
+    """Päivien hinnat (DayPrices) hintavälimuistista tai hinta-arkistosta. Tiedostot luetaan vasta tarvittaessa ja kerran."""
+
+    def __init__(self, local_tz):
+        self.local_tz = local_tz
+        self.cache = None
+        self.days = {}
+        self.archive_years = {}
+
+    def get(self, target_date):
+        """Palauttaa päivän DayPrices-taulukon tai None, jos hintoja ei ole."""
+        if target_date in self.days: return self.days[target_date]
+        if self.cache is None: self.cache = price_cache.load_cache()
+        day_prices = price_cache.get_day(self.cache, target_date, self.local_tz)
+        if day_prices is None:
+            year = target_date.year
+            if year not in self.archive_years:
+                self.archive_years[year] = price_archive.load_days(datetime.date(year, 1, 1), datetime.date(year, 12, 31), local_tz=self.local_tz)
+            day_prices = self.archive_years[year].get(target_date.isoformat())
+        self.days[target_date] = day_prices
+        return day_prices
+
+def split_interval(start_epoch, end_epoch, price_days, local_tz):
+    """Jakaa ON-jakson [start, end) hintajaksoille. Palauttaa generaattorin (paikallinen päivä, sekunnit, hinta tai None)."""
+    epoch = start_epoch
+    while epoch < end_epoch:
+        local_date = datetime.datetime.fromtimestamp(epoch, local_tz).date()
+        day_prices = price_days.get(local_date)
+        index = day_prices.index_at(epoch) if day_prices is not None else None
+        if index is None:
+            _, day_end = local_day_bounds_utc(local_date, local_tz)
+            piece_end, price = min(end_epoch, int(day_end.timestamp())), None
+        else:
+            piece_end, price = min(end_epoch, day_prices.slot_start_epoch(index) + day_prices.slot_seconds), day_prices.price(index)
+        yield local_date, piece_end - epoch, price
+        epoch = piece_end
+
+# --- Koosteet ---
+
+def _empty_bucket():
+    return [0.0] * 5
+
+def bucket_summary(bucket):
+    """Palauttaa koosteesta (ON-tunnit, kWh, kustannus €, ON-ajan keskihinta ct/kWh tai None, hinnaton ON-aika h)."""
+    average = bucket[PRICE_S] / bucket[PRICED_S] if bucket[PRICED_S] else None
+    return (bucket[ON_S] / 3600, bucket[KWH], bucket[COST_CT] / 100, average, (bucket[ON_S] - bucket[PRICED_S]) / 3600)
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(data, f, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+class CostRollups:
+    """Lisäävästi päivitettävät päivä-, kuukausi- ja pinnikoosteet (ks. moduulin kuvaus)."""
+
+    def __init__(self, rollup_dir=ROLLUP_DIR):
+        self.rollup_dir = rollup_dir
+        self.state_file = os.path.join(rollup_dir, STATE_NAME)
+        self.state = {"version": STATE_VERSION, "position": None, "open": {}, "pins": {}}
+        self.months = {}     # "VVVV-KK" -> {"total": {tunniste: kooste}, "days": {päivä: {tunniste: kooste}}}
+        self._dirty = set()
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f: loaded = json.load(f)
+            if isinstance(loaded, dict) and loaded.get('version') == STATE_VERSION: self.state = loaded
+            else: logging.warning(f"Kustannuskoosteiden tila '{self.state_file}' on eri versiota. Aja --rebuild.")
+        except FileNotFoundError: pass
+        except (OSError, json.JSONDecodeError) as e: logging.warning(f"Kustannuskoosteiden tilan '{self.state_file}' lukeminen epäonnistui: {e}")
+
+    def month(self, month_key):
+        """Palauttaa kuukauden koosteet (luetaan tiedostosta tarvittaessa)."""
+        if month_key not in self.months:
+            month = {"total": {}, "days": {}}
+            try:
+                with open(os.path.join(self.rollup_dir, f"{month_key}.json"), 'r', encoding='utf-8') as f: month = json.load(f)
+            except FileNotFoundError: pass
+            except (OSError, json.JSONDecodeError) as e: logging.warning(f"Kustannuskoosteen {month_key} lukeminen epäonnistui: {e}")
+            self.months[month_key] = month
+        return self.months[month_key]
+
+    def _add(self, identifier, local_date, seconds, price, power_kw):
+        kwh = power_kw * seconds / 3600
+        values = (seconds, seconds, price * seconds, kwh, price * kwh) if price is not None else (seconds, 0, 0, kwh, 0)
+        day_str, month_key = local_date.isoformat(), local_date.isoformat()[:7]
+        month = self.month(month_key)
+        pin_entry = self.state["pins"][identifier]
+        for bucket in (month["total"].setdefault(identifier, _empty_bucket()),
+                       month["days"].setdefault(day_str, {}).setdefault(identifier, _empty_bucket()), pin_entry["total"]):
+            for field, value in enumerate(values): bucket[field] += value
+        pin_entry["first"] = min(pin_entry.get("first") or day_str, day_str)
+        pin_entry["last"] = max(pin_entry.get("last") or day_str, day_str)
+        self._dirty.add(month_key)
+
+    def update(self, settings_list=None, history_dir=HISTORY_DIR):
+        """
+        Lisää koosteisiin edellisen päivityksen jälkeen historiaan tulleet tietueet ja tallentaa muutokset.
+        settings_list (PinRule-lista) antaa pinnien tehot; None = luetaan settings.json. Palauttaa käsiteltyjen tietueiden määrän.
+        """
+        if settings_list is None: settings_list = pin_settings.load_settings() or []
+        power_by_identifier = {rule.identifier: rule.power_kw for rule in settings_list}
+        local_tz = ZoneInfo(LOCAL_TIMEZONE_STR)
+        price_days = PriceDays(local_tz)
+        open_intervals, pins = self.state["open"], self.state["pins"]
+        processed, position = 0, None
+        for position, epoch, pin, identifier, state in HistoryStore(history_dir).read_since(self.state["position"]):
+            processed += 1
+            previous = open_intervals.get(identifier)
+            if previous and epoch < previous[0]: continue   # Jälkikäteen tuotu vanha tietue (laske uudelleen: --rebuild)
+            pin_entry = pins.setdefault(identifier, {"pin": pin, "power_kw": pin_settings.DEFAULT_POWER_KW, "total": _empty_bucket()})
+            pin_entry["pin"] = pin
+            if identifier in power_by_identifier: pin_entry["power_kw"] = power_by_identifier[identifier]
+            if previous and previous[1]:
+                end_epoch = min(epoch, previous[0] + MAX_INTERVAL_SECONDS)
+                for local_date, seconds, price in split_interval(previous[0], end_epoch, price_days, local_tz):
+                    self._add(identifier, local_date, seconds, price, pin_entry["power_kw"])
+            open_intervals[identifier] = [epoch, state, pin]
+        if processed:
+            self.state["position"] = position
+            self.save()
+        return processed
+
+    def save(self):
+        """Tallentaa muuttuneet kuukaudet ja sen jälkeen tilan (lukukohta viimeisenä)."""
+        os.makedirs(self.rollup_dir, exist_ok=True)
+        for month_key in sorted(self._dirty): _write_json(os.path.join(self.rollup_dir, f"{month_key}.json"), self.months[month_key])
+        self._dirty.clear()
+        _write_json(self.state_file, self.state)
+
+def update_rollups(settings_list=None, rollup_dir=ROLLUP_DIR, history_dir=HISTORY_DIR):
+    """Päivittää koosteet (ohjausajon koukku). Palauttaa käsiteltyjen tietueiden määrän."""
+    processed = CostRollups(rollup_dir).update(settings_list, history_dir)
+    if processed: logging.info(f"Kustannuskoosteet päivitetty: {processed} historiatietuetta")
+    return processed
+
+def rebuild(settings_list=None, rollup_dir=ROLLUP_DIR, history_dir=HISTORY_DIR):
+    """Poistaa koosteet ja laskee ne koko historiasta uudelleen. Palauttaa käsiteltyjen tietueiden määrän."""
+    if os.path.isdir(rollup_dir): shutil.rmtree(rollup_dir)
+    return CostRollups(rollup_dir).update(settings_list, history_dir)
+
+# --- Raportit ---
+
+def _print_rows(title, rows):
+    """Tulostaa taulukon riveistä (nimi, pinni, teho kW, kooste) ja yhteissumman."""
+    print(title)
+    if not rows: print("Ei koosteita (historiaa ei vielä ole tai pinnit eivät ole olleet päällä)."); return
+    header = f"{'Tunniste':<16} {'Pin':>4} {'kW':>5} {'ON h':>8} {'kWh':>9} {'€':>8} {'ka ct/kWh':>10}"
+    print(header); print("-" * len(header))
+    total, unpriced_h = _empty_bucket(), 0.0
+    for name, pin, power_kw, bucket in rows:
+        on_h, kwh, cost_eur, average, unpriced = bucket_summary(bucket)
+        average_str = f"{average:.2f}" if average is not None else "-"
+        print(f"{name:<16} {pin:>4} {power_kw:>5.2f} {on_h:>8.2f} {kwh:>9.2f} {cost_eur:>8.2f} {average_str:>10}")
+        for field, value in enumerate(bucket): total[field] += value
+        unpriced_h += unpriced
+    on_h, kwh, cost_eur, average, _ = bucket_summary(total)
+    print("-" * len(header))
+    print(f"{'Yhteensä':<16} {'':>4} {'':>5} {on_h:>8.2f} {kwh:>9.2f} {cost_eur:>8.2f} {(f'{average:.2f}' if average is not None else '-'):>10}")
+    if unpriced_h: print(f"HUOM: {unpriced_h:.2f} ON-tuntia ilman hintaa (ei kustannusta). Täytä arkisto: python3 price_archive.py --backfill")
+
+def _pin_info(rollups, identifier):
+    pin_entry = rollups.state["pins"].get(identifier, {})
+    return pin_entry.get("pin", "?"), float(pin_entry.get("power_kw", pin_settings.DEFAULT_POWER_KW))
+
+def print_month(rollups, month_key, daily=False):
+    """Tulostaa kuukauden kustannukset pinneittäin (ja halutessa päivittäin)."""
+    month = rollups.month(month_key)
+    rows = [(identifier, *_pin_info(rollups, identifier), bucket) for identifier, bucket in sorted(month["total"].items())]
+    _print_rows(f"--- Kustannukset {month_key} ---", rows)
+    if not daily: return
+    for day_str in sorted(month["days"]):
+        print()
+        _print_rows(f"--- {day_str} ---", [(identifier, *_pin_info(rollups, identifier), bucket) for identifier, bucket in sorted(month["days"][day_str].items())])
+
+def print_pins(rollups):
+    """Tulostaa pinnien kokonaissummat koko historian ajalta."""
+    pins = rollups.state["pins"]
+    rows = [(identifier, *_pin_info(rollups, identifier), entry["total"]) for identifier, entry in sorted(pins.items())]
+    first = min((entry["first"] for entry in pins.values() if entry.get("first")), default=None)
+    last = max((entry["last"] for entry in pins.values() if entry.get("last")), default=None)
+    _print_rows(f"--- Kustannukset yhteensä ({first or '-'} - {last or '-'}) ---", rows)
+
+# --- Itsenäinen ajo ---
+
+def main():
+    parser = argparse.ArgumentParser(description="Pinnikohtaiset kustannus- ja energiakoosteet (kuukausi tähän asti, päivät, koko historia).")
+    parser.add_argument("--month", help="Kuukausi VVVV-KK (oletus kuluva kuukausi)")
+    parser.add_argument("--daily", action="store_true", help="Näytä myös päiväkohtaiset koosteet")
+    parser.add_argument("--pins", action="store_true", help="Näytä pinnien kokonaissummat koko historian ajalta")
+    parser.add_argument("--rebuild", action="store_true", help="Laske koosteet koko historiasta uudelleen (esim. power_kw-muutoksen jälkeen)")
+    parser.add_argument("--no-update", action="store_true", help="Älä lue uusia historiatietueita ennen raporttia")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stderr)
+    if args.month:
+        try: datetime.datetime.strptime(args.month, '%Y-%m')
+        except ValueError: print("VIRHE: Kuukauden muoto? Käytä VVVV-KK.", file=sys.stderr); sys.exit(1)
+    if args.rebuild: print(f"Koosteet laskettu uudelleen: {rebuild()} historiatietuetta ({ROLLUP_DIR})")
+    elif not args.no_update: update_rollups()
+    rollups = CostRollups()
+    if args.pins: print_pins(rollups); return
+    print_month(rollups, args.month or datetime.datetime.now(ZoneInfo(LOCAL_TIMEZONE_STR)).strftime('%Y-%m'), daily=args.daily)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+fake_price_server.py
+
+Paikallinen testipalvelin, joka korvaa api.spot-hinta.fi- ja sahkotin.fi-
+rajapinnat. Vastaukset lasketaan hinta-arkiston (price_archive.py) hinnoista,
+joten ohjausta, simulaattoria ja välimuistia voi ajaa ja kuormitustestata
+ilman internet-yhteyttä.
+
+Toteutetut päätepisteet (samat kuin skriptit kutsuvat):
+  * GET /prices?fix&vat&start=...&end=...        (Sahkotin, JSON)
+  * GET /JustNow/{alaraja}/{yläraja}             (spot-hinta, teksti 0/1/2)
+  * GET /CheapestPeriodTodayCheck/{n}            (spot-hinta, 200 / 400)
+  * GET /v1/TodayAndDayForward (ja ilman /v1)    (spot-hinta, JSON)
+
+--replay-date VVVV-KK-PP toistaa arkistoidun päivän hinnat kuluvana päivänä
+(muut päivät siirtyvät samalla päivämäärien erotuksella). Virheitä voi
+injektoida: --latency-ms ja --jitter-ms viive, --rate-429 / --rate-404 /
+--rate-timeout todennäköisyydet (0-1). Aikakatkaisussa vastausta ei lähetetä
+--timeout-seconds sekuntiin.
+
+Skriptit ohjataan palvelimelle config.json:lla tai ympäristömuuttujilla
+(ks. app_config.py):
+  GPIO_VASALLI_SPOT_HINTA_API_URL=http://127.0.0.1:8080
+  GPIO_VASALLI_SAHKOTIN_API_URL=http://127.0.0.1:8080/prices
+
+Ajo: python3 fake_price_server.py [--port 8080] [--replay-date 2024-01-15] [--rate-429 0.05]
+"""
+
+import json
+import sys
+import time
+import random
+import datetime
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import price_archive
+from price_logic import classify_price, find_cheapest_slots
+from price_slots import DayPrices, iso_to_epoch
+from price_cache import ZoneInfo, LOCAL_TIMEZONE_STR
+
+# --- Hintalähde ---
+
+class PriceReplay:
+    """Hinta-arkiston päivät palvelimen kellonaikaan siirrettyinä (DayPrices päivää kohden, muistissa)."""
+
+    def __init__(self, archive_dir=price_archive.ARCHIVE_DIR, replay_date=None, local_tz=None, today=None):
+        self.archive_dir = archive_dir
+        self.local_tz = local_tz or ZoneInfo(LOCAL_TIMEZONE_STR)
+        today = today or datetime.datetime.now(self.local_tz).date()
+        self.day_shift = (today - replay_date) if replay_date else datetime.timedelta(0)
+        self._days = {}
+        self._lock = threading.Lock()
+
+    def day(self, target_date):
+        """Palauttaa päivän hinnat (DayPrices) tai None, jos arkistossa ei ole vastaavaa päivää."""
+        with self._lock:
+            if target_date not in self._days:
+                source_date = target_date - self.day_shift
+                source = price_archive.load_days(source_date, source_date, self.archive_dir, self.local_tz).get(source_date.isoformat())
+                # Toistettu päivä siirretään kohdepäivän kellonajoille (kesäaikasiirtymän jaksot voivat puuttua tai toistua)
+                if source is not None and source_date != target_date: source = DayPrices.from_mapping(target_date, source.as_mapping(self.local_tz), self.local_tz)
+                self._days[target_date] = source
+            return self._days[target_date]
+
+    def entries_between(self, start_epoch, end_epoch):
+        """Hinnat väliltä [start_epoch, end_epoch) listana (epoch, hinta)."""
+        entries = []
+        day = datetime.datetime.fromtimestamp(start_epoch, self.local_tz).date()
+        last_day = datetime.datetime.fromtimestamp(end_epoch - 1, self.local_tz).date()
+        while day <= last_day:
+            day_prices = self.day(day)
+            if day_prices is not None:
+                for index in range(len(day_prices)):
+                    slot_start, price = day_prices.slot_start_epoch(index), day_prices.price(index)
+                    if price is not None and start_epoch <= slot_start < end_epoch: entries.append((slot_start, price))
+            day += datetime.timedelta(days=1)
+        return entries
+
+    def current(self, now_epoch):
+        """Palauttaa (DayPrices, jakson indeksi) annetulle hetkelle tai (None, None)."""
+        day_prices = self.day(datetime.datetime.fromtimestamp(now_epoch, self.local_tz).date())
+        if day_prices is None: return None, None
+        return day_prices, day_prices.index_at(now_epoch)
+
+# --- Virheiden injektointi ---
+
+class FaultInjector:
+    """Satunnaiset viiveet ja virhevastaukset annetuilla todennäköisyyksillä."""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, rate_429=0.0, rate_404=0.0, rate_timeout=0.0, timeout_seconds=30.0, seed=None):
+        self.latency_ms, self.jitter_ms = latency_ms, jitter_ms
+        self.rate_429, self.rate_404, self.rate_timeout = rate_429, rate_404, rate_timeout
+        self.timeout_seconds = timeout_seconds
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def next_fault(self):
+        """Palauttaa (viive sekunteina, virhe: None, 429, 404 tai 'timeout')."""
+        with self._lock:
+            delay = (self.latency_ms + self._random.uniform(0, self.jitter_ms)) / 1000.0
+            roll = self._random.random()
+        if roll < self.rate_timeout: return delay, 'timeout'
+        if roll < self.rate_timeout + self.rate_429: return delay, 429
+        if roll < self.rate_timeout + self.rate_429 + self.rate_404: return delay, 404
+        return delay, None
+
+# --- Päätepisteet ---
+
+def _utc_iso(epoch):
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+def sahkotin_prices(replay, query, now_epoch):
+    """Sahkotin /prices: hinnat alusta (start) loppuun (end, oletus kaksi vuorokautta eteenpäin)."""
+    start_epoch = iso_to_epoch(query['start'][0]) if 'start' in query else now_epoch - now_epoch % 86400
+    end_epoch = iso_to_epoch(query['end'][0]) if 'end' in query else start_epoch + 2 * 86400
+    entries = replay.entries_between(start_epoch, end_epoch)
+    return 200, 'application/json', json.dumps({"prices": [{"date": _utc_iso(epoch), "value": round(price, 3)} for epoch, price in entries]})
+
+def just_now(replay, lower_limit, upper_limit, now_epoch):
+    """spot-hinta /JustNow/{alaraja}/{yläraja}: 0, 1 tai 2 (404, jos hintaa ei ole)."""
+    day_prices, index = replay.current(now_epoch)
+    price = day_prices.price(index) if day_prices is not None and index is not None else None
+    if price is None: return 404, 'text/plain', 'Not found'
+    return 200, 'text/plain', str(classify_price(price, lower_limit, upper_limit))
+
+def cheapest_period_today_check(replay, num_hours, now_epoch):
+    """spot-hinta /CheapestPeriodTodayCheck/{n}: 200, jos kuluva jakso kuuluu päivän n halvimpaan tuntiin, muuten 400."""
+    day_prices, index = replay.current(now_epoch)
+    if day_prices is None or index is None: return 404, 'text/plain', 'Not found'
+    slots_per_hour = 60 // day_prices.resolution_minutes
+    if index in find_cheapest_slots(day_prices.by_index(), num_hours * slots_per_hour): return 200, 'text/plain', 'OK'
+    return 400, 'text/plain', 'Not cheapest'
+
+def today_and_day_forward(replay, now_epoch):
+    """spot-hinta /TodayAndDayForward: kuluvan ja seuraavan päivän hinnat (€/kWh) ja päiväkohtainen järjestys."""
+    today = datetime.datetime.fromtimestamp(now_epoch, replay.local_tz).date()
+    rows = []
+    for day in (today, today + datetime.timedelta(days=1)):
+        day_prices = replay.day(day)
+        if day_prices is None: continue
+        ranked = sorted((price, index) for index, price in day_prices.by_index().items() if price is not None)
+        rank_of = {index: rank for rank, (_price, index) in enumerate(ranked, start=1)}
+        for index in sorted(rank_of):
+            slot_start = datetime.datetime.fromtimestamp(day_prices.slot_start_epoch(index), replay.local_tz)
+            price_eur = day_prices.price(index) / 100.0
+            rows.append({"Rank": rank_of[index], "DateTime": slot_start.isoformat(),
+                         "PriceNoTax": round(price_eur / 1.255, 5), "PriceWithTax": round(price_eur, 5)})
+    if not rows: return 404, 'text/plain', 'Not found'
+    return 200, 'application/json', json.dumps(rows)
+
+def route(replay, path, query, now_epoch):
+    """Ohjaa pyynnön päätepisteelle. Palauttaa (HTTP-tila, sisältötyyppi, runko)."""
+    parts = [part for part in path.split('/') if part]
+    if parts[:1] == ['v1']: parts = parts[1:]
+    try:
+        if parts == ['prices']: return sahkotin_prices(replay, query, now_epoch)
+        if len(parts) == 3 and parts[0] == 'JustNow': return just_now(replay, int(parts[1]), int(parts[2]), now_epoch)
+        if len(parts) == 2 and parts[0] == 'CheapestPeriodTodayCheck': return cheapest_period_today_check(replay, int(parts[1]), now_epoch)
+        if parts == ['TodayAndDayForward']: return today_and_day_forward(replay, now_epoch)
+    except (ValueError, KeyError) as e: return 400, 'text/plain', f"Bad request: {e}"
+    return 404, 'text/plain', 'Unknown endpoint'
+
+# --- HTTP-palvelin ---
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    """Pyyntökäsittelijä; hintalähde, virheet ja kello luetaan palvelinoliosta."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        delay, fault = server.faults.next_fault()
+        if delay: time.sleep(delay)
+        if fault == 'timeout':
+            time.sleep(server.faults.timeout_seconds); self.close_connection = True; return
+        url = urlsplit(self.path)
+        if fault is not None: status, content_type, body = fault, 'text/plain', 'Injected error'
+        else: status, content_type, body = route(server.replay, url.path, parse_qs(url.query, keep_blank_values=True), server.clock())
+        payload = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        with server.stats_lock: server.stats[status] = server.stats.get(status, 0) + 1
+
+    def log_message(self, format, *args):
+        if not self.server.quiet: super().log_message(format, *args)
+
+def make_server(host='127.0.0.1', port=8080, replay=None, faults=None, clock=time.time, quiet=False):
+    """
+    Luo palvelimen (ThreadingHTTPServer) käynnistämättä sitä. clock: funktio, joka
+    palauttaa "nykyhetken" epoch-sekunteina (testeissä virtuaalikello).
+    Portti 0 valitsee vapaan portin (server.server_address).
+    """
+    server = ThreadingHTTPServer((host, port), FakeApiHandler)
+    server.daemon_threads = True
+    server.replay = replay or PriceReplay()
+    server.faults = faults or FaultInjector()
+    server.clock, server.quiet = clock, quiet
+    server.stats, server.stats_lock = {}, threading.Lock()
+    return server
+
+# --- Itsenäinen ajo ---
+
+def main():
+    parser = argparse.ArgumentParser(description="Paikallinen spot-hinta.fi / sahkotin.fi -testipalvelin hinta-arkiston hinnoilla.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--archive-dir", default=price_archive.ARCHIVE_DIR, help="Hinta-arkiston hakemisto")
+    parser.add_argument("--replay-date", type=str, help="Toista tämän päivän hinnat kuluvana päivänä (VVVV-KK-PP)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Vastausviive millisekunteina")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Satunnainen lisäviive 0..N ms")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="HTTP 429 -vastausten osuus (0-1)")
+    parser.add_argument("--rate-404", type=float, default=0.0, help="HTTP 404 -vastausten osuus (0-1)")
+    parser.add_argument("--rate-timeout", type=float, default=0.0, help="Vastaamatta jätettävien pyyntöjen osuus (0-1)")
+    parser.add_argument("--timeout-seconds", type=float, default=30.0, help="Kauanko aikakatkaistu pyyntö odottaa ennen yhteyden sulkemista")
+    parser.add_argument("--seed", type=int, help="Satunnaislukusiemen toistettaville virheille")
+    parser.add_argument("--quiet", action="store_true", help="Älä tulosta pyyntölokia")
+    args = parser.parse_args()
+    try: replay_date = datetime.date.fromisoformat(args.replay_date) if args.replay_date else None
+    except ValueError: print("VIRHE: Päivämäärämuoto? Käytä VVVV-KK-PP.", file=sys.stderr); sys.exit(1)
+
+    replay = PriceReplay(args.archive_dir, replay_date)
+    faults = FaultInjector(args.latency_ms, args.jitter_ms, args.rate_429, args.rate_404, args.rate_timeout, args.timeout_seconds, args.seed)
+    server = make_server(args.host, args.port, replay, faults, quiet=args.quiet)
+    first, last, count = price_archive.archived_range(args.archive_dir)
+    if not count: print(f"VAROITUS: Hinta-arkisto on tyhjä ({args.archive_dir}). Täytä se: python3 price_archive.py --backfill --from VVVV-KK-PP", file=sys.stderr)
+    else: print(f"Hinta-arkisto: {count} päivää, {first} - {last}" + (f", toistetaan {replay_date.isoformat()} tänään" if replay_date else ""))
+    host, port = server.server_address[:2]
+    print(f"Testipalvelin: http://{host}:{port} (Sahkotin: http://{host}:{port}/prices)")
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+    finally:
+        server.server_close()
+        print(f"Vastauksia tilakoodeittain: {dict(sorted(server.stats.items()))}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+find_cheapest_window.py
+
+Ajanjakson optimointityökalu (ks. SUUNNITELMA_V2.md, kohta 4). Etsii
+hintavälimuistin (price_cache.py) hinnoista halvimmat jaksot ennen annettua
+määräaikaa, esim. "LVV:lle 3 h ajoa ennen klo 07:00" yön yli.
+
+Kaksi tilaa:
+  * oletus: N halvinta jaksoa (ei tarvitse olla peräkkäin), kekovalinta
+    price_logic.find_cheapest_indices (O(n log N))
+  * --contiguous: halvin yhtenäinen N jakson lohko, liukuva summa
+    price_logic.find_cheapest_window (O(n))
+
+Aikaväli voi ulottua usean päivän yli ja toimii sekä tunti- että 15 min
+jaksoilla. --output-override tallentaa valitut jaksot manual_override.json-
+tiedostoon tilaan ON; muutos tulee voimaan, kun aikataulu rakennetaan
+uudelleen (schedule_builder.py --today / --tomorrow).
+
+Ajo: python3 find_cheapest_window.py --intervals 12 --until 07:00 [--contiguous]
+     [--identifier LVV --output-override]
+"""
+
+import sys
+import datetime
+import argparse
+import price_cache
+import schedule_builder
+from price_logic import find_cheapest_indices, find_cheapest_window
+from price_cache import ZoneInfo, LOCAL_TIMEZONE_STR
+from price_slots import localize
+
+# --- Aikajana ---
+
+def build_timeline(start_local, deadline_local, local_tz):
+    """
+    Kokoaa välimuistin hinnoista aikajärjestyksessä olevat jaksot, jotka päättyvät
+    aikaisintaan start_local-hetken jälkeen ja viimeistään deadline_local-hetkellä.
+    Palauttaa listan (päivä_str, "HH:MM", alku_epoch, hinta); aukon kohdalla rivi on None.
+    """
+    timeline = []
+    previous_end = None
+    start_epoch, deadline_epoch = start_local.timestamp(), deadline_local.timestamp()
+    day = start_local.date()
+    while day <= deadline_local.date():
+        day_prices = price_cache.ensure_prices(day)
+        if day_prices is not None:
+            labels = day_prices.labels(local_tz)
+            slot_seconds = day_prices.slot_seconds
+            for index in range(len(day_prices)):
+                price = day_prices.price(index)
+                slot_start = day_prices.slot_start_epoch(index)
+                if price is None or slot_start + slot_seconds <= start_epoch or slot_start + slot_seconds > deadline_epoch: continue
+                if previous_end is not None and slot_start != previous_end: timeline.append(None)
+                timeline.append((day.isoformat(), labels[index], slot_start, price))
+                previous_end = slot_start + slot_seconds
+        day += datetime.timedelta(days=1)
+    return timeline
+
+def parse_deadline(value, now_local, local_tz):
+    """Jäsentää määräajan: "VVVV-KK-PPTHH:MM" tai "HH:MM" (seuraava kyseinen kellonaika)."""
+    if len(value) == 5:
+        clock = datetime.time.fromisoformat(value)
+        deadline = localize(datetime.datetime.combine(now_local.date(), clock), local_tz)
+        if deadline <= now_local: deadline = localize(datetime.datetime.combine(now_local.date() + datetime.timedelta(days=1), clock), local_tz)
+        return deadline
+    return localize(datetime.datetime.fromisoformat(value).replace(tzinfo=None), local_tz)
+
+def select_slots(timeline, intervals, contiguous=False):
+    """Valitsee aikajanalta halvimmat jaksot. Palauttaa listan aikajanan rivejä aikajärjestyksessä tai None."""
+    prices = [entry[3] if entry else None for entry in timeline]
+    if contiguous:
+        window = find_cheapest_window(prices, intervals)
+        if window is None: return None
+        return timeline[window[0]:window[0] + intervals]
+    indices = find_cheapest_indices(prices, intervals)
+    if len(indices) < intervals: return None
+    return [timeline[index] for index in indices]
+
+# --- Itsenäinen ajo ---
+
+def main():
+    parser = argparse.ArgumentParser(description="Etsii halvimmat jaksot ennen määräaikaa hintavälimuistista.")
+    parser.add_argument("--intervals", type=int, required=True, help="Tarvittavien jaksojen määrä (tunti- tai 15 min jaksoja hintojen mukaan)")
+    parser.add_argument("--until", type=str, help="Määräaika VVVV-KK-PPTHH:MM tai HH:MM (oletus: viimeinen tunnettu hinta)")
+    parser.add_argument("--from", dest="date_from", type=str, help="Alkuhetki VVVV-KK-PPTHH:MM (oletus nyt)")
+    parser.add_argument("--contiguous", action="store_true", help="Etsi yhtenäinen lohko hajautettujen jaksojen sijaan")
+    parser.add_argument("--identifier", type=str, help="Pinnin tunniste (tarvitaan --output-override kanssa)")
+    parser.add_argument("--output-override", action="store_true", help="Tallenna valitut jaksot manual_override.json-tiedostoon (ON)")
+    args = parser.parse_args()
+    if args.intervals <= 0: print("VIRHE: --intervals on oltava positiivinen.", file=sys.stderr); sys.exit(1)
+    if args.output_override and not args.identifier: print("VIRHE: --output-override vaatii --identifier-tunnisteen.", file=sys.stderr); sys.exit(1)
+
+    local_tz = ZoneInfo(LOCAL_TIMEZONE_STR)
+    now_local = datetime.datetime.now(local_tz)
+    try:
+        start_local = localize(datetime.datetime.fromisoformat(args.date_from).replace(tzinfo=None), local_tz) if args.date_from else now_local
+        deadline_local = (parse_deadline(args.until, start_local, local_tz) if args.until
+                          else localize(datetime.datetime.combine(start_local.date() + datetime.timedelta(days=2), datetime.time.min), local_tz))
+    except ValueError: print("VIRHE: Aikamuoto? Käytä VVVV-KK-PPTHH:MM tai HH:MM.", file=sys.stderr); sys.exit(1)
+    if deadline_local <= start_local: print("VIRHE: Määräaika on ennen alkuhetkeä.", file=sys.stderr); sys.exit(1)
+
+    timeline = build_timeline(start_local, deadline_local, local_tz)
+    available = sum(1 for entry in timeline if entry)
+    print(f"Aikaväli {start_local.strftime('%Y-%m-%d %H:%M')} - {deadline_local.strftime('%Y-%m-%d %H:%M')}: {available} jaksoa hinnoilla.")
+    selected = select_slots(timeline, args.intervals, args.contiguous)
+    if selected is None:
+        mode = "yhtenäistä lohkoa" if args.contiguous else "jaksoa"
+        print(f"VIRHE: {args.intervals} {mode} ei löytynyt aikaväliltä (hinnat puuttuvat tai aikaväli liian lyhyt).", file=sys.stderr); sys.exit(1)
+
+    print("-" * 40)
+    for day_str, slot, _start_epoch, price in selected: print(f"  {day_str} {slot}  {price:>7.2f} ct/kWh")
+    average = sum(entry[3] for entry in selected) / len(selected)
+    horizon_average = sum(entry[3] for entry in timeline if entry) / available
+    print("-" * 40)
+    print(f"Keskihinta {average:.2f} ct/kWh (aikavälin keskihinta {horizon_average:.2f} ct/kWh)")
+
+    if args.output_override:
+        new_overrides = {}
+        for day_str, slot, _start_epoch, _price in selected:
+            new_overrides.setdefault(day_str, {}).setdefault(args.identifier, {})[slot] = "ON"
+        if not schedule_builder.add_overrides(new_overrides): sys.exit(1)
+        print(f"Ohitukset tallennettu: {schedule_builder.OVERRIDE_FILE}")
+        for day_str in sorted(new_overrides): print(f"Rakenna aikataulu uudelleen: python3 schedule_builder.py --date {day_str}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+fleet_scheduler.py
+
+Monen asennuksen (sivuston) aikataulut yhdeltä koneelta. Jokaisella sivustolla
+on oma settings.json; tämä työkalu hakee jokaisen hinta-alueen hinnat kerran,
+laskee sivustojen päiväaikataulut prosessipoolissa ja kirjoittaa jokaiselle
+sivustolle valmiin control_schedule.json-tiedoston. Sivuston Pi:n
+hourly_control.py suorittaa aikataulun sellaisenaan, kun tiedosto kopioidaan
+sen ~/gpio_pricer_data/-hakemistoon (esim. rsync).
+
+Sivustohakemiston rakenne (--sites):
+  <sivusto>.json                      asetukset, hinta-alue FI
+  <sivusto>/settings.json             asetukset
+  <sivusto>/site.json                 valinnainen, esim. {"price_area": "FI", "max_power_kw": 17}
+  <sivusto>/manual_override.json      valinnaiset ohitukset (kuten schedule_builder.py)
+
+Tulokset (--out, oletus ~/gpio_pricer_data/fleet/):
+  <sivusto>/control_schedule.json     sivuston aikataulu (schedule_builder.py:n muoto)
+  manifest.json                       sivuston ja päivän syöteavain
+
+Syöteavain on tiiviste asetuksista, ohituksista, alueen päivän hinnoista ja
+edellisen päivän viimeisistä tiloista (hystereesi) sekä sivuston tehorajasta
+(site.json "max_power_kw", ks. schedule_builder.apply_power_cap). Sivusto lasketaan uudelleen
+vain, kun avain muuttuu; muuten sivusto ohitetaan lukematta sen aikataulua.
+Hinta-alueiden URL:t (Sahkotin /prices -yhteensopivat) annetaan config.json:n
+avaimella "fleet_price_areas", esim. {"FI": "https://sahkotin.fi/prices"};
+alue FI käyttää oletuksena avainta "sahkotin_api_url". Kaikki sivustot käyttävät
+samaa aikavyöhykettä (price_cache.LOCAL_TIMEZONE_STR).
+
+Ajo: python3 fleet_scheduler.py --sites ~/sivustot [--tomorrow | --date VVVV-KK-PP] [--workers N] [--force]
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import app_config
+import pin_settings
+import price_cache
+import schedule_builder
+
+# --- Konfiguraatio ja Polut ---
+DATA_DIR = os.path.expanduser('~/gpio_pricer_data')
+FLEET_DIR = os.path.join(DATA_DIR, 'fleet')
+MANIFEST_NAME = 'manifest.json'
+SITE_SETTINGS_NAME = 'settings.json'
+SITE_CONFIG_NAME = 'site.json'
+SITE_OVERRIDE_NAME = 'manual_override.json'
+SCHEDULE_NAME = 'control_schedule.json'
+DEFAULT_PRICE_AREA = 'FI'
+MANIFEST_VERSION = 1
+MANIFEST_KEEP_DAYS = 2   # Montako mennyttä päivää manifestissa säilytetään (edellisen päivän tilat hystereesiä varten)
+
+# --- Sivustot ---
+
+def _read_bytes(path):
+    """Tiedoston sisältö tavuina tai None, jos tiedostoa ei ole."""
+    try:
+        with open(path, 'rb') as f: return f.read()
+    except FileNotFoundError: return None
+
+def discover_sites(sites_dir):
+    """
+    Etsii sivustot hakemistosta. Palauttaa {sivusto: {"settings": polku, "overrides": polku tai None,
+    "area": hinta-alue, "max_power_kw": tehoraja tai None}} aakkosjärjestyksessä.
+    """
+    sites = {}
+    for entry in sorted(os.scandir(sites_dir), key=lambda e: e.name):
+        if entry.is_file() and entry.name.endswith('.json'):
+            sites[entry.name[:-5]] = {"settings": entry.path, "overrides": None, "area": DEFAULT_PRICE_AREA, "max_power_kw": None}
+        elif entry.is_dir() and os.path.isfile(os.path.join(entry.path, SITE_SETTINGS_NAME)):
+            area, max_power_kw = DEFAULT_PRICE_AREA, None
+            site_config = _read_bytes(os.path.join(entry.path, SITE_CONFIG_NAME))
+            if site_config is not None:
+                try:
+                    site_config = json.loads(site_config)
+                    area = str(site_config.get('price_area') or DEFAULT_PRICE_AREA)
+                    max_power_kw = schedule_builder.site_max_power_kw(site_config.get('max_power_kw') or 0)
+                except (ValueError, AttributeError) as e: logging.error(f"Sivusto {entry.name}: {SITE_CONFIG_NAME} virheellinen ({e}), käytetään aluetta {area}.")
+            override_file = os.path.join(entry.path, SITE_OVERRIDE_NAME)
+            sites[entry.name] = {"settings": os.path.join(entry.path, SITE_SETTINGS_NAME),
+                                 "overrides": override_file if os.path.isfile(override_file) else None, "area": area, "max_power_kw": max_power_kw}
+    return sites
+
+def price_area_urls():
+    """Hinta-alueiden URL:t {alue: url} (config.json "fleet_price_areas", FI oletuksena sahkotin_api_url)."""
+    areas = app_config.get('fleet_price_areas') or {}
+    if isinstance(areas, str):
+        try: areas = json.loads(areas)
+        except ValueError: logging.error("fleet_price_areas ei ole JSON-objekti, käytetään oletusta."); areas = {}
+    return dict({DEFAULT_PRICE_AREA: app_config.get('sahkotin_api_url')}, **areas)
+
+def fetch_area_prices(areas, target_date, local_tz):
+    """Hakee jokaisen alueen hinnat kerran. Palauttaa {alue: DayPrices}; alueet ilman hintoja puuttuvat."""
+    urls = price_area_urls()
+    area_prices = {}
+    for area in sorted(areas):
+        url = urls.get(area)
+        if not url: logging.error(f"Hinta-alueelle {area} ei ole URL:ia (fleet_price_areas)."); continue
+        series = price_cache.fetch_prices_bulk(target_date, local_tz, api_url=url.rstrip('/'))
+        day_prices = price_cache.split_prices_by_day(series, local_tz).get(target_date.isoformat()) if series is not None else None
+        if day_prices is None or not day_prices.valid_count(): logging.error(f"Alueen {area} hintoja ei saatu päivälle {target_date.isoformat()}."); continue
+        if not day_prices.is_complete(): logging.warning(f"Alueen {area} hinnat päivälle {target_date.isoformat()} ovat keskeneräiset.")
+        area_prices[area] = day_prices
+    return area_prices
+
+def prices_digest(day_prices):
+    """Päivän hintojen tiiviste (muuttuu, kun yksikin hinta tai resoluutio muuttuu)."""
+    return hashlib.sha256(json.dumps(day_prices.to_json(), sort_keys=True).encode('utf-8')).hexdigest()
+
+def input_key(settings_raw, overrides_raw, area_digest, initial_states, initial_runs=None, max_power_kw=None):
+    """Sivuston ja päivän syöteavain (ks. moduulin kuvaus). Ilman tehorajaa avain on sama kuin ennen tehorajaa."""
+    digest = hashlib.sha256()
+    state_parts = [initial_states, initial_runs or {}] + ([max_power_kw] if max_power_kw else [])
+    for part in (settings_raw, overrides_raw or b'', area_digest.encode('ascii'), json.dumps(state_parts, sort_keys=True).encode('utf-8')):
+        digest.update(hashlib.sha256(part).digest())
+    return digest.hexdigest()
+
+# --- Manifesti ---
+
+def load_manifest(manifest_file):
+    empty_manifest = {"version": MANIFEST_VERSION, "sites": {}}
+    raw = _read_bytes(manifest_file)
+    if raw is None: return empty_manifest
+    try:
+        manifest = json.loads(raw)
+        return manifest if isinstance(manifest, dict) and manifest.get('version') == MANIFEST_VERSION else empty_manifest
+    except ValueError as e: logging.error(f"Manifestin '{manifest_file}' lukeminen epäonnistui: {e}. Lasketaan kaikki."); return empty_manifest
+
+def save_manifest(manifest, manifest_file, target_date):
+    """Tallentaa manifestin atomisesti ja karsii päivät, jotka ovat yli MANIFEST_KEEP_DAYS vanhempia kuin laskettu päivä."""
+    oldest_kept = (target_date - datetime.timedelta(days=MANIFEST_KEEP_DAYS)).isoformat()
+    for site_entry in manifest['sites'].values():
+        for day in [d for d in site_entry if d < oldest_kept]: del site_entry[day]
+    tmp_path = f"{manifest_file}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(manifest, f, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        os.replace(tmp_path, manifest_file)
+    except OSError as e: logging.error(f"Manifestin tallennus tiedostoon '{manifest_file}' epäonnistui: {e}")
+
+# --- Prosessikohtainen tila (asetetaan _init_worker-funktiossa) ---
+_area_prices = {}
+_target_date = None
+_local_tz = None
+
+def _init_worker(area_prices, target_date):
+    """Prosessin alustus: alueiden hinnat välitetään kerran prosessia kohden."""
+    global _area_prices, _target_date, _local_tz
+    _area_prices, _target_date = area_prices, target_date
+    _local_tz = price_cache.ZoneInfo(price_cache.LOCAL_TIMEZONE_STR)
+
+def _build_site(task):
+    """
+    Laskee ja tallentaa yhden sivuston aikataulun. task = (sivusto, asetukset tavuina,
+    ohitustiedosto, alue, alkutilat, alkutilojen kestot, tehoraja, aikataulutiedosto).
+    Palauttaa (sivusto, (viimeiset tilat, niiden kestot), pinnit, varoitukset, virhe).
+    """
+    site, settings_raw, override_file, area, initial_states, initial_runs, max_power_kw, schedule_file = task
+    try:
+        rules, warnings = pin_settings.compile_settings(json.loads(settings_raw.decode('utf-8')))
+        if not rules: return site, None, 0, warnings, "ei kelvollisia pinnimäärityksiä"
+        overrides = schedule_builder.load_overrides(_target_date, override_file) if override_file else {}
+        day_schedule = schedule_builder.build_day_schedule(rules, _area_prices[area], overrides, initial_states, _local_tz, initial_runs, max_power_kw)
+        if not schedule_builder.save_day(_target_date, day_schedule, schedule_file): return site, None, len(rules), warnings, "tallennus epäonnistui"
+        return site, (schedule_builder.last_states(day_schedule), schedule_builder.last_runs(day_schedule)), len(rules), warnings, None
+    except (ValueError, UnicodeDecodeError) as e: return site, None, 0, [], f"asetukset virheelliset: {e}"
+    except Exception as e: return site, None, 0, [], f"aikataulun laskenta epäonnistui: {type(e).__name__}: {e}"   # Yhden sivuston virhe ei kaada koko ajoa
+
+# --- Ajo ---
+
+def schedule_fleet(sites_dir, target_date, out_dir=FLEET_DIR, workers=None, force=False):
+    """
+    Laskee kaikkien sivustojen aikataulut päivälle. Palauttaa yhteenvedon
+    {"sites", "built", "skipped", "failed", "pins", "fetch_s", "build_s"}.
+    """
+    local_tz = price_cache.ZoneInfo(price_cache.LOCAL_TIMEZONE_STR)
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_file = os.path.join(out_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_file)
+    sites = discover_sites(sites_dir)
+    day_str = target_date.isoformat()
+    previous_day_str = (target_date - datetime.timedelta(days=1)).isoformat()
+
+    fetch_started = time.perf_counter()
+    area_prices = fetch_area_prices({site['area'] for site in sites.values()}, target_date, local_tz)
+    area_digests = {area: prices_digest(day_prices) for area, day_prices in area_prices.items()}
+    fetch_seconds = time.perf_counter() - fetch_started
+
+    summary = {"sites": len(sites), "built": 0, "skipped": 0, "failed": 0, "pins": 0, "fetch_s": fetch_seconds, "build_s": 0.0}
+    tasks, task_keys = [], {}
+    for site, site_info in sites.items():
+        if site_info['area'] not in area_prices: summary['failed'] += 1; continue
+        settings_raw = _read_bytes(site_info['settings'])
+        overrides_raw = _read_bytes(site_info['overrides']) if site_info['overrides'] else None
+        site_entry = manifest['sites'].setdefault(site, {})
+        initial_states = site_entry.get(previous_day_str, {}).get('last_states', {})
+        initial_runs = site_entry.get(previous_day_str, {}).get('last_runs', {})
+        key = input_key(settings_raw or b'', overrides_raw, area_digests[site_info['area']], initial_states, initial_runs, site_info['max_power_kw'])
+        schedule_file = os.path.join(out_dir, site, SCHEDULE_NAME)
+        if not force and site_entry.get(day_str, {}).get('key') == key and os.path.exists(schedule_file): summary['skipped'] += 1; continue
+        tasks.append((site, settings_raw or b'', site_info['overrides'], site_info['area'], initial_states, initial_runs,
+                      site_info['max_power_kw'], schedule_file))
+        task_keys[site] = key
+    for site in [s for s in manifest['sites'] if s not in sites]: del manifest['sites'][site]
+
+    build_started, done = time.perf_counter(), 0
+    try:
+        if tasks:
+            workers = workers or os.cpu_count() or 1
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(area_prices, target_date)) as executor:
+                for site, site_last, pin_count, warnings, error in executor.map(_build_site, tasks, chunksize=max(1, len(tasks) // (workers * 4))):
+                    done += 1
+                    for warning in warnings: logging.warning(f"Sivusto {site}: {warning}")
+                    if error: logging.error(f"Sivusto {site}: {error}"); summary['failed'] += 1; continue
+                    manifest['sites'][site][day_str] = {"key": task_keys[site], "last_states": site_last[0], "last_runs": site_last[1], "pins": pin_count}
+                    summary['built'] += 1; summary['pins'] += pin_count
+    except BrokenProcessPool as e: # Työprosessi kaatui: jäljellä olevat sivustot epäonnistuivat, valmiit tallennetaan manifestiin
+        remaining = len(tasks) - done
+        logging.error(f"Aikataulujen laskenta keskeytyi ({e}), {remaining} sivustoa jäi laskematta."); summary['failed'] += remaining
+    finally:
+        summary['build_s'] = time.perf_counter() - build_started
+        save_manifest(manifest, manifest_file, target_date)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Laskee monen sivuston ohjausaikataulut kerralla (yksi hintahaku aluetta kohden).")
+    parser.add_argument("--sites", required=True, help="Sivustojen asetushakemisto (ks. moduulin kuvaus)")
+    parser.add_argument("--out", default=FLEET_DIR, help=f"Tuloshakemisto (oletus {FLEET_DIR})")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--today", action="store_true", help="Laske kuluvalle päivälle (oletus)")
+    group.add_argument("--tomorrow", action="store_true", help="Laske seuraavalle päivälle")
+    group.add_argument("--date", type=str, help="Laske tietylle päivälle (VVVV-KK-PP)")
+    parser.add_argument("--workers", type=int, help="Prosessien määrä (oletus kaikki ytimet)")
+    parser.add_argument("--force", action="store_true", help="Laske kaikki sivustot manifestista riippumatta")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stderr)
+    if args.date:
+        try: target_date = datetime.date.fromisoformat(args.date)
+        except ValueError: print(f"VIRHE: Päivämäärämuoto '{args.date}'? Käytä VVVV-KK-PP.", file=sys.stderr); sys.exit(1)
+    elif args.tomorrow: target_date = datetime.date.today() + datetime.timedelta(days=1)
+    else: target_date = datetime.date.today()
+    if not os.path.isdir(args.sites): print(f"VIRHE: Sivustohakemistoa '{args.sites}' ei löydy.", file=sys.stderr); sys.exit(1)
+
+    summary = schedule_fleet(args.sites, target_date, args.out, args.workers, args.force)
+    print(f"Päivä {target_date.isoformat()}: {summary['sites']} sivustoa, laskettu {summary['built']} ({summary['pins']} pinniä), "
+          f"ennallaan {summary['skipped']}, epäonnistui {summary['failed']}")
+    print(f"Hintahaku {summary['fetch_s']:.2f} s, aikataulut {summary['build_s']:.2f} s. Tulokset: {os.path.abspath(args.out)}")
+    if summary['failed']: sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+gpio_backends.py
+
+Vaihdettava GPIO-ajurikerros. hourly_control.py käyttää ajuria vain
+set_states-kutsulla, joka asettaa yhden päätöskierroksen (tai porrastetun
+kytkentäsarjan yhden vaiheen, ks. transition_sequencer.py) muuttuneet pinnit
+kerralla. Ajuri valitaan config.json:n avaimella "gpio_backend"
+(ks. app_config.py):
+
+  * "rpi" (oletus): RPi.GPIO, pinni kerrallaan (setup kerran, sen jälkeen output).
+  * "gpiod": libgpiod-merkkilaite (/dev/gpiochipN, avain "gpio_chip").
+    Kaikki asetusten ulostulolinjat varataan kerran (claim) ja muuttuneet arvot
+    asetetaan yhdellä set_values-kutsulla (yksi ioctl koko releryhmälle). Tukee
+    python3-libgpiod -sidosten versioita 1.x ja 2.x. Linjat pysyvät varattuina
+    prosessin ajan, joten ajuri on tarkoitettu jatkuvaan ajoon (--daemon);
+    kertaajossa linjat vapautuvat prosessin päättyessä ja niiden tila riippuu
+    sen jälkeen ytimestä ja ajurista.
+  * "memory": muistissa toimiva ajuri testeille ja suorituskykytestille
+    (benchmark.py). Ei koske laitteistoon.
+
+Pinnit ovat BCM-numeroita, jotka ovat Raspberry Pi:llä myös gpiochipin
+linjanumerot.
+"""
+
+import logging
+import app_config
+
+CONSUMER_NAME = 'gpio-vasalli'
+
+class GpioBackend:
+    """Ajurirajapinta. set_states palauttaa onnistuneesti kirjoitetut pinnit (set)."""
+
+    name = 'base'
+
+    def set_states(self, states):
+        """Asettaa pinnien tilat {pinni: bool} yhtenä eränä. Palauttaa onnistuneet pinnit."""
+        raise NotImplementedError
+
+    def claim(self, initial_states):
+        """Varaa pinnit etukäteen alkutiloilla {pinni: bool}. Oletuksena ei tee mitään."""
+
+    def close(self):
+        pass
+
+class MemoryGpioBackend(GpioBackend):
+    """Muistissa toimiva ajuri. writes = kirjoitettujen pinnien määrä, operations = set_states-kutsujen määrä."""
+
+    name = 'memory'
+
+    def __init__(self):
+        self.pins = {}
+        self.writes = 0
+        self.operations = 0
+
+    def set_states(self, states):
+        if not states: return set()
+        self.pins.update(states)
+        self.writes += len(states)
+        self.operations += 1
+        return set(states)
+
+class RPiGpioBackend(GpioBackend):
+    """RPi.GPIO-ajuri: pinni alustetaan ulostuloksi kerran prosessia kohden, sen jälkeen output-kutsu per pinni."""
+
+    name = 'rpi'
+
+    def __init__(self):
+        try: import RPi.GPIO as GPIO
+        except (ImportError, RuntimeError) as e: raise RuntimeError(f"RPi.GPIO-kirjastoa ei voitu ladata: {e}")
+        self.GPIO = GPIO
+        GPIO.setwarnings(False)
+        GPIO.setmode(GPIO.BCM)
+        self._configured_pins = set()
+
+    def set_states(self, states):
+        GPIO = self.GPIO
+        written = set()
+        for pin, state in states.items():
+            gpio_value = GPIO.HIGH if state else GPIO.LOW
+            try:
+                if pin in self._configured_pins: GPIO.output(pin, gpio_value)
+                else: GPIO.setup(pin, GPIO.OUT, initial=gpio_value); self._configured_pins.add(pin)
+                written.add(pin)
+            except Exception as e: logging.error(f"Pinni {pin}: RPi.GPIO-virhe: {e}")
+        return written
+
+class LibgpiodBackend(GpioBackend):
+    """
+    libgpiod-ajuri: kaikki asetusten ulostulolinjat varataan claim-kutsulla yhdellä
+    pyynnöllä, joka pidetään voimassa, ja arvot asetetaan yhdellä set_values-kutsulla.
+    Pyyntö tehdään uudelleen vain, jos claim tuo uusia pinnejä (asetusten muutos).
+    """
+
+    name = 'gpiod'
+
+    def __init__(self, chip_path=None):
+        try: import gpiod
+        except ImportError as e: raise RuntimeError(f"gpiod-kirjastoa (python3-libgpiod) ei löydy: {e}")
+        self.gpiod = gpiod
+        self.chip_path = chip_path or app_config.get('gpio_chip', '/dev/gpiochip0')
+        self.v2 = hasattr(gpiod, 'request_lines')
+        self.values = {}      # pinni -> bool, kaikki varatut linjat
+        self._request = None
+        self._chip = None
+
+    def _release(self):
+        if self._request is not None: self._request.release(); self._request = None
+
+    def _request_lines(self, values):
+        """Varaa kaikki linjat ulostuloiksi annetuilla alkuarvoilla (yksi pyyntö)."""
+        gpiod = self.gpiod
+        self._release()
+        offsets = sorted(values)
+        if self.v2:
+            from gpiod.line import Direction, Value
+            config = {offset: gpiod.LineSettings(direction=Direction.OUTPUT, output_value=Value.ACTIVE if values[offset] else Value.INACTIVE)
+                      for offset in offsets}
+            self._request = gpiod.request_lines(self.chip_path, consumer=CONSUMER_NAME, config=config)
+        else:
+            if self._chip is None: self._chip = gpiod.Chip(self.chip_path)
+            self._request = self._chip.get_lines(offsets)
+            self._request.request(consumer=CONSUMER_NAME, type=gpiod.LINE_REQ_DIR_OUT, default_vals=[int(values[offset]) for offset in offsets])
+        self.values = dict(values)
+
+    def claim(self, initial_states):
+        """Varaa kaikki pinnit; jo varatut säilyttävät nykyisen arvonsa. Uusi pyyntö vain, jos pinnejä tuli lisää."""
+        if self._request is not None and set(initial_states) <= set(self.values): return
+        try: self._request_lines({**initial_states, **self.values}); logging.info(f"libgpiod: varattu {len(self.values)} linjaa ({self.chip_path})")
+        except (OSError, ValueError) as e: logging.error(f"libgpiod-virhe linjoja varatessa ({self.chip_path}, pinnit {sorted(initial_states)}): {e}")
+
+    def set_states(self, states):
+        unclaimed = set(states) - set(self.values) if self._request is not None else set(states)
+        if unclaimed: logging.error(f"libgpiod: pinnejä {sorted(unclaimed)} ei ole varattu (ei asetuksissa), ei kirjoiteta.")
+        states = {pin: state for pin, state in states.items() if pin not in unclaimed}
+        if not states: return set()
+        try:
+            if self.v2:
+                from gpiod.line import Value
+                self._request.set_values({pin: Value.ACTIVE if state else Value.INACTIVE for pin, state in states.items()})
+                self.values.update(states)
+            else:
+                values = {**self.values, **states}
+                self._request.set_values([int(values[offset]) for offset in sorted(values)])
+                self.values = values
+            return set(states)
+        except (OSError, ValueError) as e:
+            logging.error(f"libgpiod-virhe ({self.chip_path}, pinnit {sorted(states)}): {e}"); return set()
+
+    def close(self):
+        self._release()
+        if self._chip is not None: self._chip.close(); self._chip = None
+
+BACKENDS = {backend.name: backend for backend in (RPiGpioBackend, LibgpiodBackend, MemoryGpioBackend)}
+
+def create_backend(name=None):
+    """Luo config.json:ssa valitun ajurin (tai annetun nimen). Virhe: RuntimeError."""
+    name = name or app_config.get('gpio_backend', 'rpi')
+    backend_class = BACKENDS.get(name)
+    if backend_class is None: raise RuntimeError(f"Tuntematon GPIO-ajuri '{name}' (vaihtoehdot: {', '.join(sorted(BACKENDS))})")
+    return backend_class()
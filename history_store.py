@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+history_store.py
+
+Tiivis tilahistoria, joka korvaa jatkuvasti kasvavan gpio_history.csv-tiedoston.
+
+* Vain lisäävä (append-only) binäärimuoto, kiinteä tietuekoko RECORD_SIZE tavua:
+  aikaleima (UTC epoch, uint32), pinnikoodi (uint16), syykoodi (uint16), tila (uint8).
+* Pinnit (tunniste + numero) ja syytekstit internoidaan pieniksi kokonaislukukoodeiksi
+  (history/strings.json).
+* Kuukausittaiset segmentit (history/VVVV-KK.bin, UTC-kuukausi).
+* Harva aikaleimaindeksi (history/VVVV-KK.idx, joka INDEX_EVERY:s tietue), jolla
+  aikavälihaku on O(log n) + palautettavien tietueiden määrä.
+
+CSV-muoto on saatavilla tarvittaessa vientinä:
+    python history_store.py --export-csv historia.csv [--from VVVV-KK-PP] [--to VVVV-KK-PP] [--identifier Laite_A]
+Vanhan gpio_history.csv-tiedoston voi tuoda mukaan: python history_store.py --import-csv gpio_history.csv
+"""
+
+import argparse
+import bisect
+import csv
+import datetime
+import json
+import logging
+import os
+import struct
+import sys
+# Aikavyöhykkeitä varten (Python 3.9+)
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    try:
+        from pytz import timezone as ZoneInfo
+    except ImportError:
+        print("VIRHE: Aikavyöhykekirjastoa (zoneinfo tai pytz) ei löydy.", file=sys.stderr)
+        sys.exit(1)
+
+# --- Konfiguraatio ja Polut ---
+DATA_DIR = os.path.expanduser('~/gpio_pricer_data')
+HISTORY_DIR = os.path.join(DATA_DIR, 'history')
+LOCAL_TIMEZONE_STR = "Europe/Helsinki"
+RECORD = struct.Struct('<IHHBx')   # aikaleima, pinnikoodi, syykoodi, tila, täyte
+RECORD_SIZE = RECORD.size
+INDEX_ENTRY = struct.Struct('<II') # aikaleima, tietueen järjestysnumero segmentissä
+INDEX_EVERY = 256
+CSV_HEADER = ['Timestamp', 'PinNumber', 'Identifier', 'State', 'Reason']
+
+def _segment_name(epoch):
+    """Palauttaa segmentin nimen (UTC-kuukausi) aikaleimalle."""
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc).strftime('%Y-%m')
+
+def _segment_bounds(segment_name):
+    """Palauttaa segmentin (alku, loppu) UTC epoch -sekunteina."""
+    year, month = (int(part) for part in segment_name.split('-'))
+    start = datetime.datetime(year, month, 1, tzinfo=datetime.timezone.utc)
+    end = datetime.datetime(year + month // 12, month % 12 + 1, 1, tzinfo=datetime.timezone.utc)
+    return int(start.timestamp()), int(end.timestamp())
+
+class HistoryStore:
+    """Kuukausisegmentteihin jaettu binäärihistoria internoiduilla merkkijonoilla ja harvalla indeksillä."""
+
+    def __init__(self, history_dir=HISTORY_DIR):
+        self.history_dir = history_dir
+        self.strings_file = os.path.join(history_dir, 'strings.json')
+        self.pins = []        # koodi -> [tunniste, pinni]
+        self.reasons = []     # koodi -> syyteksti
+        self._pin_codes = {}
+        self._reason_codes = {}
+        self._strings_dirty = False
+        self._load_strings()
+
+    # --- Internointi ---
+
+    def _load_strings(self):
+        if not os.path.exists(self.strings_file): return
+        try:
+            with open(self.strings_file, 'r', encoding='utf-8') as f: data = json.load(f)
+            self.pins = [list(entry) for entry in data.get('pins', [])]
+            self.reasons = list(data.get('reasons', []))
+        except (json.JSONDecodeError, IOError) as e:
+            raise RuntimeError(f"Historian merkkijonotaulu '{self.strings_file}' on viallinen: {e}")
+        self._pin_codes = {(identifier, pin): code for code, (identifier, pin) in enumerate(self.pins)}
+        self._reason_codes = {reason: code for code, reason in enumerate(self.reasons)}
+
+    def _save_strings(self):
+        if not self._strings_dirty: return
+        tmp_path = f"{self.strings_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"pins": self.pins, "reasons": self.reasons}, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.strings_file)
+        self._strings_dirty = False
+
+    def _intern_pin(self, identifier, pin):
+        key = (identifier, int(pin))
+        code = self._pin_codes.get(key)
+        if code is None:
+            code = len(self.pins); self.pins.append([identifier, int(pin)]); self._pin_codes[key] = code; self._strings_dirty = True
+        return code
+
+    def _intern_reason(self, reason):
+        code = self._reason_codes.get(reason)
+        if code is None:
+            code = len(self.reasons); self.reasons.append(reason); self._reason_codes[reason] = code; self._strings_dirty = True
+        return code
+
+    # --- Kirjoitus ---
+
+    def append(self, records):
+        """
+        Lisää tietueet (aikaleima datetime, pinni, tunniste, tila bool, syy) historiaan.
+        Tietueiden oletetaan tulevan aikajärjestyksessä. Palauttaa kirjoitettujen tavujen määrän.
+        """
+        os.makedirs(self.history_dir, exist_ok=True)
+        by_segment = {}
+        for timestamp, pin, identifier, state, reason in records:
+            epoch = int(timestamp.timestamp())
+            packed = RECORD.pack(epoch, self._intern_pin(identifier, pin), self._intern_reason(reason or ""), 1 if state else 0)
+            by_segment.setdefault(_segment_name(epoch), []).append((epoch, packed))
+        self._save_strings() # Merkkijonot ensin, jotta tietueet eivät koskaan viittaa tuntemattomaan koodiin
+        bytes_written = 0
+        for segment, entries in by_segment.items():
+            data_path = os.path.join(self.history_dir, f"{segment}.bin")
+            with open(data_path, 'ab') as f_data:
+                size = f_data.tell()
+                partial = size % RECORD_SIZE
+                if partial: # Keskeytynyt kirjoitus (esim. sähkökatko) jätti vajaan tietueen, joka siirtäisi kaikki seuraavat
+                    logging.warning(f"Historiasegmentin {data_path} lopussa on vajaa tietue ({partial} tavua), se poistetaan ennen lisäystä.")
+                    f_data.truncate(size - partial)
+                record_number = size // RECORD_SIZE
+                index_entries = []
+                for offset, (epoch, _packed) in enumerate(entries):
+                    if (record_number + offset) % INDEX_EVERY == 0: index_entries.append(INDEX_ENTRY.pack(epoch, record_number + offset))
+                payload = b"".join(packed for _epoch, packed in entries)
+                f_data.write(payload); bytes_written += len(payload)
+            if index_entries:
+                with open(os.path.join(self.history_dir, f"{segment}.idx"), 'ab') as f_idx:
+                    index_payload = b"".join(index_entries)
+                    f_idx.write(index_payload); bytes_written += len(index_payload)
+        return bytes_written
+
+    # --- Haku ---
+
+    def segments(self):
+        """Palauttaa segmenttien nimet aikajärjestyksessä."""
+        if not os.path.isdir(self.history_dir): return []
+        return sorted(name[:-4] for name in os.listdir(self.history_dir) if name.endswith('.bin'))
+
+    def _start_record(self, segment, start_epoch):
+        """Etsii harvasta indeksistä tietueen, josta aikavälihaku aloitetaan (O(log n))."""
+        idx_path = os.path.join(self.history_dir, f"{segment}.idx")
+        if start_epoch is None or not os.path.exists(idx_path): return 0
+        with open(idx_path, 'rb') as f: raw = f.read()
+        entries = [INDEX_ENTRY.unpack_from(raw, pos) for pos in range(0, len(raw) - len(raw) % INDEX_ENTRY.size, INDEX_ENTRY.size)]
+        position = bisect.bisect_left([epoch for epoch, _record in entries], start_epoch)
+        return entries[position - 1][1] if position > 0 else 0
+
+    def query(self, start=None, end=None, identifier=None):
+        """
+        Palauttaa generaattorin tietueista (aikaleima datetime UTC, pinni, tunniste, tila bool, syy)
+        aikaväliltä [start, end) (datetime, None = rajaton), valinnaisesti yhdelle tunnisteelle.
+        """
+        start_epoch = int(start.timestamp()) if start else None
+        end_epoch = int(end.timestamp()) if end else None
+        wanted_codes = None
+        if identifier is not None: wanted_codes = {code for code, (pin_id, _pin) in enumerate(self.pins) if pin_id == identifier}
+        for segment in self.segments():
+            segment_start, segment_end = _segment_bounds(segment)
+            if start_epoch is not None and segment_end <= start_epoch: continue
+            if end_epoch is not None and segment_start >= end_epoch: break
+            with open(os.path.join(self.history_dir, f"{segment}.bin"), 'rb') as f:
+                f.seek(self._start_record(segment, start_epoch) * RECORD_SIZE)
+                while True:
+                    chunk = f.read(RECORD_SIZE * 1024)
+                    if not chunk: break
+                    for epoch, pin_code, reason_code, state in RECORD.iter_unpack(chunk[:len(chunk) - len(chunk) % RECORD_SIZE]):
+                        if start_epoch is not None and epoch < start_epoch: continue
+                        if end_epoch is not None and epoch >= end_epoch: return
+                        if wanted_codes is not None and pin_code not in wanted_codes: continue
+                        pin_id, pin = self.pins[pin_code]
+                        yield (datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc), pin, pin_id, bool(state), self.reasons[reason_code])
+
+    def read_since(self, position=None):
+        """
+        Palauttaa generaattorin tietueista kohdasta position ([segmentti, tietueen numero], None = alusta)
+        eteenpäin muodossa (kohta tietueen jälkeen, aikaleima epoch, pinni, tunniste, tila bool).
+        Lisäävä lukija (cost_rollups.py) tallentaa viimeisen kohdan ja lukee seuraavalla kerralla vain uudet tietueet.
+        """
+        start_segment, start_record = position if position else (None, 0)
+        for segment in self.segments():
+            if start_segment is not None and segment < start_segment: continue
+            record_number = start_record if segment == start_segment else 0
+            with open(os.path.join(self.history_dir, f"{segment}.bin"), 'rb') as f:
+                f.seek(record_number * RECORD_SIZE)
+                while True:
+                    chunk = f.read(RECORD_SIZE * 1024)
+                    if not chunk: break
+                    for epoch, pin_code, _reason_code, state in RECORD.iter_unpack(chunk[:len(chunk) - len(chunk) % RECORD_SIZE]):
+                        record_number += 1
+                        pin_id, pin = self.pins[pin_code]
+                        yield [segment, record_number], epoch, pin, pin_id, bool(state)
+
+    # --- CSV-vienti ja -tuonti ---
+
+    def export_csv(self, f_out, start=None, end=None, identifier=None):
+        """Kirjoittaa historian CSV-muodossa (sama sarakkeisto kuin vanha gpio_history.csv). Palauttaa rivimäärän."""
+        local_tz = ZoneInfo(LOCAL_TIMEZONE_STR)
+        writer = csv.writer(f_out); writer.writerow(CSV_HEADER)
+        rows = 0
+        for timestamp, pin, pin_id, state, reason in self.query(start, end, identifier):
+            writer.writerow([timestamp.astimezone(local_tz).isoformat(), pin, pin_id, "ON" if state else "OFF", reason]); rows += 1
+        return rows
+
+    def import_csv(self, f_in):
+        """Tuo vanhan gpio_history.csv-tiedoston rivit historiaan. Palauttaa tuotujen rivien määrän."""
+        records = []
+        for row in csv.DictReader(f_in):
+            try:
+                records.append((datetime.datetime.fromisoformat(row['Timestamp']), int(row['PinNumber']), row['Identifier'], row['State'] == 'ON', row.get('Reason', '')))
+            except (KeyError, ValueError, TypeError): continue
+        records.sort(key=lambda record: record[0].timestamp())
+        self.append(records)
+        return len(records)
+
+# --- Komentorivi ---
+
+def _parse_local_date(date_str):
+    local_date = datetime.date.fromisoformat(date_str)
+    return datetime.datetime.combine(local_date, datetime.time.min).replace(tzinfo=ZoneInfo(LOCAL_TIMEZONE_STR))
+
+def main():
+    parser = argparse.ArgumentParser(description="Tilahistorian vienti CSV-muotoon ja vanhan CSV:n tuonti.")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--export-csv", metavar="TIEDOSTO", help="Vie historia CSV-tiedostoon ('-' = stdout)")
+    group.add_argument("--import-csv", metavar="TIEDOSTO", help="Tuo vanha gpio_history.csv historiaan")
+    parser.add_argument("--from", dest="date_from", help="Alkupäivä (VVVV-KK-PP, paikallinen aika)")
+    parser.add_argument("--to", dest="date_to", help="Loppupäivä (VVVV-KK-PP, mukaan lukien)")
+    parser.add_argument("--identifier", help="Vain tämän pinnin tunnisteen rivit")
+    args = parser.parse_args()
+    store = HistoryStore()
+    if args.import_csv:
+        with open(args.import_csv, 'r', newline='', encoding='utf-8') as f_in: count = store.import_csv(f_in)
+        print(f"Tuotu {count} riviä historiaan: {HISTORY_DIR}", file=sys.stderr)
+        return
+    try:
+        start = _parse_local_date(args.date_from) if args.date_from else None
+        end = _parse_local_date(args.date_to) + datetime.timedelta(days=1) if args.date_to else None
+    except ValueError as e: print(f"VIRHE: Päivämäärämuoto? Käytä VVVV-KK-PP. ({e})", file=sys.stderr); sys.exit(1)
+    if args.export_csv == '-': count = store.export_csv(sys.stdout, start, end, args.identifier)
+    else:
+        with open(args.export_csv, 'w', newline='', encoding='utf-8') as f_out: count = store.export_csv(f_out, start, end, args.identifier)
+    print(f"Viety {count} riviä.", file=sys.stderr)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stderr)
+    main()
@@ -4,31 +4,53 @@
 """
 hourly_control.py
 
-Ajetaan tunneittain (esim. cronilla). Hakee sähkön hinnan, vertaa sitä
+Ajetaan tunneittain (esim. cronilla) tai jatkuvana prosessina (--daemon). Hakee sähkön hinnan, vertaa sitä
 asetuksiin ja ohjaa Raspberry Pi:n GPIO-pinnejä käyttäen 
-api.spot-hinta.fi -palvelun API-kutsuja.
+api.spot-hinta.fi -palvelun API-kutsuja. Pinnit kirjoitetaan config.json:ssa
+valitun ajurin kautta (gpio_backends.py: RPi.GPIO, libgpiod tai muisti).
+
+Pinnien tilat luetaan valmiista aikataulusta (control_schedule.json), jonka
+schedule_builder.py laskee hintavälimuistin (price_cache.py) ja asetusten
+perusteella. Jos kuluvan päivän aikataulua ei ole, se rakennetaan ajon aikana
+välimuistista (enintään yksi bulkkihaku). Vasta jos sekään ei onnistu,
+käytetään varalla api.spot-hinta.fi -palvelun tarkistuksia. Jos aikataulusta
+puuttuu kuluva jakso, pinnit asetetaan turvalliseen OFF-tilaan.
 
 Kirjoittaa ajon päätteeksi yhteenvedon pinnien tiloista JSON-tiedostoon 
-(viimeisin tila) sekä lisää tilatiedot jatkuvaan CSV-historiatiedostoon.
-Molemmat tiedostot tallennetaan DATA_DIR-hakemistoon. 
+(viimeisin tila) sekä lisää tilatiedot tiiviiseen binäärihistoriaan
+(history_store.py, CSV-vienti tarvittaessa). Molemmat tallennetaan DATA_DIR-hakemistoon
+SD-kortin säästämiseksi kirjoituspuskurin kautta (io_spool.py): historia ja loki
+siirretään pysyvään tallennukseen erinä flush_interval_minutes välein.
+Tilamuutokset kirjoitetaan kytkentäsarjana (transition_sequencer.py): OFF ensin,
+ON-kytkennät porrastettuna käynnistysvirtojen rajoittamiseksi.
+Ajon vaiheajat, API-viiveet ja kytkentälaskurit kirjoitetaan mittaritiedostoihin
+(metrics.py: Prometheus textfile ja JSONL); --profile tallentaa yhden ajon
+cProfile- ja tracemalloc-profiilin.
 Asetukset (kokonaislukurajat ct/kWh) luetaan skriptin omasta hakemistosta.
 """
 
-import json
 import requests
 import logging
 import sys
 import os
 import datetime
-import csv 
-try:
-    import RPi.GPIO as GPIO
-except ImportError:
-    print("VIRHE: RPi.GPIO kirjastoa ei löytynyt...", file=sys.stderr)
-    sys.exit(1)
-except RuntimeError:
-     print("VIRHE: Ei voitu ladata RPi.GPIO:ta...", file=sys.stderr)
-     sys.exit(1)
+import time
+import signal
+import asyncio
+import argparse
+import api_client
+import app_config
+import metrics
+import io_spool
+import cost_rollups
+import schedule_builder
+import pin_settings
+import price_provider
+from pin_state_cache import PinStateCache
+from history_store import HISTORY_DIR
+from price_cache import ZoneInfo, LOCAL_TIMEZONE_STR
+import gpio_backends
+import transition_sequencer
 
 # --- Konfiguraatio ja Polut ---
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__)) 
@@ -36,12 +58,11 @@ SETTINGS_FILE = os.path.join(SCRIPT_DIR, 'settings.json')
 DATA_DIR = os.path.expanduser('~/gpio_pricer_data') 
 LOG_FILE = os.path.join(DATA_DIR, 'gpio_control.log') 
 STATUS_FILE = os.path.join(DATA_DIR, 'gpio_current_status.json') 
-CSV_LOG_FILE = os.path.join(DATA_DIR, 'gpio_history.csv')      
-API_BASE_URL = 'https://api.spot-hinta.fi' 
-API_V1_BASE_URL = 'https://api.spot-hinta.fi/v1' 
-API_TIMEOUT = 15 
-GPIO_MODE = GPIO.BCM 
-GPIO.setwarnings(False) 
+API_BASE_URL = app_config.get('spot_hinta_api_url').rstrip('/')   # Vaihdettavissa config.json:lla tai ympäristömuuttujalla
+API_V1_BASE_URL = f"{API_BASE_URL}/v1" 
+API_TIMEOUT = price_provider.DEADLINE_S   # Varapolun tarkistukset haetaan rinnakkain samalla aikarajalla kuin hinnat
+API_MAX_CHEAPEST_HOURS_N = 12   # api.spot-hinta.fi:n N-tarkistuksen yläraja (varapolku)
+DAEMON_SETTINGS_POLL_SECONDS = 30  # Jatkuva ajo: settings.json-muutosten tarkistusväli
 
 # --- Lokituksen Asetukset ---
 try:
@@ -50,85 +71,65 @@ try:
 except OSError as e:
      print(f"KRIITTINEN VIRHE lokihakemiston luonnissa: {e}", file=sys.stderr)
 try:
-    logging.basicConfig( level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', filename=LOG_FILE, filemode='a' )
+    logging.basicConfig( level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[io_spool.get_spool().log_handler(LOG_FILE)] )
 except Exception as e: # Laajennettu virheenkäsittely, jos PermissionError ei ole ainoa mahdollinen
      logging.basicConfig( level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stderr )
      logging.error(f"*** VIRHE LOKITIEDOSTOON KIRJOITTAMISESSA ({LOG_FILE}), syy: {e}. Lokitetaan stderr:iin. ***")
 
 # --- Apufunktiot ---
 
+@metrics.timed('settings')
 def load_settings():
-    """Lataa asetukset JSON-tiedostosta ja varmistaa rajojen olevan kokonaislukuja."""
-    settings_path = os.path.abspath(SETTINGS_FILE) 
-    logging.info(f"Ladataan asetukset tiedostosta: {settings_path}")
-    if not os.path.exists(settings_path): logging.error(f"Asetustiedostoa '{settings_path}' ei löydy."); return None
-    try:
-        with open(settings_path, 'r', encoding='utf-8') as f:
-            settings_list = json.load(f)
-            if not isinstance(settings_list, list): logging.error(f"Asetustiedosto '{settings_path}' ei sisältänyt listaa."); return None
-            
-            valid_settings = []
-            required_keys = {'gpio_pin', 'upper_limit_ct_kwh', 'lower_limit_ct_kwh', 'cheapest_hours_n'}
-            
-            for i, item in enumerate(settings_list):
-                 is_valid_entry = False
-                 if isinstance(item, dict) and required_keys.issubset(item.keys()):
-                      try:
-                           # --- MUUTOS: Varmista ja muunna rajat kokonaisluvuiksi ---
-                           pin = int(item['gpio_pin'])
-                           upper_limit = int(item['upper_limit_ct_kwh'])
-                           lower_limit = int(item['lower_limit_ct_kwh'])
-                           n_value = int(item['cheapest_hours_n'])
-
-                           # Tee lisätarkistuksia
-                           if not (0 <= n_value <= 12): raise ValueError(f"N ({n_value}) ei ole välillä 0-12")
-                           if not (lower_limit <= upper_limit): raise ValueError("Alarajan tulee olla <= yläraja")
-                           if pin <= 0: raise ValueError("Pinninumeron tulee olla positiivinen")
-
-                           # Tallenna kokonaislukuina (vaikka configure_settings tallentaakin jo näin)
-                           item['upper_limit_ct_kwh'] = upper_limit
-                           item['lower_limit_ct_kwh'] = lower_limit
-                           item['cheapest_hours_n'] = n_value
-                           item['gpio_pin'] = pin
-                           # --- MUUTOS LOPPUU ---
-
-                           if 'identifier' not in item or not item['identifier']: item['identifier'] = f"Pin_{pin}"
-                           valid_settings.append(item)
-                           is_valid_entry = True
-
-                      except (ValueError, TypeError, KeyError) as e:
-                           logging.warning(f"Ohitetaan asetusrivi {i+1} virheellisen arvon vuoksi: {item}. Virhe: {e}")
-                 
-                 if not is_valid_entry and isinstance(item, dict): 
-                      if not required_keys.issubset(item.keys()): logging.warning(f"Ohitetaan asetusrivi {i+1} puuttuvien avainten vuoksi")
-                      # Muita mahdollisia virheitä logattu jo ylempänä try-exceptissä
-
-            if not valid_settings: logging.error("Asetustiedosto ei sisältänyt yhtään kelvollista pinnimääritystä."); return None
-            logging.info(f"Löytyi {len(valid_settings)} kelvollista pinnin asetusta.")
-            return valid_settings
-            
-    except json.JSONDecodeError as e: logging.error(f"Asetustiedosto '{settings_path}' on virheellinen JSON: {e}"); return None
-    except IOError as e: logging.error(f"Asetustiedoston '{settings_path}' lukeminen epäonnistui: {e}"); return None
-    except Exception as e: logging.error(f"Odottamaton virhe ladattaessa asetuksia: {e}"); return None
-
-def setup_gpio():
-    """Alustaa GPIO-kirjaston."""
-    try: GPIO.setmode(GPIO_MODE); logging.info(f"GPIO-tila asetettu: {GPIO_MODE} (BCM)")
-    except Exception as e: logging.error(f"GPIO-tilan ({GPIO_MODE}) asetus epäonnistui: {e}"); raise RuntimeError(f"GPIO alustus epäonnistui: {e}")
-
-def set_gpio_state(pin_number, state, identifier=""):
-    """Asettaa annetun GPIO-pinnin tilan (True=ON, False=OFF)."""
-    pin_id_str = f"Pinni {pin_number} ({identifier})" if identifier else f"Pinni {pin_number}"
-    target_state_str = "ON (HIGH)" if state else "OFF (LOW)"
-    gpio_value = GPIO.HIGH if state else GPIO.LOW
-    try:
-        GPIO.setup(pin_number, GPIO.OUT) 
-        GPIO.output(pin_number, gpio_value)
-        logging.info(f"{pin_id_str}: Tila asetettu -> {target_state_str}")
-        return True
-    except Exception as e: logging.error(f"{pin_id_str}: GPIO-virhe tilaa {target_state_str} asettaessa: {e}"); return False
+    """Lataa ja validoi asetukset (pin_settings.py, käännetty välimuisti). Palauttaa listan PinRule-olioita tai None."""
+    return pin_settings.load_settings(SETTINGS_FILE) or None
+
+_gpio_backend = None # GPIO-ajuri (gpio_backends.py), luodaan kerran prosessia kohden
+
+def setup_gpio(pins=None, pin_cache=None):
+    """
+    Alustaa config.json:ssa valitun GPIO-ajurin (oletus RPi.GPIO) kerran prosessia kohden. Palauttaa ajurin.
+    pins: asetusten kaikki ulostulopinnit, jotka ajuri varaa kerralla (libgpiod) tilavälimuistin
+    tiloilla (tuntematon = OFF); jo varattuja pinnejä ei varata uudelleen.
+    """
+    global _gpio_backend
+    if _gpio_backend is None:
+        try: _gpio_backend = gpio_backends.create_backend(); logging.info(f"GPIO-ajuri: {_gpio_backend.name} (BCM-numerointi)")
+        except Exception as e: raise RuntimeError(f"GPIO-ajurin alustus epäonnistui: {e}")
+    if pins: _gpio_backend.claim({pin: bool(pin_cache and pin_cache.known_state(pin)) for pin in pins})
+    return _gpio_backend
+
+@metrics.timed('gpio')
+def set_gpio_states(changes, rules_by_pin=None):
+    """
+    Asettaa yhden päätöskierroksen muuttuneet pinnit ajurin kautta kytkentäsarjana
+    (transition_sequencer.py: OFF ensin, ON porrastettuna). changes: lista (pinni, tila,
+    tunniste), rules_by_pin: {pinni: PinRule}. Palauttaa onnistuneet.
+    """
+    if not changes: return []
+    written = transition_sequencer.apply_transitions(setup_gpio(), changes, rules_by_pin)
+    applied = []
+    for pin, state, identifier in changes:
+        pin_id_str = f"Pinni {pin} ({identifier})" if identifier else f"Pinni {pin}"
+        target_state_str = "ON (HIGH)" if state else "OFF (LOW)"
+        if pin in written: logging.info(f"{pin_id_str}: Tila asetettu -> {target_state_str}"); applied.append((pin, state, identifier))
+        else: logging.error(f"{pin_id_str}: GPIO-virhe tilaa {target_state_str} asettaessa")
+    return applied
 
 # --- API-KUTSUFUNKTIOT ---
+# Kaikki kutsut kulkevat api_client-moduulin kautta (yhteyspooli, muistiinpano
+# URL:n mukaan, nopeusrajoitin), joten sama URL haetaan ajon aikana vain kerran.
+
+JUSTNOW_HEADERS = {'accept': 'text/plain'}
+
+def price_limits_url(lower_limit_ct_int, upper_limit_ct_int):
+    """Muodostaa /JustNow/{lower}/{upper} URL:n kokonaislukurajoista (alaraja rajataan ylärajaan)."""
+    upper_limit = int(upper_limit_ct_int)
+    lower_limit = min(int(lower_limit_ct_int), upper_limit)
+    return f"{API_BASE_URL}/JustNow/{lower_limit}/{upper_limit}"
+
+def cheapest_hour_url(num_hours):
+    """Muodostaa /CheapestPeriodTodayCheck/{hours} URL:n."""
+    return f"{API_BASE_URL}/CheapestPeriodTodayCheck/{num_hours}"
 
 # ===== MUUTETTU FUNKTIO =====
 def check_price_limits(lower_limit_ct_int, upper_limit_ct_int):
@@ -146,9 +147,9 @@ def check_price_limits(lower_limit_ct_int, upper_limit_ct_int):
              logging.warning(f"check_price_limits sai alarajan ({lower_limit_int_checked}), joka on suurempi kuin yläraja ({upper_limit_int_checked}). Käytetään ylärajaa molemmissa.")
              lower_limit_int_checked = upper_limit_int_checked
 
-        url = f"{API_BASE_URL}/JustNow/{lower_limit_int_checked}/{upper_limit_int_checked}" 
+        url = price_limits_url(lower_limit_int_checked, upper_limit_int_checked) 
         logging.info(f"API-KUTSU: {url} (Rajat ct/kWh kokonaislukuina)") 
-        response = requests.get(url, timeout=API_TIMEOUT, headers={'accept': 'text/plain'}) 
+        response = api_client.get(url, timeout=API_TIMEOUT, headers=JUSTNOW_HEADERS) 
         
         if response.status_code == 404: logging.error(f"API VIRHE: HTTP 404 kutsussa {url}. API ei löytänyt hintatietoja."); return None 
         elif response.status_code == 429: logging.error(f"API VIRHE: HTTP 429 kutsussa {url}. Liikaa pyyntöjä."); return None
@@ -172,10 +173,10 @@ def check_if_cheapest_hour(num_hours):
     """Kutsuu API:a /CheapestPeriodTodayCheck/{hours} tarkistaakseen, kuuluuko tunti N halvimpiin (1-12)."""
     # ...(sisältö sama kuin edellisessä versiossa)...
     if not 1 <= num_hours <= 12: logging.warning(f"API /CheapestPeriodTodayCheck tukee vain 1-12h, pyydetty N={num_hours}."); return None 
-    url = f"{API_BASE_URL}/CheapestPeriodTodayCheck/{num_hours}"
+    url = cheapest_hour_url(num_hours)
     logging.info(f"API-KUTSU: {url}")
     try:
-        response = requests.get(url, timeout=API_TIMEOUT); status_code = response.status_code
+        response = api_client.get(url, timeout=API_TIMEOUT); status_code = response.status_code
         logging.info(f"API VASTAUS: CheapestPeriodTodayCheck -> Status {status_code}")
         if status_code == 200: return True 
         elif status_code == 400: logging.info(f"API Info: (N={num_hours}) palautti 400 - tunti ei halvin."); return False 
@@ -188,38 +189,43 @@ def check_if_cheapest_hour(num_hours):
     except requests.exceptions.RequestException as e: logging.error(f"API VIRHE: Yleinen Request-virhe kutsussa {url}: {e}"); return None 
     except Exception as e: logging.error(f"Odottamaton virhe check_if_cheapest_hour funktiossa: {e}"); return None 
 
-# --- Pääohjelma ---
-
-def main():
-    """Pääohjelma, joka ajetaan tunneittain."""
-    start_time = datetime.datetime.now(datetime.timezone.utc).astimezone() 
-    logging.info("===== Ohjausohjelma Käynnistyy =====")
-    pin_final_statuses = {} 
-    try: os.makedirs(DATA_DIR, exist_ok=True); logging.info(f"Varmistettu datahakemiston olemassaolo: {DATA_DIR}")
-    except OSError as e: logging.critical(f"KRIITTINEN VIRHE datahakemiston '{DATA_DIR}' luonnissa: {e}. Lopetetaan."); sys.exit(1)
-    try: setup_gpio()
-    except RuntimeError as e: logging.critical(f"GPIO alustus epäonnistui: {e}. Lopetetaan."); sys.exit(1) 
-    
-    # Lataa asetukset (joiden pitäisi nyt sisältää kokonaislukurajat)
-    settings_list = load_settings()
-    if not settings_list: logging.error("Asetuksia ei voitu ladata. Lopetetaan."); sys.exit(1) 
-
-    for setting in settings_list:
+def prefetch_api_checks(settings_list):
+    """
+    Hakee varapolun API-tarkistukset rinnakkain etukäteen: yksi kutsu jokaista
+    erillistä rajaparia ja N-arvoa kohden pinnien määrästä riippumatta.
+    Pinnisilmukan check_*-kutsut saavat tuloksen api_clientin muistiinpanosta.
+    """
+    limit_urls, cheapest_urls = set(), set()
+    for rule in settings_list:
+        limit_urls.add(price_limits_url(rule.lower_limit_ct_kwh, rule.upper_limit_ct_kwh))
+        if 1 <= rule.cheapest_hours_n <= API_MAX_CHEAPEST_HOURS_N: cheapest_urls.add(cheapest_hour_url(rule.cheapest_hours_n))
+    api_client.prefetch(limit_urls, timeout=API_TIMEOUT, headers=JUSTNOW_HEADERS)
+    # N-tarkistus tarvitaan vain, jos jokin hinta on rajojen välissä, mutta
+    # erillisiä N-arvoja on vähän, joten ne haetaan samalla kertaa rinnakkain.
+    api_client.prefetch(cheapest_urls, timeout=API_TIMEOUT)
+    logging.info(f"API-tarkistukset haettu: {len(limit_urls)} rajaparia, {len(cheapest_urls)} N-arvoa ({len(settings_list)} pinniä)")
+
+def decide_from_api(settings_list):
+    """
+    Varapolku: pinnikohtaiset päätökset api.spot-hinta.fi -tarkistuksilla. Käytetään vain,
+    jos kuluvan päivän aikataulua ei ole eikä sitä voitu rakentaa hintavälimuistista.
+    Palauttaa listan (tunniste, pinni, tila, syy).
+    """
+    prefetch_api_checks(settings_list)
+    decisions = []
+    for rule in settings_list:
         try:
-            # Luetaan arvot ja varmistetaan tyypit (erityisesti rajat kokonaislukuina)
-            pin = int(setting['gpio_pin']) 
-            identifier = setting.get('identifier', f'Pinni_{pin}') 
-            upper_limit_ct = int(setting['upper_limit_ct_kwh']) 
-            lower_limit_ct = int(setting['lower_limit_ct_kwh']) 
-            rank_n = int(setting.get('cheapest_hours_n', 0)) 
-            # Varmistetaan vielä N:n arvo (0-12)
-            if not (0 <= rank_n <= 12): rank_n = 0
+            # Arvot on validoitu ja muunnettu kokonaisluvuiksi jo latauksessa (pin_settings.py)
+            pin, identifier = rule.gpio_pin, rule.identifier
+            upper_limit_ct, lower_limit_ct = rule.upper_limit_ct_kwh, rule.lower_limit_ct_kwh
+            rank_n = rule.cheapest_hours_n
+            # API:n N-tarkistus tukee vain arvoja 0-12
+            if rank_n > API_MAX_CHEAPEST_HOURS_N: rank_n = 0
 
             logging.info(f"--- Käsitellään: {identifier} (GPIO {pin}) ---")
             # Tulostetaan nyt kokonaislukurajat lokiin selkeyden vuoksi
-            logging.info(f"Asetukset: Yläraja={upper_limit_ct} ct/kWh, Alaraja={lower_limit_ct} ct/kWh, N={rank_n} (0-12)")
+            logging.info(f"Asetukset: Yläraja={upper_limit_ct} ct/kWh, Alaraja={lower_limit_ct} ct/kWh, N={rank_n} (0-{API_MAX_CHEAPEST_HOURS_N})")
 
-            # === MUUTOS: Annetaan check_price_limits funktiolle suoraan kokonaisluvut ===
             limit_check_result = check_price_limits(lower_limit_ct, upper_limit_ct) 
 
             desired_state = None 
@@ -260,42 +266,258 @@ def main():
                  reason_string = "Kriittinen logiikkavirhe" 
                  desired_state = False
 
-            # Tallenna lopullinen tila ja syy dictionaryyn
-            pin_final_statuses[identifier] = { "pin": pin, "state": "ON" if desired_state else "OFF",
-                "reason": reason_string, "timestamp": start_time.isoformat() }
+            decisions.append((identifier, pin, desired_state, reason_string))
 
-            # Aseta GPIO-pinnin tila
-            set_gpio_state(pin, desired_state, identifier)
+        except Exception as e: logging.error(f"Odottamaton virhe: {rule}: {e}"); continue 
+    return decisions
 
-        except KeyError as e: logging.error(f"Asetusvirhe: Avainta {e} ei löytynyt: {setting}. Ohitetaan."); continue 
-        except (ValueError, TypeError) as e: logging.error(f"Asetusvirhe: Virheellinen arvo: {setting}: {e}. Ohitetaan."); continue
-        except Exception as e: logging.error(f"Odottamaton virhe: {setting}: {e}"); continue 
+# --- Ohjauksen vaiheet (yhteiset kertaajolle ja jatkuvalle ajolle) ---
 
-    # --- KIRJOITETAAN TIEDOSTOT AJON LOPUKSI ---
-    # (CSV ja JSON kirjoitus sama kuin edellisessä versiossa)
+@metrics.timed('schedule')
+def get_day_schedule(local_date, now, settings_list=None, rebuild=False):
+    """
+    Palauttaa (päivän aikataulu tai None, settings_list). Lukee aikataulun
+    control_schedule.json-tiedostosta; jos päivää ei ole (tai rebuild=True),
+    rakentaa sen hintavälimuistista. Asetukset ladataan vain tarvittaessa.
+    """
+    day_schedule = None if rebuild else schedule_builder.load_day(local_date)
+    if day_schedule is None:
+        if not rebuild: logging.warning(f"Päivän {local_date.isoformat()} aikataulua ei löytynyt. Rakennetaan se hintavälimuistista.")
+        if settings_list is None: settings_list = load_settings()
+        if settings_list:
+            try: day_schedule = schedule_builder.build_and_save(settings_list, local_date, now=now)
+            except Exception as e: logging.error(f"Aikataulun rakentaminen epäonnistui: {e}")
+    return day_schedule, settings_list
+
+@metrics.timed('decisions')
+def decide_states(local_now, day_schedule, settings_list):
+    """
+    Palauttaa (päätökset, jakso) kuluvalle jaksolle: aikataulusta tai varalla API-tarkistuksilla.
+    Päätökset ovat listan (tunniste, pinni, tila, syy); jakso on {"slot": "HH:MM", "resolution_minutes": min} tai None.
+    """
+    if day_schedule is not None:
+        # Valmis aikataulu: jakson indeksi suoraan kellonajasta, O(pinnit) haku ilman verkkoa ja hintalogiikkaa
+        slot_index = schedule_builder.slot_index_at(day_schedule, local_now.timestamp())
+        decisions = schedule_builder.lookup_states(day_schedule, slot_index)
+        slot_label = day_schedule['slots'][slot_index] if slot_index is not None else None
+        logging.info(f"Aikataulu: jakso {slot_label} ({day_schedule['resolution_minutes']} min), {len(decisions)} pinniä")
+        return decisions, {"slot": slot_label, "resolution_minutes": day_schedule['resolution_minutes']}
+    if not settings_list: logging.error("Aikataulua tai asetuksia ei ole. Ei ohjattavia pinnejä."); return [], None
+    logging.warning("Aikataulua ei voitu luoda. Käytetään API-tarkistuksia.")
+    return decide_from_api(settings_list), {"slot": local_now.strftime('%H:00'), "resolution_minutes": 60}
+
+def apply_decisions(decisions, run_time, pin_cache, slot_info=None, settings_list=None):
+    """
+    Asettaa GPIO-pinnien tilat ja palauttaa tilayhteenvedon {tunniste: {...}}.
+    Vain pinnit, joiden tavoitetila poikkeaa tilavälimuistin tilasta, kirjoitetaan (kytkentäsarjana).
+    slot_info ({"slot", "resolution_minutes"}) lisätään tilatietoihin; settings_list antaa
+    kytkentäsarjalle pinnien prioriteetit ja käynnistysvirtojen kestot.
+    """
+    pin_final_statuses = {}
+    for identifier, pin, desired_state, reason_string in decisions:
+        # Tallenna lopullinen tila ja syy dictionaryyn
+        pin_final_statuses[identifier] = { "pin": pin, "state": "ON" if desired_state else "OFF",
+            "reason": reason_string, "timestamp": run_time.isoformat() }
+        if slot_info: pin_final_statuses[identifier].update(slot_info)
+    changes = pin_cache.pending_changes(decisions, run_time)
+    if settings_list is None and transition_sequencer.is_staggered(changes): settings_list = load_settings()   # Prioriteetit ja käynnistysvirrat
+    applied = set_gpio_states(changes, {rule.gpio_pin: rule for rule in settings_list or []})
+    for pin, state, identifier in applied: pin_cache.record_write(pin, state, identifier, run_time)
+    with metrics.phase('file_io'): pin_cache.save()
+    metrics.record_pins(pin_cache, written=len(applied), decided=len(decisions))
+    logging.info(f"GPIO: kirjoitettu {len(applied)}/{len(decisions)} pinniä ({len(decisions) - len(changes)} ennallaan)")
+    return pin_final_statuses
+
+@metrics.timed('file_io')
+def write_run_outputs(pin_final_statuses, run_time, settings_list=None):
+    """
+    Lisää tilat binäärihistoriaan (history_store.py) ja kirjoittaa viimeisimmän tilan JSON-tiedostoon
+    kirjoituspuskurin kautta (io_spool.py), ja tyhjentää puskurin, jos tyhjennysväli on täynnä.
+    Kun historia on pysyvässä tallennuksessa, kustannuskoosteet (cost_rollups.py) päivitetään.
+    """
+    spool = io_spool.get_spool()
     try:
-        csv_file_path = os.path.abspath(CSV_LOG_FILE); file_exists = os.path.isfile(csv_file_path)
-        needs_header = not file_exists or os.path.getsize(csv_file_path) == 0
-        logging.info(f"Kirjoitetaan tilahistoriaa CSV: {csv_file_path}")
-        with open(csv_file_path, 'a', newline='', encoding='utf-8') as f_csv:
-            csv_writer = csv.writer(f_csv); 
-            if needs_header: csv_writer.writerow(['Timestamp', 'PinNumber', 'Identifier', 'State', 'Reason'])
-            run_timestamp_iso = start_time.isoformat() 
-            for identifier in sorted(pin_final_statuses.keys()):
-                info = pin_final_statuses[identifier]
-                csv_writer.writerow([ run_timestamp_iso, info.get('pin'), identifier, info.get('state'), info.get('reason') ])
-    except Exception as e: logging.error(f"VIRHE CSV-kirjoituksessa: {e}")
+        records = [(run_time, info.get('pin'), identifier, info.get('state') == "ON", info.get('reason'))
+                   for identifier, info in sorted(pin_final_statuses.items())]
+        spool.append_history(records)
+        logging.info(f"Tilahistoria päivitetty: {len(records)} tietuetta ({spool.spool_dir or HISTORY_DIR})")
+    except Exception as e: logging.error(f"VIRHE historian kirjoituksessa: {e}")
     try:
         status_file_path = os.path.abspath(STATUS_FILE) 
-        logging.info(f"Päivitetään JSON-status: {status_file_path}")
-        with open(status_file_path, 'w', encoding='utf-8') as f_status:
-            json.dump(pin_final_statuses, f_status, indent=4, ensure_ascii=False, sort_keys=True) 
+        if spool.write_status(status_file_path, pin_final_statuses): logging.info(f"Päivitetty JSON-status: {status_file_path}")
     except Exception as e: logging.error(f"VIRHE JSON-kirjoituksessa: {e}")
+    flushed = 0
+    try: flushed = spool.maybe_flush(run_time.timestamp())
+    except Exception as e: logging.error(f"VIRHE kirjoituspuskurin tyhjennyksessä: {e}")
+    if flushed or not spool.enabled:
+        try: cost_rollups.update_rollups(settings_list)
+        except Exception as e: logging.error(f"VIRHE kustannuskoosteiden päivityksessä: {e}")
+    metrics.set_gauge('storage_bytes_written_today', spool.bytes_today())
+    metrics.set_gauge('storage_spool_pending_bytes', spool.pending_bytes())
+
+# --- Jatkuva ajo (--daemon) ---
+
+def _file_mtime(path):
+    """Palauttaa tiedoston mtime_ns-arvon tai None, jos tiedostoa ei ole."""
+    try: return os.stat(path).st_mtime_ns
+    except OSError: return None
+
+class ControlDaemon:
+    """
+    Pitkäkestoinen ohjausprosessi: asetukset, aikataulu ja GPIO-alustus pysyvät
+    muistissa, ja uudet tilat asetetaan heti jokaisen jakson (tunti tai 15 min)
+    rajalla. Asetukset ladataan uudelleen SIGHUP-signaalilla tai kun
+    settings.json-tiedoston mtime muuttuu; SIGTERM/SIGINT lopettaa hallitusti.
+    """
+
+    def __init__(self):
+        self.settings_list = None
+        self.settings_mtime = None
+        self.day_schedule = None
+        self.schedule_key = None      # (päivä, control_schedule.json mtime)
+        self.reload_requested = False
+        self.stop_event = None
+        self.wake_event = None
+        self.cycle_lock = None
+        self.pin_cache = PinStateCache.load()
+
+    def reload_settings(self):
+        """Lataa asetukset uudelleen. Virheellinen tiedosto ei korvaa edellisiä asetuksia."""
+        self.settings_mtime = _file_mtime(SETTINGS_FILE)
+        settings_list = load_settings()
+        if settings_list:
+            self.settings_list = settings_list
+            setup_gpio([rule.gpio_pin for rule in settings_list], self.pin_cache)
+            return True
+        logging.error("Asetusten uudelleenlataus epäonnistui. Käytetään edellisiä asetuksia.")
+        return False
+
+    def settings_changed(self):
+        return self.reload_requested or _file_mtime(SETTINGS_FILE) != self.settings_mtime
+
+    def run_cycle(self):
+        """Yksi ohjauskierros: tarvittaessa asetusten ja aikataulun päivitys, tilojen asetus ja tiedostot."""
+        cycle_started = datetime.datetime.now(datetime.timezone.utc).astimezone()
+        cycle_clock = time.perf_counter()
+        metrics.begin_run()
+        local_now = cycle_started.astimezone(ZoneInfo(LOCAL_TIMEZONE_STR))
+        rebuild = False
+        if self.settings_changed():
+            logging.info("Asetukset muuttuneet, ladataan uudelleen ja rakennetaan päivän aikataulu.")
+            self.reload_requested = False
+            rebuild = self.reload_settings()
+        schedule_key = (local_now.date(), _file_mtime(schedule_builder.SCHEDULE_FILE))
+        if rebuild or self.day_schedule is None or schedule_key != self.schedule_key:
+            self.day_schedule, _ = get_day_schedule(local_now.date(), cycle_started, self.settings_list, rebuild=rebuild)
+            self.schedule_key = (local_now.date(), _file_mtime(schedule_builder.SCHEDULE_FILE))
+        decisions, slot_info = decide_states(local_now, self.day_schedule, self.settings_list)
+        pin_final_statuses = apply_decisions(decisions, cycle_started, self.pin_cache, slot_info, self.settings_list)
+        write_run_outputs(pin_final_statuses, cycle_started, self.settings_list)
+        api_client.reset_run_cache()
+        metrics.write_outputs(cycle_started, time.perf_counter() - cycle_clock, mode='daemon')
+
+    async def _run_cycle(self):
+        """
+        Ajaa kierroksen säikeessä, jotta porrastetun kytkentäsarjan odotukset (time.sleep) eivät
+        pysäytä tapahtumasilmukkaa (signaalit, lopetus). Lukko pitää kierrokset peräkkäisinä.
+        """
+        async with self.cycle_lock: await asyncio.to_thread(self.run_cycle)
+
+    def slot_seconds(self):
+        """Herätysväli: aikataulun resoluutio (oletus 60 min)."""
+        return int((self.day_schedule or {}).get('resolution_minutes', 60)) * 60
+
+    def _request_reload(self):
+        logging.info("SIGHUP vastaanotettu: asetukset ladataan uudelleen.")
+        self.reload_requested = True
+        self.wake_event.set()
+
+    async def _wait(self, event, timeout_s):
+        """Odottaa tapahtumaa enintään timeout_s sekuntia. Palauttaa True, jos tapahtuma laukesi."""
+        try: await asyncio.wait_for(event.wait(), timeout=max(0.0, timeout_s)); return True
+        except asyncio.TimeoutError: return False
+
+    async def _watch_settings(self):
+        """Tarkkailee asetustiedostoa ja SIGHUP-pyyntöjä jaksojen välissä."""
+        while not self.stop_event.is_set():
+            await self._wait(self.wake_event, DAEMON_SETTINGS_POLL_SECONDS)
+            self.wake_event.clear()
+            if not self.stop_event.is_set() and self.settings_changed(): await self._run_cycle()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event(); self.wake_event = asyncio.Event(); self.cycle_lock = asyncio.Lock()
+        loop.add_signal_handler(signal.SIGHUP, self._request_reload)
+        for sig in (signal.SIGTERM, signal.SIGINT): loop.add_signal_handler(sig, self.stop_event.set)
+        self.reload_settings()
+        await self._run_cycle()
+        watcher = asyncio.create_task(self._watch_settings())
+        while not self.stop_event.is_set():
+            slot_s = self.slot_seconds()
+            boundary = (int(time.time()) // slot_s + 1) * slot_s
+            # Odotetaan jakson rajaan asti; tarkistetaan jäljellä oleva aika uudelleen seinäkellosta
+            while not self.stop_event.is_set() and time.time() < boundary:
+                await self._wait(self.stop_event, boundary - time.time())
+            if self.stop_event.is_set(): break
+            lateness_ms = (time.time() - boundary) * 1000
+            cycle_start = time.monotonic()
+            await self._run_cycle()
+            logging.info(f"Jakson raja {datetime.datetime.fromtimestamp(boundary, ZoneInfo(LOCAL_TIMEZONE_STR)).strftime('%H:%M')}: viive {lateness_ms:.1f} ms, kierros {(time.monotonic() - cycle_start) * 1000:.1f} ms")
+        self.wake_event.set(); await watcher
+        api_client.close()
+        logging.info("===== Jatkuva ajo lopetettu =====")
+        spool = io_spool.get_spool()
+        if spool.flush(): cost_rollups.update_rollups(self.settings_list)
+        spool.save_state()
+
+def run_daemon():
+    """Käynnistää jatkuvan ajon."""
+    logging.info("===== Ohjausohjelma Käynnistyy (jatkuva ajo) =====")
+    try: os.makedirs(DATA_DIR, exist_ok=True)
+    except OSError as e: logging.critical(f"KRIITTINEN VIRHE datahakemiston '{DATA_DIR}' luonnissa: {e}. Lopetetaan."); sys.exit(1)
+    try: setup_gpio()
+    except RuntimeError as e: logging.critical(f"GPIO alustus epäonnistui: {e}. Lopetetaan."); sys.exit(1)
+    asyncio.run(ControlDaemon().run())
+
+# --- Pääohjelma ---
+
+def main():
+    """Pääohjelma, joka ajetaan tunneittain."""
+    start_time = datetime.datetime.now(datetime.timezone.utc).astimezone() 
+    start_clock = time.perf_counter()
+    metrics.begin_run()
+    logging.info("===== Ohjausohjelma Käynnistyy =====")
+    try: os.makedirs(DATA_DIR, exist_ok=True); logging.info(f"Varmistettu datahakemiston olemassaolo: {DATA_DIR}")
+    except OSError as e: logging.critical(f"KRIITTINEN VIRHE datahakemiston '{DATA_DIR}' luonnissa: {e}. Lopetetaan."); sys.exit(1)
+    try: backend = setup_gpio()
+    except RuntimeError as e: logging.critical(f"GPIO alustus epäonnistui: {e}. Lopetetaan."); sys.exit(1) 
+    if backend.name == 'gpiod':
+        logging.warning("libgpiod-ajuri kertaajossa: linjat vapautuvat ajon päättyessä, mutta tilavälimuisti ei kirjoita niitä uudelleen "
+                        "ennen tilan muutosta (varaus palauttaa vain muistetut tilat ajon ajaksi). Käytä jatkuvaa ajoa (--daemon).")
+
+    local_now = start_time.astimezone(ZoneInfo(LOCAL_TIMEZONE_STR))
+    day_schedule, settings_list = get_day_schedule(local_now.date(), start_time)
+    if day_schedule is None and not settings_list: logging.error("Asetuksia ei voitu ladata. Lopetetaan."); sys.exit(1) 
+    decisions, slot_info = decide_states(local_now, day_schedule, settings_list)
+    pin_cache = PinStateCache.load()
+    setup_gpio([pin for _identifier, pin, _state, _reason in decisions], pin_cache)   # Aikataulun pinnit = asetusten pinnit
+    pin_final_statuses = apply_decisions(decisions, start_time, pin_cache, slot_info, settings_list)
+
+    # --- KIRJOITETAAN TIEDOSTOT AJON LOPUKSI ---
+    write_run_outputs(pin_final_statuses, start_time, settings_list)
             
-    end_time = datetime.datetime.now(datetime.timezone.utc).astimezone()
-    duration = end_time - start_time
-    logging.info(f"===== Ohjausohjelma Valmis (Kesto: {duration.total_seconds():.2f} s) =====")
+    api_client.close()
+    duration_s = time.perf_counter() - start_clock
+    metrics.write_outputs(start_time, duration_s)
+    logging.info(f"===== Ohjausohjelma Valmis (Kesto: {duration_s:.2f} s) =====")
 
 # --- Pääohjelman Suoritus ---
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Ohjaa GPIO-pinnejä valmiin aikataulun (control_schedule.json) mukaan.")
+    parser.add_argument("--daemon", action="store_true", help="Jatkuva ajo: tilat asetetaan jokaisen jakson rajalla (cronin sijaan)")
+    parser.add_argument("--profile", action="store_true", help=f"Profiloi yksi ajo (cProfile + tracemalloc), tulokset: {metrics.PROFILE_DIR}")
+    args = parser.parse_args()
+    if args.daemon and args.profile: parser.error("--profile profiloi yhden kertaajon, eikä sitä voi yhdistää --daemon-valintaan.")
+    if args.daemon: run_daemon()
+    elif args.profile: metrics.profile_call(main)
+    else: main()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+io_spool.py
+
+SD-kortille ystävällinen kirjoituspolku ohjausajon tiedostoille.
+
+Jokainen ajo (15 min resoluutiolla 96 kertaa vuorokaudessa) kirjoittaisi muuten
+lokiin, historiaan, mittarivirtaan ja tilatiedostoon useita pieniä lohkoja.
+Tämä moduuli puskuroi ne RAM-levylle (tmpfs, oletuksena /dev/shm) ja siirtää
+ne DATA_DIR-hakemistoon isoina erinä:
+
+* Historia (history_store.py) ja lisäävät tekstitiedostot (gpio_control.log,
+  metrics.jsonl) kirjoitetaan ensin puskurihakemistoon. Puskuri tyhjennetään
+  pysyvään tallennukseen, kun edellisestä tyhjennyksestä on kulunut
+  flush_interval_minutes (config.json). Sähkökatkossa menetetään siis enintään
+  tämän verran historiaa (pyöristettynä ylöspäin seuraavaan ajoon).
+  Tyhjennettävä tiedosto nimetään ensin .flushing-nimelle, joten tyhjennyksen
+  aikana kirjoitetut rivit menevät uuteen puskuritiedostoon. Jos tyhjennys
+  keskeytyy, .flushing-tiedosto siirretään seuraavalla kerralla: historiasta
+  ohitetaan tietueet, jotka ehdittiin jo tallentaa, mutta tekstitiedostoihin
+  keskeytyneen erän rivit voivat tällöin tulla kahdesti.
+* Tilatiedosto (gpio_current_status.json) kirjoitetaan atomisesti (väliaikainen
+  tiedosto + rename). Tuore kopio on puskurihakemistossa; pysyvä kopio
+  kirjoitetaan vain, kun pinnien tila tai syy muuttuu (aikaleimoja
+  huomioimatta), sekä tyhjennyksen yhteydessä, jos sisältö poikkeaa.
+* Pysyvään tallennukseen kirjoitetut tavut lasketaan päivittäin
+  (io_stats.json, näytetään: python3 io_spool.py).
+
+Puskurointi on käytössä, kun "spool_dir" on "auto" (oletus, /dev/shm/gpio-vasalli-<uid>)
+tai hakemiston polku. Tyhjä arvo kirjoittaa suoraan DATA_DIR-hakemistoon kuten ennen.
+
+Ajo: python3 io_spool.py [--flush]
+  --flush tyhjentää puskurin heti (esim. ennen sammutusta).
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import sys
+import time
+from collections import Counter
+import app_config
+from history_store import HistoryStore, HISTORY_DIR
+
+# --- Konfiguraatio ja Polut ---
+DATA_DIR = os.path.expanduser('~/gpio_pricer_data')
+IO_STATS_FILE = os.path.join(DATA_DIR, 'io_stats.json')
+AUTO_SPOOL_PARENT = '/dev/shm'
+HISTORY_SPOOL_NAME = 'history.jsonl'
+STATUS_SPOOL_NAME = 'gpio_current_status.json'
+STATE_NAME = 'spool_state.json'
+STATS_KEEP_DAYS = 62          # Montako päivää tavutilastoa säilytetään
+
+def resolve_spool_dir(setting=None):
+    """Palauttaa käytettävän puskurihakemiston (luodaan tarvittaessa) tai None, jos puskurointi ei ole käytössä."""
+    setting = app_config.get('spool_dir', 'auto') if setting is None else setting
+    if not setting: return None
+    if setting == 'auto':
+        if not os.path.isdir(AUTO_SPOOL_PARENT): return None
+        setting = os.path.join(AUTO_SPOOL_PARENT, f"gpio-vasalli-{os.getuid()}")
+    try: os.makedirs(setting, exist_ok=True); return setting
+    except OSError as e: logging.warning(f"Puskurihakemistoa '{setting}' ei voitu luoda ({e}). Kirjoitetaan suoraan."); return None
+
+def _write_atomic(path, data):
+    """Kirjoittaa tavut atomisesti (väliaikainen tiedosto + rename)."""
+    directory = os.path.dirname(path)
+    if directory: os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f: f.write(data)
+    os.replace(tmp_path, path)
+
+def _read_bytes(path):
+    try:
+        with open(path, 'rb') as f: return f.read()
+    except OSError: return None
+
+def _rotate(spool_path):
+    """
+    Nimeää puskuritiedoston .flushing-nimelle siirtoa varten. Keskeytyneen edellisen siirron
+    .flushing-tiedosto palautetaan ensin. Palauttaa polun tai None, jos siirrettävää ei ole.
+    """
+    flushing_path = f"{spool_path}.flushing"
+    if os.path.exists(flushing_path): return flushing_path
+    if not os.path.exists(spool_path) or not os.path.getsize(spool_path): return None
+    os.replace(spool_path, flushing_path)
+    return flushing_path
+
+def _record_key(record):
+    timestamp, pin, identifier, state, reason = record
+    return (int(timestamp.timestamp()), int(pin), identifier, bool(state), reason or "")
+
+def _unstored_records(store, records):
+    """Keskeytyneen siirron tietueista ne, joita historiassa ei vielä ole (kaatuminen appendin jälkeen ei monista tietueita)."""
+    if not records: return records
+    first, last = min(record[0] for record in records), max(record[0] for record in records)
+    stored = Counter(_record_key(record) for record in store.query(first, last + datetime.timedelta(seconds=1)))
+    unstored = []
+    for record in records:
+        key = _record_key(record)
+        if stored[key]: stored[key] -= 1
+        else: unstored.append(record)
+    return unstored
+
+def _stable_status(status):
+    """Tilatiedon vertailuavain ilman ajokohtaisia aikaleimoja."""
+    return json.dumps({identifier: {key: value for key, value in info.items() if key != 'timestamp'}
+                       for identifier, info in status.items()}, sort_keys=True)
+
+class SpoolLogHandler(logging.handlers.WatchedFileHandler):
+    """Puskurin lokikäsittelijä: avaa tiedoston uudelleen tyhjennyksen jälkeen ja luo poistetun puskurihakemiston uudelleen."""
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+class WriteSpool:
+    """Puskuroitu kirjoituspolku (ks. moduulin kuvaus). spool_dir=None kirjoittaa suoraan."""
+
+    def __init__(self, spool_dir, flush_interval_minutes=60, history_dir=HISTORY_DIR, stats_file=IO_STATS_FILE):
+        self.spool_dir = spool_dir
+        self.enabled = spool_dir is not None
+        self.flush_interval_s = max(0, int(flush_interval_minutes)) * 60
+        self.history_dir = history_dir
+        self.stats_file = stats_file
+        self.state_file = os.path.join(spool_dir, STATE_NAME) if self.enabled else stats_file
+        self.state = {"last_flush": None, "status_key": None, "targets": {}, "days": {}}
+        # Uudelleenkäynnistyksen jälkeen tmpfs on tyhjä: tilastot jatkuvat pysyvästä io_stats.json:sta
+        for path in ([self.state_file, stats_file] if self.enabled else [self.state_file]):
+            try:
+                with open(path, 'r', encoding='utf-8') as f: loaded = json.load(f)
+                if isinstance(loaded, dict): self.state.update(loaded); break
+            except (OSError, json.JSONDecodeError): continue
+
+    @property
+    def status_file(self):
+        """Pysyvän tilatiedoston polku (viimeisimmästä write_status-kutsusta)."""
+        return self.state.get("status_file") or os.path.join(DATA_DIR, STATUS_SPOOL_NAME)
+
+    def _spool_path(self, name):
+        return os.path.join(self.spool_dir, name)
+
+    # --- Tilastot ---
+
+    def _account(self, nbytes, skipped=False):
+        """Kirjaa pysyvään tallennukseen kirjoitetut tavut päivälle."""
+        day = self.state["days"].setdefault(datetime.date.today().isoformat(), {"bytes": 0, "writes": 0, "skipped": 0})
+        if skipped: day["skipped"] += 1
+        else: day["bytes"] += nbytes; day["writes"] += 1
+
+    def bytes_today(self):
+        return self.state["days"].get(datetime.date.today().isoformat(), {}).get("bytes", 0)
+
+    def save_state(self):
+        """Tallentaa puskurin tilan ja tavutilastot (puskurihakemistoon tai ilman puskuria suoraan io_stats.json:iin)."""
+        days = self.state["days"]
+        for day in sorted(days)[:-STATS_KEEP_DAYS]: del days[day]
+        try: _write_atomic(self.state_file, json.dumps(self.state, sort_keys=True, separators=(',', ':')).encode('utf-8'))
+        except OSError as e: logging.error(f"Kirjoituspuskurin tilan '{self.state_file}' tallennus epäonnistui: {e}")
+
+    # --- Kirjoitus ---
+
+    def append_text(self, target_path, text):
+        """Lisää tekstin tiedoston loppuun (puskurin kautta)."""
+        data = text.encode('utf-8')
+        if not self.enabled:
+            with open(target_path, 'ab') as f: f.write(data)
+            self._account(len(data)); return
+        name = f"append-{os.path.basename(target_path)}"
+        self.state["targets"][name] = target_path
+        with open(self._spool_path(name), 'ab') as f: f.write(data)
+
+    def append_history(self, records):
+        """Lisää historiatietueet (aikaleima, pinni, tunniste, tila, syy). Palauttaa pysyvään tallennukseen kirjoitetut tavut."""
+        if not self.enabled:
+            written = HistoryStore(self.history_dir).append(records)
+            self._account(written); return written
+        lines = "".join(json.dumps([timestamp.timestamp(), pin, identifier, bool(state), reason], ensure_ascii=False) + "\n"
+                        for timestamp, pin, identifier, state, reason in records)
+        with open(self._spool_path(HISTORY_SPOOL_NAME), 'a', encoding='utf-8') as f: f.write(lines)
+        return 0
+
+    def write_status(self, status_path, status):
+        """
+        Kirjoittaa tilatiedoston atomisesti. Ilman puskuria kirjoitus ohitetaan, jos sisältö on sama.
+        Puskurin kanssa tuore kopio menee puskuriin ja pysyvä vain tilan/syyn muuttuessa. Palauttaa kirjoitetut tavut.
+        """
+        data = json.dumps(status, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        if self.enabled:
+            self.state["status_file"] = status_path
+            _write_atomic(self._spool_path(STATUS_SPOOL_NAME), data)
+            status_key = _stable_status(status)
+            if status_key == self.state["status_key"] and os.path.exists(status_path): self._account(0, skipped=True); return 0
+            self.state["status_key"] = status_key
+        if _read_bytes(status_path) == data: self._account(0, skipped=True); return 0
+        _write_atomic(status_path, data)
+        self._account(len(data))
+        return len(data)
+
+    def status_path(self, status_path):
+        """Palauttaa tuoreimman tilatiedoston polun (puskurin kopio, jos se on olemassa)."""
+        if self.enabled and os.path.exists(self._spool_path(STATUS_SPOOL_NAME)): return self._spool_path(STATUS_SPOOL_NAME)
+        return status_path
+
+    def log_handler(self, log_file):
+        """
+        Palauttaa lokitiedoston käsittelijän: puskurin kanssa loki kirjoitetaan puskuriin ja siirretään tyhjennyksessä.
+        SpoolLogHandler avaa puskuritiedoston uudelleen, kun tyhjennys on nimennyt sen .flushing-nimelle.
+        """
+        if not self.enabled: return logging.FileHandler(log_file, mode='a', encoding='utf-8')
+        name = f"append-{os.path.basename(log_file)}"
+        self.state["targets"][name] = log_file
+        return SpoolLogHandler(self._spool_path(name), mode='a', encoding='utf-8')
+
+    # --- Tyhjennys ---
+
+    def pending_bytes(self):
+        """Palauttaa puskurissa odottavien tavujen määrän."""
+        if not self.enabled: return 0
+        names = [name + suffix for name in [HISTORY_SPOOL_NAME] + list(self.state["targets"]) for suffix in ("", ".flushing")]
+        return sum(os.path.getsize(self._spool_path(name)) for name in names if os.path.exists(self._spool_path(name)))
+
+    def flush_due(self, now=None):
+        now = time.time() if now is None else now
+        last_flush = self.state.get("last_flush")
+        return last_flush is None or now - last_flush >= self.flush_interval_s or now < last_flush
+
+    def maybe_flush(self, now=None):
+        """Tyhjentää puskurin, jos väli on täynnä, ja tallentaa tilan. Palauttaa siirretyt tavut."""
+        flushed = self.flush(now) if self.enabled and self.flush_due(now) else 0
+        self.save_state()
+        return flushed
+
+    def flush(self, now=None):
+        """Siirtää puskurin pysyvään tallennukseen isoina erinä. Palauttaa kirjoitetut tavut."""
+        if not self.enabled: return 0
+        written = self._flush_history()
+        for name, target_path in sorted(self.state["targets"].items()):
+            spool_path = self._spool_path(name)
+            try:
+                for _round in range(2): # Keskeytyneen edellisen siirron tiedosto ensin, sitten nykyinen
+                    flushing_path = _rotate(spool_path)
+                    if flushing_path is None: break
+                    data = _read_bytes(flushing_path) or b""
+                    directory = os.path.dirname(target_path)
+                    if directory: os.makedirs(directory, exist_ok=True)
+                    with open(target_path, 'ab') as f: f.write(data)
+                    os.remove(flushing_path)
+                    self._account(len(data)); written += len(data)
+            except OSError as e: logging.error(f"Puskurin '{spool_path}' siirto tiedostoon '{target_path}' epäonnistui: {e}")
+        status_data = _read_bytes(self._spool_path(STATUS_SPOOL_NAME))
+        if status_data and status_data != _read_bytes(self.status_file):
+            try: _write_atomic(self.status_file, status_data); self._account(len(status_data)); written += len(status_data)
+            except OSError as e: logging.error(f"Tilatiedoston '{self.status_file}' kirjoitus epäonnistui: {e}")
+        self.state["last_flush"] = time.time() if now is None else now
+        if self.stats_file != self.state_file:
+            try: _write_atomic(self.stats_file, json.dumps({"days": self.state["days"]}, sort_keys=True, separators=(',', ':')).encode('utf-8'))
+            except OSError as e: logging.error(f"Kirjoitustilastojen '{self.stats_file}' tallennus epäonnistui: {e}")
+        logging.info(f"Kirjoituspuskuri tyhjennetty: {written} tavua pysyvään tallennukseen")
+        return written
+
+    def _flush_history(self):
+        """Siirtää puskuroidut historiatietueet HistoryStoreen (yksi append-kutsu erää kohden)."""
+        spool_path = self._spool_path(HISTORY_SPOOL_NAME)
+        written = 0
+        for _round in range(2):
+            # Keskeytynyt edellinen siirto käsitellään ensin (.flushing), jotta tietueita ei menetetä eikä monisteta
+            resumed = os.path.exists(f"{spool_path}.flushing")
+            flushing_path = _rotate(spool_path)
+            if flushing_path is None: break
+            records = []
+            with open(flushing_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        epoch, pin, identifier, state, reason = json.loads(line)
+                        records.append((datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc), pin, identifier, state, reason))
+                    except (ValueError, TypeError): continue
+            try:
+                store = HistoryStore(self.history_dir)
+                if resumed:
+                    unstored = _unstored_records(store, records)
+                    if len(unstored) < len(records): logging.warning(f"Keskeytyneen historiansiirron {len(records) - len(unstored)} tietuetta oli jo tallennettu, ne ohitetaan.")
+                    records = unstored
+                batch_written = store.append(records)
+            except (OSError, RuntimeError) as e: logging.error(f"Historian siirto puskurista epäonnistui: {e}"); return written
+            os.remove(flushing_path)
+            self._account(batch_written); written += batch_written
+        return written
+
+# --- Moduulin tila (yksi puskuri prosessia kohden) ---
+_spool = None
+
+def get_spool():
+    """Palauttaa prosessin kirjoituspuskurin (config.json: spool_dir, flush_interval_minutes)."""
+    global _spool
+    if _spool is None:
+        try: interval = int(app_config.get('flush_interval_minutes', 60))
+        except (TypeError, ValueError): interval = 60
+        _spool = WriteSpool(resolve_spool_dir(), interval)
+    return _spool
+
+def volatile_dir(default_dir=DATA_DIR):
+    """Hakemisto usein päivittyville tiedostoille: puskurihakemisto tai default_dir."""
+    return get_spool().spool_dir or default_dir
+
+# --- Itsenäinen ajo ---
+
+def main():
+    parser = argparse.ArgumentParser(description="Kirjoituspuskurin tila ja pysyvään tallennukseen kirjoitetut tavut päivittäin.")
+    parser.add_argument("--flush", action="store_true", help="Tyhjennä puskuri pysyvään tallennukseen heti")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stderr)
+    spool = get_spool()
+    if args.flush:
+        written = spool.flush(); spool.save_state()
+        print(f"Puskuri tyhjennetty: {written} tavua.")
+    if spool.enabled:
+        last_flush = spool.state.get("last_flush")
+        last_str = datetime.datetime.fromtimestamp(last_flush).strftime('%Y-%m-%d %H:%M:%S') if last_flush else "ei koskaan"
+        print(f"Puskuri: {spool.spool_dir}, odottaa {spool.pending_bytes()} tavua, edellinen tyhjennys {last_str}, väli {spool.flush_interval_s // 60} min")
+    else: print("Puskurointi ei ole käytössä (spool_dir tyhjä tai tmpfs ei saatavilla).")
+    days = spool.state.get("days", {})
+    if not days: print("Ei kirjoitustilastoja."); return
+    print(f"{'Päivä':<12} {'Tavua':>12} {'Kirjoituksia':>13} {'Ohitettu':>9}")
+    for day in sorted(days):
+        stats = days[day]
+        print(f"{day:<12} {stats.get('bytes', 0):>12} {stats.get('writes', 0):>13} {stats.get('skipped', 0):>9}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+metrics.py
+
+Ohjausajon mittarit ja profilointi.
+
+* Vaihekohtaiset ajat (asetukset, aikataulu, päätökset, GPIO, tiedostot).
+  Sisäkkäisen vaiheen aika vähennetään ulommasta, joten vaiheet summautuvat ajon kestoon.
+* API-kutsujen viivejakaumat (histogrammi), tilakoodi-, virhe- ja 429-laskurit
+  päätepisteittäin sekä api_clientin muistiinpano- ja nopeusrajoitintilastot.
+* Pinnikohtaiset kytkentälaskurit ja tilat (pin_state_cache.py:n pysyvät laskurit).
+
+Ajon (tai jatkuvan ajon kierroksen) lopuksi write_outputs() kirjoittaa
+  * Prometheus textfile collector -tiedoston (METRICS_PROM_FILE, atominen korvaus).
+    Polun voi vaihtaa config.json:n avaimella "metrics_textfile", esim.
+    /var/lib/node_exporter/textfile_collector/gpio_vasalli.prom.
+    Oletuksena tiedosto on kirjoituspuskurin hakemistossa (io_spool.py), jos se on käytössä.
+  * yhden JSON-rivin ajoa kohden tiedostoon METRICS_JSONL_FILE kirjoituspuskurin
+    kautta (kierrätetään METRICS_JSONL_MAX_BYTES ylittyessä).
+
+Laskurit ja histogrammit ovat prosessikohtaisia: kertaajossa ne kuvaavat yhtä
+ajoa (Prometheus käsittelee nollautumisen laskurin nollautumisena), jatkuvassa
+ajossa koko prosessin elinaikaa. Vaiheajat ovat aina viimeisimmän ajon arvoja.
+
+profile_call() ajaa funktion cProfile- ja tracemalloc-mittauksen alla
+(hourly_control.py --profile) ja tallentaa tulokset PROFILE_DIR-hakemistoon.
+"""
+
+import contextlib
+import datetime
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+import app_config
+import io_spool
+
+# --- Konfiguraatio ja Polut ---
+DATA_DIR = os.path.expanduser('~/gpio_pricer_data')
+METRICS_PROM_FILE = app_config.get('metrics_textfile') or os.path.join(io_spool.volatile_dir(DATA_DIR), 'gpio_vasalli.prom')
+METRICS_JSONL_FILE = os.path.join(DATA_DIR, 'metrics.jsonl')
+METRICS_JSONL_MAX_BYTES = 5 * 1024 * 1024   # Tätä suurempi JSONL siirretään .1-tiedostoksi
+PROFILE_DIR = os.path.join(DATA_DIR, 'profile')
+PROFILE_TOP_N = 40                          # Montako riviä profiiliyhteenvetoon
+METRIC_PREFIX = 'gpio_vasalli_'
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)   # sekuntia
+
+class Histogram:
+    """Kiinteäväliset histogrammilokerot (Prometheus-muoto: kumulatiiviset lokerot, summa ja määrä)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, upper in enumerate(self.buckets):
+            if value <= upper: self.counts[i] += 1; break
+        self.total += value
+        self.count += 1
+
+    def cumulative(self):
+        """Palauttaa [(raja, kumulatiivinen määrä)] ilman +Inf-lokeroa."""
+        running, result = 0, []
+        for upper, count in zip(self.buckets, self.counts):
+            running += count; result.append((upper, running))
+        return result
+
+# --- Moduulin tila (yksi mittaristo prosessia kohden) ---
+_lock = threading.Lock()
+_counters = defaultdict(float)   # (nimi, ((nimiö, arvo), ...)) -> arvo, prosessin elinaika
+_histograms = {}                 # (nimi, nimiöt) -> Histogram, prosessin elinaika
+_gauges = {}                     # (nimi, nimiöt) -> arvo, viimeisin
+_run = {}                        # Kuluvan ajon yhteenveto JSONL-riviä varten
+_phase_stack = []                # Sisäkkäisten vaiheiden ajat (pääsäie)
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def begin_run():
+    """Aloittaa uuden ajon: nollaa vaiheajat ja ajokohtaisen yhteenvedon (laskurit säilyvät)."""
+    with _lock:
+        _run.clear()
+        _run.update({"phases": defaultdict(float), "api": {}, "gpio_writes": 0, "pins": 0})
+        _phase_stack.clear()
+
+def inc(name, value=1, **labels):
+    """Kasvattaa laskuria."""
+    with _lock: _counters[_key(name, labels)] += value
+
+def set_gauge(name, value, **labels):
+    """Asettaa mittarin arvon."""
+    with _lock: _gauges[_key(name, labels)] = value
+
+def observe(name, value, **labels):
+    """Lisää havainnon histogrammiin."""
+    with _lock:
+        key = _key(name, labels)
+        histogram = _histograms.get(key)
+        if histogram is None: histogram = _histograms[key] = Histogram()
+        histogram.observe(value)
+
+@contextlib.contextmanager
+def phase(name):
+    """Mittaa lohkon ajan vaiheelle name. Sisäkkäisen vaiheen aika vähennetään ulommasta."""
+    if not _run: begin_run()
+    started = time.perf_counter()
+    _phase_stack.append(0.0)
+    try: yield
+    finally:
+        elapsed = time.perf_counter() - started
+        nested = _phase_stack.pop()
+        _run["phases"][name] += elapsed - nested
+        if _phase_stack: _phase_stack[-1] += elapsed
+
+def timed(name):
+    """Koristin: mittaa funktion ajan vaiheelle name."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with phase(name): return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def endpoint_of(url):
+    """Palauttaa (isäntä, päätepiste) URL:sta: polun ensimmäinen osa ilman /v1-etuliitettä, esim. JustNow tai prices."""
+    parts = urlsplit(url)
+    segments = [segment for segment in parts.path.split('/') if segment]
+    if segments and segments[0] == 'v1': segments = segments[1:]
+    return parts.netloc, segments[0] if segments else '/'
+
+def record_api_call(url, seconds, status=None, error=None):
+    """Kirjaa yhden HTTP-kutsun: viive, tilakoodi tai virheen tyyppi (esim. Timeout)."""
+    host, endpoint = endpoint_of(url)
+    result = str(status) if status is not None else (error or 'error')
+    observe('api_request_duration_seconds', seconds, host=host, endpoint=endpoint)
+    inc('api_requests_total', host=host, endpoint=endpoint, result=result)
+    if status == 429: inc('api_rate_limited_total', host=host, endpoint=endpoint)
+    if error: inc('api_errors_total', host=host, endpoint=endpoint, error=error)
+    with _lock:
+        if not _run: return
+        summary = _run["api"].setdefault(endpoint, {"calls": 0, "seconds": 0.0, "errors": 0, "http_429": 0})
+        summary["calls"] += 1; summary["seconds"] += seconds
+        if error or (status is not None and status >= 400): summary["errors"] += 1
+        if status == 429: summary["http_429"] += 1
+
+def record_pins(pin_cache, written=0, decided=0):
+    """Päivittää pinnien tilat ja pysyvät kytkentälaskurit (PinStateCache) sekä ajon kirjoitusmäärän."""
+    for pin_str, entry in pin_cache.pins.items():
+        identifier = entry.get('identifier') or f"Pin_{pin_str}"
+        set_gauge('pin_toggles_total', entry.get('toggles', 0), pin=pin_str, identifier=identifier)
+        if entry.get('state') is not None: set_gauge('pin_state', int(bool(entry['state'])), pin=pin_str, identifier=identifier)
+    inc('gpio_writes_total', written)
+    with _lock:
+        if _run: _run["gpio_writes"] += written; _run["pins"] = decided
+
+# --- Tulostus ---
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else f"{value:.6g}"
+
+def _labels(pairs, extra=()):
+    pairs = list(pairs) + list(extra)
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}" if pairs else ""
+
+def _by_name(items):
+    grouped = defaultdict(list)
+    for (name, labels), value in sorted(items): grouped[name].append((labels, value))
+    return grouped
+
+# Tyyppi ja ohje mittarin nimen mukaan; pysyvät kytkentälaskurit ovat laskureita, vaikka arvo asetetaan.
+METRIC_HELP = {
+    'api_requests_total': ('counter', "HTTP-kutsut päätepisteittäin ja tuloksittain (tilakoodi tai virheen tyyppi)"),
+    'api_rate_limited_total': ('counter', "HTTP 429 -vastaukset"),
+    'api_errors_total': ('counter', "Verkkovirheet (aikakatkaisu, yhteysvirhe)"),
+    'api_cache_hits_total': ('counter', "api_clientin muistiinpanosta palautetut kutsut"),
+    'api_throttle_seconds_total': ('counter', "Nopeusrajoittimen odotusaika"),
+    'price_source_results_total': ('counter', "Hintalähteiden vastaukset lähteittäin (ok / error)"),
+    'price_hedged_requests_total': ('counter', "Varalähteelle lähetetyt suojatut hintahaut"),
+    'price_source_mismatch_total': ('counter', "Hintalähteiden ristiintarkistuksen poikkeamat"),
+    'price_fetch_failed_total': ('counter', "Hintahaut, joihin mikään lähde ei vastannut aikarajassa"),
+    'gpio_writes_total': ('counter', "Kirjoitetut pinnit"),
+    'pin_toggles_total': ('counter', "Pinnin tilamuutokset (pysyvä laskuri)"),
+    'pin_state': ('gauge', "Pinnin viimeksi kirjoitettu tila (1=ON)"),
+    'gpio_sequence_seconds': ('histogram', "Kytkentäsarjan kesto (transition_sequencer.py)"),
+    'gpio_sequence_steps': ('gauge', "Viimeisimmän kytkentäsarjan vaiheiden (ajurikutsujen) määrä"),
+    'gpio_sequence_max_lateness_seconds': ('gauge', "Viimeisimmän kytkentäsarjan suurin myöhästyminen suunnitellusta hetkestä"),
+    'api_request_duration_seconds': ('histogram', "HTTP-kutsujen kesto"),
+    'last_run_phase_seconds': ('gauge', "Viimeisimmän ajon vaiheiden kesto"),
+    'last_run_api_seconds': ('gauge', "Viimeisimmän ajon API-kutsujen yhteiskesto päätepisteittäin"),
+    'last_run_duration_seconds': ('gauge', "Viimeisimmän ajon kokonaiskesto"),
+    'last_run_timestamp_seconds': ('gauge', "Viimeisimmän ajon alkuhetki (Unix-aika)"),
+    'storage_bytes_written_today': ('gauge', "Pysyvään tallennukseen tänään kirjoitetut tavut (io_spool.py)"),
+    'storage_spool_pending_bytes': ('gauge', "Kirjoituspuskurissa odottavat tavut"),
+}
+
+def render_prometheus():
+    """Palauttaa mittarit Prometheus-tekstimuodossa."""
+    with _lock:
+        scalars = _by_name(list(_counters.items()) + list(_gauges.items()))
+        histograms = _by_name((key, (h.cumulative(), h.total, h.count)) for key, h in _histograms.items())
+    lines = []
+    for name in sorted(set(scalars) | set(histograms)):
+        metric_type, help_text = METRIC_HELP.get(name, ('untyped', name))
+        full_name = f"{METRIC_PREFIX}{name}"
+        lines.append(f"# HELP {full_name} {help_text}")
+        lines.append(f"# TYPE {full_name} {metric_type}")
+        for labels, value in scalars.get(name, []): lines.append(f"{full_name}{_labels(labels)} {_number(value)}")
+        for labels, (buckets, total, count) in histograms.get(name, []):
+            for upper, cumulative in buckets: lines.append(f"{full_name}_bucket{_labels(labels, [('le', f'{upper:g}')])} {cumulative}")
+            lines.append(f"{full_name}_bucket{_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{full_name}_sum{_labels(labels)} {total:.6f}")
+            lines.append(f"{full_name}_count{_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+def run_summary(run_time, duration_s, mode):
+    """Palauttaa kuluvan ajon yhteenvedon (JSONL-rivi)."""
+    with _lock: run = {key: value for key, value in _run.items()}
+    return {"time": run_time.isoformat(), "mode": mode, "duration_s": round(duration_s, 4),
+            "phases_s": {name: round(seconds, 4) for name, seconds in run.get("phases", {}).items()},
+            "api": {endpoint: dict(summary, seconds=round(summary["seconds"], 4)) for endpoint, summary in run.get("api", {}).items()},
+            "gpio_writes": run.get("gpio_writes", 0), "pins": run.get("pins", 0)}
+
+def _write_atomic(path, text):
+    directory = os.path.dirname(path)
+    if directory: os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"   # Ei .prom-päätettä, jottei keräin lue keskeneräistä tiedostoa
+    with open(tmp_path, 'w', encoding='utf-8') as f: f.write(text)
+    os.replace(tmp_path, path)
+
+def write_outputs(run_time, duration_s, mode='once'):
+    """Kirjoittaa ajon mittarit Prometheus-tiedostoon ja JSONL-virtaan. Virheet lokitetaan, ajo ei keskeydy."""
+    summary = run_summary(run_time, duration_s, mode)
+    for name, seconds in summary["phases_s"].items(): set_gauge('last_run_phase_seconds', seconds, phase=name)
+    for endpoint, api_summary in summary["api"].items(): set_gauge('last_run_api_seconds', api_summary["seconds"], endpoint=endpoint)
+    set_gauge('last_run_duration_seconds', round(duration_s, 4))
+    set_gauge('last_run_timestamp_seconds', int(run_time.timestamp()))
+    try: _write_atomic(METRICS_PROM_FILE, render_prometheus())
+    except (IOError, OSError) as e: logging.error(f"Mittaritiedoston '{METRICS_PROM_FILE}' kirjoitus epäonnistui: {e}")
+    try:
+        if os.path.exists(METRICS_JSONL_FILE) and os.path.getsize(METRICS_JSONL_FILE) > METRICS_JSONL_MAX_BYTES:
+            os.replace(METRICS_JSONL_FILE, f"{METRICS_JSONL_FILE}.1")
+        io_spool.get_spool().append_text(METRICS_JSONL_FILE, json.dumps(summary, ensure_ascii=False, sort_keys=True, separators=(',', ':')) + "\n")
+    except (IOError, OSError) as e: logging.error(f"Mittarivirran '{METRICS_JSONL_FILE}' kirjoitus epäonnistui: {e}")
+    return summary
+
+# --- Profilointi ---
+
+def profile_call(func, label='control'):
+    """
+    Ajaa func():n cProfile- ja tracemalloc-mittauksen alla. Tallentaa PROFILE_DIR-hakemistoon
+    <label>_<aika>.prof (pstats), .tracemalloc (Snapshot.dump) ja .txt (yhteenveto). Palauttaa func():n tuloksen.
+    """
+    import cProfile
+    import pstats
+    import tracemalloc
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base_path = os.path.join(PROFILE_DIR, f"{label}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    profiler = cProfile.Profile()
+    tracemalloc.start(25)
+    profiler.enable()
+    try: return func()
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        try:
+            profiler.dump_stats(f"{base_path}.prof")
+            snapshot.dump(f"{base_path}.tracemalloc")
+            with open(f"{base_path}.txt", 'w', encoding='utf-8') as f:
+                f.write(f"# cProfile ({label}), {PROFILE_TOP_N} kalleinta kumulatiivisen ajan mukaan\n")
+                pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(PROFILE_TOP_N)
+                f.write(f"# tracemalloc: nyt {current_bytes / 1024:.1f} KiB, huippu {peak_bytes / 1024:.1f} KiB\n")
+                for stat in snapshot.statistics('lineno')[:PROFILE_TOP_N]: f.write(f"{stat}\n")
+            logging.info(f"Profiili tallennettu: {base_path}.prof / .tracemalloc / .txt")
+        except (IOError, OSError) as e: logging.error(f"Profiilin tallennus epäonnistui ({base_path}): {e}")
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+optimize_settings.py
+
+Asetusten optimoija: hakee pinneittäin halvimmat rajat (lower_limit_ct_kwh,
+upper_limit_ct_kwh) ja N:n (cheapest_hours_n), joilla pinni on silti päällä
+vähintään vaaditun määrän tunteja päivässä. Ehdokkaat lasketaan hintahistoriaa
+vasten samalla taulukkologiikalla kuin backtest.py.
+
+Ehdokkaat jaetaan ProcessPoolExecutorin prosesseille (oletuksena kaikki
+ytimet). Hintamatriisi ja päiväkohtainen hintajärjestys lasketaan kerran ja
+välitetään prosesseille alustuksessa, joten ehdokkaiden arviointi on pelkkiä
+taulukkovertailuja. Tulostaa voittajan ja kustannus / ON-tunnit -Pareto-rintaman;
+--apply tallentaa voittajat settings.json-tiedostoon configure_settings.py:n kautta.
+
+Vaatii numpy-kirjaston (pip install numpy).
+
+Ajo: python3 optimize_settings.py --from 2023-01-01 --min-hours 4 [--pin Laite_A] [--apply]
+"""
+
+import os
+import sys
+import time
+import datetime
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import backtest
+import pin_settings
+from price_logic import cheapest_slot_count
+try:
+    import numpy as np
+except ImportError:
+    print("VIRHE: numpy-kirjastoa ei löydy. Asenna: pip install numpy", file=sys.stderr)
+    sys.exit(1)
+
+# --- Konfiguraatio ja Polut ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SETTINGS_FILE = os.path.join(SCRIPT_DIR, 'settings.json')
+PARETO_ROWS_SHOWN = 15  # Montako Pareto-rintaman riviä tulostetaan pinniä kohden
+
+# --- Prosessikohtainen tila (asetetaan _init_worker-funktiossa) ---
+_prices = None
+_valid = None
+_ranks = None
+_cheapest_masks = {}
+_day_shape = None
+_priced_days = None
+
+def _init_worker(price_matrix, ranks):
+    """Prosessin alustus: hintamatriisi ja hintajärjestys välitetään kerran prosessia kohden."""
+    global _prices, _valid, _ranks, _day_shape, _priced_days
+    _prices = price_matrix.ravel()
+    _valid = ~np.isnan(_prices)
+    _ranks = ranks
+    _day_shape = price_matrix.shape
+    _priced_days = _valid.reshape(_day_shape).any(axis=1)
+    _cheapest_masks.clear()
+
+def _cheapest_mask(n, startup_factor=1.0):
+    """N halvimman jakson maski päivittäin; lasketaan kerran jokaista (N, käynnistyskerroin) -paria kohden."""
+    mask_key = (n, startup_factor if startup_factor > 1.0 else 1.0)
+    if mask_key not in _cheapest_masks:
+        _cheapest_masks[mask_key] = (backtest.startup_cheapest_mask(_prices.reshape(_day_shape), n, startup_factor)
+                                     if startup_factor > 1.0 else (_ranks < n).ravel())
+    return _cheapest_masks[mask_key]
+
+def _evaluate_lower(lower_limit, upper_values, n_values, hysteresis, startup_factor, power_kw, slot_hours, min_hours):
+    """
+    Arvioi kaikki (yläraja, N) -ehdokkaat yhdelle alarajalle.
+    Palauttaa listan (alaraja, yläraja, N, kustannus €, ON h/pv, tavoitteen täyttöaste, kytkennät).
+    """
+    results = []
+    priced_day_count = max(1, int(np.count_nonzero(_priced_days)))
+    for upper_limit in upper_values:
+        if upper_limit < lower_limit: continue
+        for n in n_values:
+            slot_n = cheapest_slot_count(n, round(slot_hours * 60))   # Ehdokas N on tunteja, maski jaksoina
+            states = backtest.evaluate_pin(_prices, _valid, _cheapest_mask(slot_n, startup_factor), float(lower_limit), float(upper_limit), slot_n, hysteresis)
+            daily_hours = states.reshape(_day_shape).sum(axis=1) * slot_hours
+            cost_eur = float(np.sum(_prices[states])) * slot_hours * power_kw / 100
+            coverage = float(np.count_nonzero((daily_hours >= min_hours) & _priced_days)) / priced_day_count
+            results.append((lower_limit, upper_limit, n, cost_eur, float(daily_hours[_priced_days].mean()) if _priced_days.any() else 0.0,
+                            coverage, int(np.count_nonzero(np.diff(states.view(np.int8))))))
+    return results
+
+# --- Tulosten käsittely ---
+
+def pareto_front(candidates):
+    """Kustannus / ON-tunnit -Pareto-rintama: ehdokkaat, joita mikään muu ei voita sekä halvemmalla että pidemmällä käyttöajalla."""
+    front, best_hours = [], -1.0
+    for candidate in sorted(candidates, key=lambda c: (c[3], -c[4], c[6])):
+        if candidate[4] > best_hours: front.append(candidate); best_hours = candidate[4]
+    return front
+
+def pick_winner(candidates, coverage_required):
+    """Halvin ehdokas, joka täyttää päivätavoitteen vaaditulla osuudella päivistä (tasatilanteessa vähiten kytkentöjä)."""
+    feasible = [c for c in candidates if c[5] >= coverage_required]
+    if not feasible: return None
+    return min(feasible, key=lambda c: (c[3], c[6], -c[4]))
+
+def _parse_range(value, name):
+    """Jäsentää muodon "min:max" kokonaislukuväliksi."""
+    try:
+        low_str, high_str = value.split(':')
+        low, high = int(low_str), int(high_str)
+        if low < 0 or high < low: raise ValueError
+        return range(low, high + 1)
+    except ValueError:
+        print(f"VIRHE: {name} '{value}'? Käytä muotoa min:max (kokonaisluvut, ct/kWh).", file=sys.stderr); sys.exit(1)
+
+def optimize(settings_list, price_matrix, lower_values, upper_values, n_values, min_hours, resolution_minutes=60, workers=None):
+    """Ajaa ruudukkohaun kaikille pinneille prosessipoolissa. Palauttaa {tunniste: ehdokaslista}."""
+    ranks = backtest.daily_ranks(price_matrix)
+    slot_hours = resolution_minutes / 60
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(price_matrix, ranks)) as executor:
+        futures = {}
+        for rule in settings_list:
+            hysteresis, startup_factor = rule.hysteresis_ct_kwh, rule.startup_factor
+            power_kw = rule.power_kw
+            futures[rule.identifier] = [executor.submit(_evaluate_lower, lower_limit, list(upper_values), list(n_values),
+                                                              hysteresis, startup_factor, power_kw, slot_hours, min_hours)
+                                              for lower_limit in lower_values]
+        return {identifier: [candidate for future in pin_futures for candidate in future.result()]
+                for identifier, pin_futures in futures.items()}
+
+def apply_winners(winners):
+    """Tallentaa voittaja-asetukset settings.json-tiedostoon configure_settings.py:n lataus- ja tallennusfunktioilla."""
+    import configure_settings
+    settings_dict = configure_settings.load_settings()
+    if not settings_dict: print("VIRHE: Asetuksia ei voitu ladata, ei tallenneta.", file=sys.stderr); return False
+    for pin_setting in settings_dict.values():
+        winner = winners.get(pin_setting['identifier'])
+        if winner is None: continue
+        pin_setting['lower_limit_ct_kwh'], pin_setting['upper_limit_ct_kwh'], pin_setting['cheapest_hours_n'] = winner[0], winner[1], winner[2]
+    return configure_settings.save_settings(settings_dict)
+
+# --- Itsenäinen ajo ---
+
+def main():
+    parser = argparse.ArgumentParser(description="Etsii pinneittäin halvimmat rajat ja N:n, jotka täyttävät päivittäisen ON-tuntitavoitteen.")
+    parser.add_argument("--from", dest="date_from", type=str, required=True, help="Alkupäivä (VVVV-KK-PP)")
+    parser.add_argument("--to", dest="date_to", type=str, help="Loppupäivä (VVVV-KK-PP, oletus eilen)")
+    parser.add_argument("--min-hours", type=float, required=True, help="Vaadittu ON-tuntimäärä päivässä")
+    parser.add_argument("--coverage", type=float, default=0.95, help="Osuus päivistä, joilla tavoitteen on täytyttävä (0-1)")
+    parser.add_argument("--pin", action="append", help="Optimoitava tunniste (voi antaa useasti, oletus kaikki)")
+    parser.add_argument("--lower-range", type=str, default="0:10", help="Alarajan hakuväli min:max ct/kWh")
+    parser.add_argument("--upper-range", type=str, default="0:30", help="Ylärajan hakuväli min:max ct/kWh")
+    parser.add_argument("--max-n", type=int, default=pin_settings.MAX_CHEAPEST_HOURS_N, help=f"Suurin kokeiltava N (enintään {pin_settings.MAX_CHEAPEST_HOURS_N})")
+    parser.add_argument("--resolution", type=int, choices=(15, 60), default=60, help="Jakson pituus minuutteina")
+    parser.add_argument("--workers", type=int, help="Prosessien määrä (oletus kaikki ytimet)")
+    parser.add_argument("--apply", action="store_true", help="Tallenna voittajat settings.json-tiedostoon")
+    args = parser.parse_args()
+    try:
+        start_date = datetime.date.fromisoformat(args.date_from)
+        end_date = datetime.date.fromisoformat(args.date_to) if args.date_to else datetime.date.today() - datetime.timedelta(days=1)
+    except ValueError: print("VIRHE: Päivämäärämuoto? Käytä VVVV-KK-PP.", file=sys.stderr); sys.exit(1)
+    if end_date < start_date: print("VIRHE: --to on ennen --from-päivää.", file=sys.stderr); sys.exit(1)
+    lower_values = _parse_range(args.lower_range, "--lower-range")
+    upper_values = _parse_range(args.upper_range, "--upper-range")
+    n_values = range(0, max(0, min(args.max_n, pin_settings.MAX_CHEAPEST_HOURS_N)) + 1)
+
+    settings_list = pin_settings.load_settings(SETTINGS_FILE)
+    if not settings_list: print(f"VIRHE: Ei kelvollisia asetuksia tiedostossa '{os.path.abspath(SETTINGS_FILE)}'.", file=sys.stderr); sys.exit(1)
+    if args.pin:
+        settings_list = [rule for rule in settings_list if rule.identifier in args.pin]
+        if not settings_list: print(f"VIRHE: Tunnisteita {args.pin} ei löytynyt asetuksista.", file=sys.stderr); sys.exit(1)
+
+    days = backtest.load_price_days(start_date, end_date)
+    if not days: print(f"VIRHE: Hintahistoriaa ei löytynyt väliltä {start_date} - {end_date}. Aja: python3 price_archive.py --backfill --from {start_date}", file=sys.stderr); sys.exit(1)
+    price_matrix = backtest.build_price_matrix(days, start_date, end_date, args.resolution)
+
+    candidate_count = sum(1 for lower in lower_values for upper in upper_values if upper >= lower) * len(n_values) * len(settings_list)
+    print(f"Optimoidaan {len(settings_list)} pinniä, {candidate_count} ehdokasta, {len(days)} päivää ({start_date} - {end_date})...")
+    started = time.perf_counter()
+    candidates_by_pin = optimize(settings_list, price_matrix, lower_values, upper_values, n_values, args.min_hours, args.resolution, args.workers)
+    elapsed = time.perf_counter() - started
+
+    winners = {}
+    header = f"  {'Ala':>4}{'Ylä':>5}{'N':>4}{'Kustannus €':>13}{'ON h/pv':>9}{'Tavoite %':>11}{'Kytkennät':>11}"
+    for rule in settings_list:
+        identifier = rule.identifier
+        candidates = candidates_by_pin[identifier]
+        winner = pick_winner(candidates, args.coverage)
+        print("-" * 60)
+        print(f"{identifier} (nyt: ala {rule.lower_limit_ct_kwh}, ylä {rule.upper_limit_ct_kwh}, N {rule.cheapest_hours_n})")
+        if winner is None: print(f"  Mikään ehdokas ei täytä tavoitetta {args.min_hours} h/pv {args.coverage:.0%} päivistä.")
+        else:
+            winners[identifier] = winner
+            print(f"  Halvin tavoitteen täyttävä: ala {winner[0]}, ylä {winner[1]}, N {winner[2]}: {winner[3]:.2f} €, "
+                  f"{winner[4]:.1f} h/pv, tavoite {winner[5]:.0%} päivistä, {winner[6]} kytkentää")
+        front = pareto_front(candidates)
+        print(f"  Pareto-rintama (kustannus / ON-tunnit), {len(front)} pistettä:")
+        print(header)
+        step = max(1, len(front) // PARETO_ROWS_SHOWN)
+        for candidate in front[::step]:
+            print(f"  {candidate[0]:>4}{candidate[1]:>5}{candidate[2]:>4}{candidate[3]:>13.2f}{candidate[4]:>9.1f}{candidate[5]:>10.0%}{candidate[6]:>12}")
+    print("-" * 60)
+    print(f"Laskenta-aika {elapsed:.2f} s ({candidate_count / max(elapsed, 1e-9):.0f} ehdokasta/s)")
+    if args.apply:
+        if not winners: print("Ei tallennettavia voittajia."); return
+        if apply_winners(winners): print(f"Tallennettu {len(winners)} pinnin optimoidut asetukset.")
+
+if __name__ == "__main__":
+    main()
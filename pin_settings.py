@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+pin_settings.py
+
+Pinnikohtaisten asetusten (settings.json) yhteinen lataus ja validointi.
+Ohjaus (hourly_control.py), aikataulu, simulaattori, backtest, optimoija ja
+configure_settings.py käyttävät samaa validointia, joten simulointi ja
+ohjaus eivät voi tulkita asetuksia eri tavoin.
+
+* Asetukset käännetään kevyiksi PinRule-olioiksi (__slots__), joissa rajat ja
+  N ovat valmiiksi kokonaislukuja ja valinnaiset kertoimet sekä kuorman teho
+  (power_kw) liukulukuja. Tuntemattomat avaimet säilyvät extra-sanakirjassa.
+* Käännetty muoto tallennetaan välimuistiin (SETTINGS_CACHE_FILE, marshal).
+  Välimuisti on voimassa, kun settings.json:n polku, mtime ja koko täsmäävät;
+  jos vain mtime on muuttunut, sisällön SHA-256 tarkistetaan ennen uutta
+  käännöstä. Toistuvat ajot eivät siis jäsennä eivätkä validoi JSONia.
+
+Säännöt (virheellinen rivi ohitetaan varoituksella):
+  gpio_pin > 0, lower_limit_ct_kwh <= upper_limit_ct_kwh (kokonaislukuja,
+  negatiivinen sallittu), 0 <= cheapest_hours_n <= MAX_CHEAPEST_HOURS_N,
+  hysteresis_ct_kwh >= 0, startup_factor >= 1.0, power_kw >= 0, min_on_minutes ja
+  min_off_minutes >= 0, max_toggles_per_day >= 0 tai puuttuu, priority
+  kokonaisluku sekä inrush_seconds >= 0 tai puuttuu (virheellinen arvo korvataan
+  oletuksella), pinni ja tunniste yksilöllisiä.
+"""
+
+import hashlib
+import json
+import logging
+import marshal
+import os
+import sys
+
+# --- Konfiguraatio ja Polut ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SETTINGS_FILE = os.path.join(SCRIPT_DIR, 'settings.json')
+DATA_DIR = os.path.expanduser('~/gpio_pricer_data')
+SETTINGS_CACHE_FILE = os.path.join(DATA_DIR, 'settings_compiled.bin')
+CACHE_VERSION = (5, sys.version_info[0], sys.version_info[1])   # marshal-muoto riippuu Python-versiosta
+MAX_CHEAPEST_HOURS_N = 24
+DEFAULT_POWER_KW = 1.0   # Pinnin kuorman teho, jos asetuksissa ei ole power_kw-arvoa (kustannuslaskelmat, tehoraja)
+DEFAULT_PRIORITY = 0     # Suurempi priority saa tehorajan alla jaksonsa ensin (schedule_builder.apply_power_cap)
+REQUIRED_KEYS = ('gpio_pin', 'upper_limit_ct_kwh', 'lower_limit_ct_kwh', 'cheapest_hours_n')
+
+class PinRule:
+    """Yhden pinnin käännetty asetus. get()/[] toimivat kuten settings.json:n sanakirjalla (myös extra-avaimille)."""
+
+    __slots__ = ('gpio_pin', 'identifier', 'upper_limit_ct_kwh', 'lower_limit_ct_kwh', 'cheapest_hours_n',
+                 'hysteresis_ct_kwh', 'startup_factor', 'power_kw', 'min_on_minutes', 'min_off_minutes',
+                 'max_toggles_per_day', 'priority', 'inrush_seconds', 'extra')
+
+    def __init__(self, gpio_pin, identifier, upper_limit_ct_kwh, lower_limit_ct_kwh, cheapest_hours_n,
+                 hysteresis_ct_kwh=0.0, startup_factor=1.0, power_kw=DEFAULT_POWER_KW, min_on_minutes=0, min_off_minutes=0,
+                 max_toggles_per_day=None, priority=DEFAULT_PRIORITY, inrush_seconds=None, extra=None):
+        self.gpio_pin = gpio_pin
+        self.identifier = identifier
+        self.upper_limit_ct_kwh = upper_limit_ct_kwh
+        self.lower_limit_ct_kwh = lower_limit_ct_kwh
+        self.cheapest_hours_n = cheapest_hours_n
+        self.hysteresis_ct_kwh = hysteresis_ct_kwh
+        self.startup_factor = startup_factor
+        self.power_kw = power_kw
+        self.min_on_minutes = min_on_minutes
+        self.min_off_minutes = min_off_minutes
+        self.max_toggles_per_day = max_toggles_per_day
+        self.priority = priority
+        self.inrush_seconds = inrush_seconds
+        self.extra = extra or {}
+
+    def get(self, key, default=None):
+        if key in _RULE_FIELDS: return getattr(self, key)
+        return self.extra.get(key, default)
+
+    def __getitem__(self, key):
+        if key in _RULE_FIELDS: return getattr(self, key)
+        return self.extra[key]
+
+    def __contains__(self, key):
+        return key in _RULE_FIELDS or key in self.extra
+
+    def has_switching_limits(self):
+        """Onko pinnillä vähimmäis-ON/OFF-aika tai päivän kytkentäbudjetti (price_logic.limit_switching)."""
+        return self.min_on_minutes > 0 or self.min_off_minutes > 0 or self.max_toggles_per_day is not None
+
+    def to_dict(self):
+        """Palauttaa asetuksen settings.json-muodossa (extra-avaimet mukana)."""
+        settings = dict(self.extra)
+        settings.update({field: getattr(self, field) for field in _RULE_FIELDS})
+        for key in ('max_toggles_per_day', 'inrush_seconds'):
+            if settings[key] is None: del settings[key]
+        return settings
+
+    def as_tuple(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def __repr__(self):
+        return (f"PinRule({self.identifier!r}, pin={self.gpio_pin}, ala={self.lower_limit_ct_kwh}, ylä={self.upper_limit_ct_kwh}, "
+                f"N={self.cheapest_hours_n}, hystereesi={self.hysteresis_ct_kwh}, kerroin={self.startup_factor}, teho={self.power_kw} kW)")
+
+_RULE_FIELDS = frozenset(PinRule.__slots__) - {'extra'}
+
+# --- Validointi ---
+
+def compile_rule(item):
+    """Kääntää yhden asetusrivin (dict). Palauttaa (PinRule, varoitukset) tai nostaa ValueError."""
+    if not isinstance(item, dict): raise ValueError("rivi ei ole JSON-objekti")
+    missing = [key for key in REQUIRED_KEYS if key not in item]
+    if missing: raise ValueError(f"puuttuvat avaimet {missing}")
+    try:
+        pin = int(item['gpio_pin'])
+        upper_limit = int(item['upper_limit_ct_kwh'])
+        lower_limit = int(item['lower_limit_ct_kwh'])
+        n_value = int(item['cheapest_hours_n'])
+    except (ValueError, TypeError) as e: raise ValueError(f"virheellinen arvo: {e}")
+    if pin <= 0: raise ValueError("Pinninumeron tulee olla positiivinen")
+    if lower_limit > upper_limit: raise ValueError("Alarajan tulee olla <= yläraja")
+    if not 0 <= n_value <= MAX_CHEAPEST_HOURS_N: raise ValueError(f"N ({n_value}) ei ole välillä 0-{MAX_CHEAPEST_HOURS_N}")
+    warnings = []
+    try: hysteresis = float(item.get('hysteresis_ct_kwh', 0) or 0)
+    except (ValueError, TypeError): hysteresis = -1.0
+    if hysteresis < 0: warnings.append(f"hysteresis_ct_kwh ({item.get('hysteresis_ct_kwh')}) ei kelpaa, käytetään 0"); hysteresis = 0.0
+    try: startup_factor = float(item.get('startup_factor', 1.0) or 1.0)
+    except (ValueError, TypeError): startup_factor = 0.0
+    if startup_factor < 1.0: warnings.append(f"startup_factor ({item.get('startup_factor')}) ei kelpaa, käytetään 1.0"); startup_factor = 1.0
+    try: power_kw = float(item.get('power_kw', DEFAULT_POWER_KW))
+    except (ValueError, TypeError): power_kw = -1.0
+    if not power_kw >= 0: warnings.append(f"power_kw ({item.get('power_kw')}) ei kelpaa, käytetään {DEFAULT_POWER_KW}"); power_kw = DEFAULT_POWER_KW
+    min_minutes = {}
+    for key in ('min_on_minutes', 'min_off_minutes'):
+        try: min_minutes[key] = int(item.get(key, 0) or 0)
+        except (ValueError, TypeError): min_minutes[key] = -1
+        if min_minutes[key] < 0: warnings.append(f"{key} ({item.get(key)}) ei kelpaa, käytetään 0"); min_minutes[key] = 0
+    max_toggles = item.get('max_toggles_per_day')
+    if max_toggles is not None:
+        try: max_toggles = int(max_toggles)
+        except (ValueError, TypeError): max_toggles = -1
+        if max_toggles < 0: warnings.append(f"max_toggles_per_day ({item.get('max_toggles_per_day')}) ei kelpaa, ei rajoitusta"); max_toggles = None
+    try: priority = int(item.get('priority', DEFAULT_PRIORITY))
+    except (ValueError, TypeError): warnings.append(f"priority ({item.get('priority')}) ei kelpaa, käytetään {DEFAULT_PRIORITY}"); priority = DEFAULT_PRIORITY
+    inrush_seconds = item.get('inrush_seconds')
+    if inrush_seconds is not None:
+        try: inrush_seconds = float(inrush_seconds)
+        except (ValueError, TypeError): inrush_seconds = -1.0
+        if not inrush_seconds >= 0: warnings.append(f"inrush_seconds ({item.get('inrush_seconds')}) ei kelpaa, käytetään oletusta"); inrush_seconds = None
+    identifier = str(item.get('identifier') or f"Pin_{pin}")
+    extra = {key: value for key, value in item.items() if key not in _RULE_FIELDS}
+    return PinRule(pin, identifier, upper_limit, lower_limit, n_value, hysteresis, startup_factor, power_kw,
+                   min_minutes['min_on_minutes'], min_minutes['min_off_minutes'], max_toggles, priority, inrush_seconds, extra), warnings
+
+def compile_settings(settings_list):
+    """Kääntää asetuslistan. Palauttaa (säännöt, varoitukset). Virheelliset ja päällekkäiset rivit ohitetaan."""
+    if not isinstance(settings_list, list): raise ValueError("asetustiedosto ei sisältänyt listaa")
+    rules, warnings, pins, identifiers = [], [], set(), set()
+    for i, item in enumerate(settings_list):
+        try: rule, rule_warnings = compile_rule(item)
+        except ValueError as e: warnings.append(f"Ohitetaan asetusrivi {i+1}: {e}"); continue
+        if rule.gpio_pin in pins or rule.identifier in identifiers:
+            warnings.append(f"Ohitetaan asetusrivi {i+1}: pinni {rule.gpio_pin} tai tunniste '{rule.identifier}' on jo käytössä"); continue
+        warnings.extend(f"Asetusrivi {i+1}: {warning}" for warning in rule_warnings)
+        pins.add(rule.gpio_pin); identifiers.add(rule.identifier)
+        rules.append(rule)
+    return rules, warnings
+
+# --- Välimuisti ---
+
+def _read_cache(cache_file):
+    try:
+        with open(cache_file, 'rb') as f: cached = marshal.loads(f.read())
+        return cached if isinstance(cached, dict) and cached.get('version') == CACHE_VERSION else None
+    except (OSError, EOFError, ValueError, TypeError): return None
+
+def _write_cache(cache_file, cached):
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_path = f"{cache_file}.tmp"
+        with open(tmp_path, 'wb') as f: f.write(marshal.dumps(cached))
+        os.replace(tmp_path, cache_file)
+    except (OSError, ValueError) as e: logging.warning(f"Asetusten välimuistin '{cache_file}' tallennus epäonnistui: {e}")
+
+def _rules_from_cache(cached):
+    return [PinRule(*values) for values in cached['rules']]
+
+# --- Lataus ---
+
+def load_settings(settings_file=SETTINGS_FILE, cache_file=SETTINGS_CACHE_FILE):
+    """
+    Lataa ja validoi asetukset (käännetty välimuisti ensin). Palauttaa listan PinRule-olioita,
+    tyhjän listan, jos kelvollisia rivejä ei ole, tai None, jos tiedostoa ei voida lukea.
+    """
+    settings_path = os.path.abspath(settings_file)
+    try: stat = os.stat(settings_path)
+    except OSError: logging.error(f"Asetustiedostoa '{settings_path}' ei löydy."); return None
+    cached = _read_cache(cache_file)
+    if cached is not None and cached.get('path') != settings_path: cached = None
+    if cached is not None and cached['mtime_ns'] == stat.st_mtime_ns and cached['size'] == stat.st_size:
+        return _report(_rules_from_cache(cached), cached['warnings'], settings_path, from_cache=True)
+    try:
+        with open(settings_path, 'rb') as f: raw = f.read()
+    except OSError as e: logging.error(f"Asetustiedoston '{settings_path}' lukeminen epäonnistui: {e}"); return None
+    digest = hashlib.sha256(raw).hexdigest()
+    if cached is not None and cached['sha256'] == digest:
+        # Sisältö ennallaan (esim. touch): päivitetään vain avain
+        cached.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+        _write_cache(cache_file, cached)
+        return _report(_rules_from_cache(cached), cached['warnings'], settings_path, from_cache=True)
+    try: rules, warnings = compile_settings(json.loads(raw.decode('utf-8')))
+    except (json.JSONDecodeError, UnicodeDecodeError) as e: logging.error(f"Asetustiedosto '{settings_path}' on virheellinen JSON: {e}"); return None
+    except ValueError as e: logging.error(f"Asetustiedosto '{settings_path}': {e}"); return None
+    _write_cache(cache_file, {"version": CACHE_VERSION, "path": settings_path, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+                              "sha256": digest, "rules": [rule.as_tuple() for rule in rules], "warnings": warnings})
+    return _report(rules, warnings, settings_path, from_cache=False)
+
+def _report(rules, warnings, settings_path, from_cache):
+    for warning in warnings: logging.warning(warning)
+    if not rules: logging.error(f"Asetustiedosto '{settings_path}' ei sisältänyt yhtään kelvollista pinnimääritystä."); return rules
+    logging.info(f"Löytyi {len(rules)} kelvollista pinnin asetusta ({'käännetty välimuisti' if from_cache else settings_path}).")
+    return rules
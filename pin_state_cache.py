@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+pin_state_cache.py
+
+Pysyvä pinnien tilavälimuisti (DATA_DIR/gpio_pin_state.json).
+
+Muistaa jokaisen pinnin viimeksi kirjoitetun tilan ajojen välillä, jotta
+hourly_control.py kirjoittaa vain ne pinnit, joiden tavoitetila poikkeaa
+nykyisestä. Lisäksi tallentaa pinnikohtaiset kytkentälaskurit ja viimeisimmän
+tilamuutoksen ajan (releiden kulumisen seurantaan).
+
+Tunnetut tilat mitätöidään, jos laite on käynnistetty uudelleen (Linuxin
+boot_id muuttuu), koska GPIO-pinnit palautuvat tällöin oletustilaan.
+Varmuuden vuoksi jokainen pinni kirjoitetaan uudelleen viimeistään
+REFRESH_SECONDS välein, vaikka tila ei olisi muuttunut.
+"""
+
+import json
+import logging
+import os
+import datetime
+
+# --- Konfiguraatio ja Polut ---
+DATA_DIR = os.path.expanduser('~/gpio_pricer_data')
+PIN_STATE_FILE = os.path.join(DATA_DIR, 'gpio_pin_state.json')
+BOOT_ID_FILE = '/proc/sys/kernel/random/boot_id'
+REFRESH_SECONDS = 6 * 3600   # Pinnin tila kirjoitetaan uudelleen viimeistään tämän välein
+
+def read_boot_id():
+    """Palauttaa käynnistyskohtaisen tunnisteen (Linux) tai None."""
+    try:
+        with open(BOOT_ID_FILE, 'r', encoding='ascii') as f: return f.read().strip()
+    except OSError: return None
+
+class PinStateCache:
+    """Pinnien viimeksi kirjoitetut tilat, kytkentälaskurit ja muutosajat."""
+
+    def __init__(self, cache_file=PIN_STATE_FILE):
+        self.cache_file = cache_file
+        self.boot_id = read_boot_id()
+        self.pins = {}      # str(pinni) -> {"state", "identifier", "toggles", "last_change", "last_write"}
+        self.dirty = False
+
+    @classmethod
+    def load(cls, cache_file=PIN_STATE_FILE):
+        """Lataa välimuistin tiedostosta. Uudelleenkäynnistyksen jälkeen tunnetut tilat unohdetaan (laskurit säilyvät)."""
+        cache = cls(cache_file)
+        if not os.path.exists(cache_file): return cache
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f: data = json.load(f)
+            cache.pins = data.get('pins', {}) if isinstance(data, dict) else {}
+            if data.get('boot_id') != cache.boot_id:
+                logging.info("Pinnien tilavälimuisti: laite käynnistetty uudelleen, kaikki pinnit kirjoitetaan.")
+                for entry in cache.pins.values(): entry['state'] = None
+                cache.dirty = True
+        except (json.JSONDecodeError, IOError, AttributeError) as e:
+            logging.warning(f"Pinnien tilavälimuistin '{cache_file}' lukeminen epäonnistui: {e}. Kaikki pinnit kirjoitetaan.")
+            cache.pins = {}
+        return cache
+
+    def save(self):
+        """Tallentaa välimuistin atomisesti, jos se on muuttunut."""
+        if not self.dirty: return True
+        tmp_path = f"{self.cache_file}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"boot_id": self.boot_id, "pins": self.pins}, f, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+            os.replace(tmp_path, self.cache_file)
+            self.dirty = False
+            return True
+        except (IOError, OSError) as e:
+            logging.error(f"Pinnien tilavälimuistin '{self.cache_file}' tallennus epäonnistui: {e}"); return False
+
+    def needs_write(self, pin, state, now):
+        """Tarvitseeko pinni kirjoituksen: tila tuntematon, eri kuin tavoite tai edellisestä kirjoituksesta yli REFRESH_SECONDS."""
+        entry = self.pins.get(str(pin))
+        if entry is None or entry.get('state') is None or entry['state'] != bool(state): return True
+        try: return (now - datetime.datetime.fromisoformat(entry['last_write'])).total_seconds() >= REFRESH_SECONDS
+        except (KeyError, TypeError, ValueError): return True
+
+    def known_state(self, pin):
+        """Palauttaa pinnin viimeksi kirjoitetun tilan tai None, jos se ei ole tiedossa."""
+        return self.pins.get(str(pin), {}).get('state')
+
+    def pending_changes(self, decisions, now):
+        """Suodattaa päätöksistä (tunniste, pinni, tila, syy) ne, jotka on kirjoitettava. Palauttaa listan (pinni, tila, tunniste)."""
+        return [(pin, state, identifier) for identifier, pin, state, _reason in decisions if self.needs_write(pin, state, now)]
+
+    def record_write(self, pin, state, identifier, now):
+        """Kirjaa onnistuneen kirjoituksen; kasvattaa kytkentälaskuria, jos tila muuttui."""
+        entry = self.pins.setdefault(str(pin), {"state": None, "toggles": 0, "last_change": None})
+        previous_state = entry.get('state')
+        timestamp = now.isoformat()
+        if previous_state is not None and previous_state != bool(state):
+            entry['toggles'] = entry.get('toggles', 0) + 1
+        if previous_state != bool(state): entry['last_change'] = timestamp
+        entry['state'] = bool(state); entry['identifier'] = identifier; entry['last_write'] = timestamp
+        self.dirty = True
+
+    def toggle_count(self, pin):
+        """Palauttaa pinnin kytkentälaskurin."""
+        return self.pins.get(str(pin), {}).get('toggles', 0)
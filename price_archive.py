@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+price_archive.py
+
+Pysyvä hintahistoria takautuvia laskelmia (backtest.py) varten.
+
+Tallentaa päiväkohtaiset hinnat DATA_DIR/price_archive/-hakemistoon
+vuosittaisiin JSON-tiedostoihin (esim. 2024.json) samassa muodossa kuin
+hintavälimuisti: {päivä_str: {"start": epoch, "resolution_minutes": 60 tai 15,
+"prices": [hinta_ct tai null, ...]}}, joten talviaikasiirtymän toistuvan tunnin
+hinnat säilyvät. Vanha {päivä_str: {"HH:MM": hinta_ct}} -muoto muunnetaan
+luettaessa. Hintavälimuisti (price_cache.py) siirtää
+karsimansa päivät tänne, joten arkisto kasvaa itsestään. Vanhemman historian
+voi täyttää kerralla Sahkotin /prices API:sta (--backfill), jolloin haku
+tehdään enintään FETCH_PAGE_DAYS päivän sivuina.
+
+Ajo: python3 price_archive.py --backfill --from 2022-01-01 [--to 2024-12-31]
+tai ilman parametreja, jolloin tulostetaan arkiston yhteenveto.
+"""
+
+import json
+import logging
+import os
+import sys
+import datetime
+import argparse
+import requests
+import api_client
+from price_cache import (DATA_DIR, SAHKOTIN_API_URL, API_TIMEOUT, LOCAL_TIMEZONE_STR, ZoneInfo,
+                         local_day_bounds_utc, split_prices_by_day)
+from price_slots import DayPrices, parse_price_json
+
+# --- Konfiguraatio ja Polut ---
+ARCHIVE_DIR = os.path.join(DATA_DIR, 'price_archive')
+FETCH_PAGE_DAYS = 31   # Montako päivää haetaan yhdellä API-kutsulla
+
+# --- Tiedostojen käsittely ---
+
+def _year_file(year, archive_dir=ARCHIVE_DIR):
+    return os.path.join(archive_dir, f"{year}.json")
+
+def _load_year(year, archive_dir=ARCHIVE_DIR):
+    """Lukee yhden vuoden arkiston. Palauttaa {päivä_str: tallennettu päivä} (DayPrices.to_json tai vanha {"HH:MM": hinta})."""
+    year_path = _year_file(year, archive_dir)
+    if not os.path.exists(year_path): return {}
+    try:
+        with open(year_path, 'r', encoding='utf-8') as f: days = json.load(f)
+        return days if isinstance(days, dict) else {}
+    except (json.JSONDecodeError, IOError) as e:
+        logging.error(f"Hinta-arkiston '{year_path}' lukeminen epäonnistui: {e}"); return {}
+
+def _save_year(year, days, archive_dir=ARCHIVE_DIR):
+    """Tallentaa vuoden arkiston atomisesti."""
+    year_path = _year_file(year, archive_dir)
+    tmp_path = f"{year_path}.tmp"
+    try:
+        os.makedirs(archive_dir, exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(days, f, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        os.replace(tmp_path, year_path)
+        return True
+    except (IOError, OSError) as e:
+        logging.error(f"Hinta-arkiston tallennus tiedostoon '{year_path}' epäonnistui: {e}"); return False
+
+def _day_from_entry(day_str, entry, local_tz):
+    """Muuntaa tallennetun päivän DayPrices-taulukoksi (vanha {"HH:MM": hinta} -muoto from_mapping-funktiolla). Virheellinen päivä: None."""
+    target_date = datetime.date.fromisoformat(day_str)
+    try:
+        if 'start' in entry: return DayPrices.from_json(target_date, entry, local_tz)
+        return DayPrices.from_mapping(target_date, entry, local_tz)
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        logging.warning(f"Hinta-arkiston päivä {day_str} on virheellinen: {e}"); return None
+
+def store_days(days, archive_dir=ARCHIVE_DIR):
+    """Lisää päivät {päivä_str: DayPrices} arkistoon (olemassa olevat päivät korvataan). Palauttaa tallennettujen päivien määrän."""
+    by_year = {}
+    for day_str, day_prices in days.items():
+        if day_prices is not None and day_prices.valid_count(): by_year.setdefault(day_str[:4], {})[day_str] = day_prices.to_json()
+    stored = 0
+    for year, year_days in by_year.items():
+        archived = _load_year(year, archive_dir)
+        archived.update(year_days)
+        if _save_year(year, archived, archive_dir): stored += len(year_days)
+    return stored
+
+def load_days(start_date, end_date, archive_dir=ARCHIVE_DIR, local_tz=None):
+    """Palauttaa arkistoidut päivät väliltä [start_date, end_date] muodossa {päivä_str: DayPrices}."""
+    local_tz = local_tz or ZoneInfo(LOCAL_TIMEZONE_STR)
+    start_str, end_str = start_date.isoformat(), end_date.isoformat()
+    days = {}
+    for year in range(start_date.year, end_date.year + 1):
+        for day_str, entry in _load_year(year, archive_dir).items():
+            if not start_str <= day_str <= end_str or not isinstance(entry, dict): continue
+            day_prices = _day_from_entry(day_str, entry, local_tz)
+            if day_prices is not None: days[day_str] = day_prices
+    return days
+
+def archived_range(archive_dir=ARCHIVE_DIR):
+    """Palauttaa (ensimmäinen, viimeinen, päivien määrä) arkistosta tai (None, None, 0)."""
+    if not os.path.isdir(archive_dir): return None, None, 0
+    all_days = []
+    for name in sorted(os.listdir(archive_dir)):
+        if name.endswith('.json') and name[:4].isdigit(): all_days.extend(_load_year(name[:4], archive_dir))
+    if not all_days: return None, None, 0
+    return min(all_days), max(all_days), len(all_days)
+
+# --- Takautuva haku ---
+
+def fetch_range(start_date, end_date, local_tz, api_url=SAHKOTIN_API_URL, timeout=API_TIMEOUT):
+    """Hakee hinnat väliltä [start_date, end_date] yhdellä API-kutsulla. Palauttaa PriceSeries tai None."""
+    start_utc, _ = local_day_bounds_utc(start_date, local_tz)
+    _, end_utc = local_day_bounds_utc(end_date, local_tz)
+    url = (f"{api_url}?fix&vat&start={start_utc.strftime('%Y-%m-%dT%H:%M:%S.000Z')}"
+           f"&end={end_utc.strftime('%Y-%m-%dT%H:%M:%S.000Z')}")
+    logging.info(f"API-KUTSU: {url} (hinta-arkiston täyttö)")
+    try:
+        response = api_client.get(url, timeout=timeout)
+        response.raise_for_status()
+        series = parse_price_json(response.content)
+        if series is None: logging.error(f"API VIRHE: Odottamaton JSON (puuttuu 'prices'): {response.content[:200]!r}"); return None
+        return series
+    except requests.exceptions.RequestException as e: logging.error(f"API VIRHE: Kutsu {url} epäonnistui: {e}"); return None
+    except ValueError: logging.error(f"API VIRHE: Vastaus ei ollut JSONia ({url})"); return None
+
+def backfill(start_date, end_date, archive_dir=ARCHIVE_DIR):
+    """Täyttää arkiston väliltä [start_date, end_date] puuttuvat päivät FETCH_PAGE_DAYS päivän sivuina. Palauttaa lisättyjen päivien määrän."""
+    local_tz = ZoneInfo(LOCAL_TIMEZONE_STR)
+    existing = {day_str for year in range(start_date.year, end_date.year + 1) for day_str in _load_year(year, archive_dir)}
+    added = 0
+    page_start = start_date
+    while page_start <= end_date:
+        page_end = min(page_start + datetime.timedelta(days=FETCH_PAGE_DAYS - 1), end_date)
+        page_days = [page_start + datetime.timedelta(days=i) for i in range((page_end - page_start).days + 1)]
+        if all(day.isoformat() in existing for day in page_days):
+            page_start = page_end + datetime.timedelta(days=1); continue
+        fetched = split_prices_by_day(fetch_range(page_start, page_end, local_tz), local_tz)
+        new_days = {day_str: day_prices for day_str, day_prices in fetched.items()
+                    if page_start.isoformat() <= day_str <= page_end.isoformat() and day_str not in existing}
+        added += store_days(new_days, archive_dir)
+        page_start = page_end + datetime.timedelta(days=1)
+    return added
+
+# --- Itsenäinen ajo ---
+
+def main():
+    parser = argparse.ArgumentParser(description="Hintahistorian arkisto (backtest.py:n lähde).")
+    parser.add_argument("--backfill", action="store_true", help="Hae puuttuvat päivät API:sta väliltä --from..--to")
+    parser.add_argument("--from", dest="date_from", type=str, help="Alkupäivä (VVVV-KK-PP)")
+    parser.add_argument("--to", dest="date_to", type=str, help="Loppupäivä (VVVV-KK-PP, oletus eilen)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stderr)
+    if args.backfill:
+        if not args.date_from: print("VIRHE: --backfill vaatii --from-päivän.", file=sys.stderr); sys.exit(1)
+        try:
+            start_date = datetime.date.fromisoformat(args.date_from)
+            end_date = datetime.date.fromisoformat(args.date_to) if args.date_to else datetime.date.today() - datetime.timedelta(days=1)
+        except ValueError: print("VIRHE: Päivämäärämuoto? Käytä VVVV-KK-PP.", file=sys.stderr); sys.exit(1)
+        added = backfill(start_date, end_date)
+        print(f"Arkistoon lisätty {added} päivää ({start_date.isoformat()} - {end_date.isoformat()}).")
+        api_client.close()
+    first, last, count = archived_range()
+    if not count: print(f"Hinta-arkisto on tyhjä ({ARCHIVE_DIR})."); return
+    print(f"Hinta-arkisto: {count} päivää, {first} - {last} ({ARCHIVE_DIR})")
+
+if __name__ == "__main__":
+    main()
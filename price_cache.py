@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+price_cache.py
+
+Paikallinen hintavälimuisti (price_cache.json, ks. SUUNNITELMA_V2.md).
+
+Hakee kuluvan päivän hinnat (ja seuraavan päivän hinnat, kun ne on julkaistu)
+yhdellä haulla (price_provider.py: Sahkotin /prices, varalla api.spot-hinta.fi)
+ja tallentaa ne DATA_DIR-hakemistoon
+päiväkohtaisina jaksotaulukkoina (price_slots.DayPrices: päivän alku epoch-
+sekunteina, resoluutio 15/60 min ja hintalista, 92-100 tai 23-25 jaksoa).
+Valmiita päiviä ei haeta uudelleen; keskeneräisen päivän uudelleenhakua
+rajoitetaan CACHE_TTL_SECONDS-asetuksella ja vanhat päivät karsitaan.
+
+Voidaan ajaa myös itsenäisesti (esim. cronilla klo 14:15 jälkeen), jolloin
+välimuisti päivitetään ja sen sisältö tulostetaan.
+"""
+
+import json
+import logging
+import os
+import sys
+import datetime
+import app_config
+import price_provider
+from price_slots import (DayPrices, PriceSeries, split_epoch_prices, parse_price_entries,
+                         local_day_bounds_utc)
+# Aikavyöhykkeitä varten (Python 3.9+)
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    try:
+        from pytz import timezone as ZoneInfo
+    except ImportError:
+        print("VIRHE: Aikavyöhykekirjastoa (zoneinfo tai pytz) ei löydy.", file=sys.stderr)
+        sys.exit(1)
+
+# --- Konfiguraatio ja Polut ---
+DATA_DIR = os.path.expanduser('~/gpio_pricer_data')
+PRICE_CACHE_FILE = os.path.join(DATA_DIR, 'price_cache.json')
+SAHKOTIN_API_URL = app_config.get('sahkotin_api_url')   # Vaihdettavissa config.json:lla tai ympäristömuuttujalla
+API_TIMEOUT = 15          # Yksittäisen lähteen haku (api_url); suojatun haun aikaraja on price_provider.DEADLINE_S
+LOCAL_TIMEZONE_STR = "Europe/Helsinki"
+CACHE_TTL_SECONDS = 3600   # Keskeneräisen päivän (tai epäonnistuneen haun) uudelleenhakuväli
+CACHE_KEEP_DAYS = 2        # Montako mennyttä päivää välimuistissa säilytetään
+
+# --- Apufunktiot ---
+
+def get_day(cache, target_date, local_tz):
+    """Palauttaa välimuistin päivän DayPrices-taulukkona tai None."""
+    entry = cache['days'].get(target_date.isoformat())
+    if not entry or not entry.get('prices'): return None
+    try: return DayPrices.from_json(target_date, entry, local_tz)
+    except (KeyError, TypeError, ValueError) as e:
+        logging.warning(f"Hintavälimuistin päivä {target_date.isoformat()} on virheellinen: {e}"); return None
+
+# --- Välimuistitiedoston käsittely ---
+
+def load_cache(cache_file=PRICE_CACHE_FILE):
+    """Lukee välimuistin tiedostosta. Palauttaa tyhjän välimuistin, jos tiedostoa ei ole tai se on virheellinen."""
+    empty_cache = {"days": {}, "last_fetch_attempt": None}
+    if not os.path.exists(cache_file): return empty_cache
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f: cache = json.load(f)
+        if not isinstance(cache, dict) or not isinstance(cache.get('days'), dict):
+            logging.warning(f"Hintavälimuisti '{cache_file}' on virheellisessä muodossa, aloitetaan tyhjästä.")
+            return empty_cache
+        cache.setdefault('last_fetch_attempt', None)
+        return cache
+    except (json.JSONDecodeError, IOError) as e:
+        logging.warning(f"Hintavälimuistin '{cache_file}' lukeminen epäonnistui: {e}. Aloitetaan tyhjästä.")
+        return empty_cache
+
+def save_cache(cache, cache_file=PRICE_CACHE_FILE):
+    """Tallentaa välimuistin atomisesti (väliaikaistiedosto + uudelleennimeäminen)."""
+    tmp_path = f"{cache_file}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        os.replace(tmp_path, cache_file)
+        return True
+    except (IOError, OSError) as e:
+        logging.error(f"Hintavälimuistin '{cache_file}' tallennus epäonnistui: {e}")
+        return False
+
+def evict_old_days(cache, today):
+    """Siirtää hinta-arkistoon (price_archive.py) ja poistaa välimuistista päivät, jotka ovat vanhempia kuin CACHE_KEEP_DAYS."""
+    oldest_kept = (today - datetime.timedelta(days=CACHE_KEEP_DAYS)).isoformat()
+    evicted = [day for day in cache['days'] if day < oldest_kept]
+    if evicted:
+        import price_archive
+        local_tz = ZoneInfo(LOCAL_TIMEZONE_STR)
+        archived = {day: get_day(cache, datetime.date.fromisoformat(day), local_tz) for day in evicted}
+        price_archive.store_days(archived)
+    for day in evicted: del cache['days'][day]
+    if evicted: logging.info(f"Hintavälimuisti: poistettu vanhat päivät {sorted(evicted)}")
+    return evicted
+
+# --- Haku ja jäsennys ---
+
+def fetch_prices_bulk(start_date, local_tz, api_url=None, timeout=API_TIMEOUT):
+    """
+    Hakee kaikki hinnat annetun päivän alusta alkaen (tänään + huominen, jos
+    julkaistu). Ilman api_url-arvoa haku tehdään price_provider.py:n suojatuilla
+    pyynnöillä (Sahkotin ja api.spot-hinta.fi, aikaraja price_deadline_seconds);
+    api_url annettuna haetaan vain kyseisestä Sahkotin-yhteensopivasta osoitteesta.
+    Vastaus jäsennetään suoraan tavuista tyypitettyihin taulukoihin. Palauttaa PriceSeries tai None.
+    """
+    if api_url: return price_provider.SahkotinSource(api_url).fetch(start_date, local_tz, timeout)
+    series, _source = price_provider.fetch_prices(start_date, local_tz)
+    return series
+
+def split_prices_by_day(prices, local_tz):
+    """
+    Jakaa hinnat (PriceSeries tai raakalista dictejä 'date'/'value') paikallisiin
+    päiviin jaksotaulukoiksi ilman hintakohtaisia aikavyöhykemuunnoksia.
+    Palauttaa {päivä_str: DayPrices}.
+    """
+    if not isinstance(prices, PriceSeries): prices = parse_price_entries(prices)
+    return split_epoch_prices(prices, local_tz)
+
+# --- Julkinen rajapinta ---
+
+def ensure_prices(target_date, now=None, cache_file=PRICE_CACHE_FILE):
+    """
+    Palauttaa päivän hinnat (DayPrices) välimuistista. Jos päivä puuttuu tai
+    on keskeneräinen ja edellisestä hakuyrityksestä on kulunut yli CACHE_TTL_SECONDS,
+    tekee yhden bulkkihaun ja päivittää välimuistin. Palauttaa None, jos hintoja ei ole.
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    local_tz = ZoneInfo(LOCAL_TIMEZONE_STR)
+    today = now.astimezone(local_tz).date()
+    cache = load_cache(cache_file)
+    day_str = target_date.isoformat()
+    day_prices = get_day(cache, target_date, local_tz)
+    if day_prices is not None and day_prices.is_complete(): return day_prices
+
+    last_attempt = cache.get('last_fetch_attempt')
+    if last_attempt:
+        try:
+            age_s = (now - datetime.datetime.fromisoformat(last_attempt)).total_seconds()
+            if 0 <= age_s < CACHE_TTL_SECONDS:
+                logging.info(f"Hintavälimuisti: päivä {day_str} keskeneräinen, edellinen haku {age_s:.0f} s sitten (TTL {CACHE_TTL_SECONDS} s). Ei uutta hakua.")
+                return day_prices if day_prices is not None and day_prices.valid_count() else None
+        except (ValueError, TypeError): pass
+
+    cache['last_fetch_attempt'] = now.isoformat()
+    prices_raw = fetch_prices_bulk(min(today, target_date), local_tz)
+    if prices_raw is None and day_prices is not None and day_prices.valid_count():
+        logging.warning(f"Hintahaku epäonnistui. Käytetään välimuistin viimeisimpiä hintoja päivälle {day_str} ({day_prices.valid_count()}/{len(day_prices)} jaksoa).")
+    fetched_iso = now.isoformat()
+    for fetched_day, fetched_prices in split_prices_by_day(prices_raw, local_tz).items():
+        cache['days'][fetched_day] = dict(fetched_prices.to_json(), fetched=fetched_iso)
+    evict_old_days(cache, today)
+    save_cache(cache, cache_file)
+    day_prices = get_day(cache, target_date, local_tz)
+    return day_prices if day_prices is not None and day_prices.valid_count() else None
+
+def get_current_price(day_prices, dt):
+    """Palauttaa (jakson indeksi, hinta) annetulle ajalle päivän hinnoista (O(1))."""
+    if not day_prices: return None, None
+    index = day_prices.index_at(dt.timestamp())
+    return index, (None if index is None else day_prices.price(index))
+
+# --- Itsenäinen ajo ---
+
+def main():
+    """Päivittää välimuistin kuluvalle ja seuraavalle päivälle ja tulostaa yhteenvedon."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stderr)
+    local_tz = ZoneInfo(LOCAL_TIMEZONE_STR)
+    today = datetime.datetime.now(local_tz).date()
+    for target_date in (today, today + datetime.timedelta(days=1)):
+        prices = ensure_prices(target_date)
+        if prices is None: print(f"{target_date.isoformat()}: ei hintoja välimuistissa"); continue
+        print(f"{target_date.isoformat()}: {prices.valid_count()}/{len(prices)} hintaa välimuistissa ({prices.resolution_minutes} min jaksot)")
+
+if __name__ == "__main__":
+    main()
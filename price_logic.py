@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+price_logic.py
+
+Paikallinen hintalogiikka, jota ohjaus (hourly_control.py) ja muut työkalut
+käyttävät. Vastaa api.spot-hinta.fi -palvelun /JustNow- ja
+/CheapestPeriodTodayCheck-tarkistuksia, mutta laskee tuloksen muistissa
+olevista hinnoista ilman verkkokutsuja.
+"""
+
+import heapq
+
+# Hintarajatarkistuksen tulokset (samat arvot kuin /JustNow API:lla)
+LIMIT_BELOW_LOWER = 0   # hinta <= alaraja
+LIMIT_BETWEEN = 1       # alaraja < hinta <= yläraja
+LIMIT_ABOVE_UPPER = 2   # hinta > yläraja
+
+def classify_price(price_ct_kwh, lower_limit_ct, upper_limit_ct):
+    """
+    Vertaa hintaa kokonaislukurajoihin kuten /JustNow/{lower}/{upper}.
+    Palauttaa: 0 (hinta <= alaraja), 1 (hinta välissä), 2 (hinta > yläraja) tai None (hinta puuttuu).
+    """
+    if price_ct_kwh is None: return None
+    lower_limit = float(lower_limit_ct)
+    upper_limit = float(upper_limit_ct)
+    if lower_limit > upper_limit: lower_limit = upper_limit
+    price = float(price_ct_kwh)
+    if price > upper_limit: return LIMIT_ABOVE_UPPER
+    if price <= lower_limit: return LIMIT_BELOW_LOWER
+    return LIMIT_BETWEEN
+
+def find_cheapest_slots(prices_by_slot, n):
+    """Etsii N halvinta jaksoa {jakso: hinta} dictistä (O(n log N) kekovalinta). Palauttaa set jaksoavaimista."""
+    if n <= 0 or not prices_by_slot: return set()
+    return {slot for price, slot in heapq.nsmallest(n, ((price, slot) for slot, price in prices_by_slot.items() if price is not None))}
+
+def find_cheapest_intervals_with_startup_cost(prices_by_slot, n, startup_factor=1.0, initially_on=False):
+    """
+    Valitsee N jaksoa {jakso: hinta} dictistä minimoiden hintojen summan, kun
+    jokaisen käynnistyksen (ON-jakso, jota edeltää OFF-jakso) hinta painotetaan
+    startup_factor-kertoimella (negatiivista hintaa ei painoteta). Kerroin 1.0
+    vastaa find_cheapest_slots-valintaa. initially_on: edellinen jakso (edellisen
+    päivän viimeinen) oli ON, joten ensimmäinen jakso ei ole käynnistys.
+
+    Tarkka dynaaminen ohjelmointi O(jaksot × N): kustannustaulukosta pidetään
+    vain kaksi riviä (OFF/ON-tila × valittujen määrä), paluuosoittimet tavuina.
+    Palauttaa set jaksoavaimista.
+    """
+    if startup_factor <= 1.0: return find_cheapest_slots(prices_by_slot, n)
+    slots = sorted(prices_by_slot)
+    n = min(n, sum(1 for slot in slots if prices_by_slot[slot] is not None))
+    if n <= 0: return set()
+    inf = float('inf')
+    width = n + 1
+    off_costs = [0.0] + [inf] * n
+    on_costs = [inf] * width
+    # Paluuosoittimet per jakso ja valittujen määrä: bitti 0 = OFF-tila tuli ON-tilasta, bitti 1 = ON-tila tuli ON-tilasta
+    back = bytearray(len(slots) * width)
+    for index, slot in enumerate(slots):
+        price = prices_by_slot[slot]
+        new_off, new_on = [inf] * width, [inf] * width
+        row = index * width
+        start_price = price * startup_factor if price is not None and price > 0 else price
+        for k in range(width):
+            from_off, from_on = off_costs[k], on_costs[k]
+            if index == 0 and initially_on: from_off, from_on = inf, from_off
+            if from_on < from_off: new_off[k] = from_on; back[row + k] |= 1
+            else: new_off[k] = from_off
+            if price is None or k == 0: continue
+            prev_off, prev_on = off_costs[k - 1], on_costs[k - 1]
+            if index == 0 and initially_on: prev_off, prev_on = inf, prev_off
+            via_off, via_on = prev_off + start_price, prev_on + price
+            if via_on <= via_off: new_on[k] = via_on; back[row + k] |= 2
+            else: new_on[k] = via_off
+        off_costs, on_costs = new_off, new_on
+    state_on = on_costs[n] < off_costs[n]
+    if min(on_costs[n], off_costs[n]) == inf: return find_cheapest_slots(prices_by_slot, n)
+    selected, k = set(), n
+    for index in range(len(slots) - 1, -1, -1):
+        bits = back[index * width + k]
+        if state_on:
+            selected.add(slots[index]); k -= 1
+            state_on = bool(bits & 2)
+        else: state_on = bool(bits & 1)
+    return selected
+
+def count_starts(selected_slots, slots, initially_on=False):
+    """Laskee käynnistysten määrän (OFF -> ON) aikajärjestyksessä oleville jaksoille."""
+    starts, previous = 0, initially_on
+    for slot in slots:
+        current = slot in selected_slots
+        if current and not previous: starts += 1
+        previous = current
+    return starts
+
+def find_cheapest_indices(prices, n):
+    """
+    Etsii N halvinta jaksoa aikajärjestyksessä olevasta hintalistasta (None = ei hintaa)
+    O(n log N) kekovalinnalla. Tasahinnoissa aiempi jakso valitaan ensin.
+    Palauttaa valittujen jaksojen indeksit aikajärjestyksessä.
+    """
+    if n <= 0: return []
+    return sorted(index for price, index in heapq.nsmallest(n, ((price, index) for index, price in enumerate(prices) if price is not None)))
+
+def cheapest_slot_count(hours_n, resolution_minutes):
+    """Muuntaa cheapest_hours_n-asetuksen (tunteja) päivän jaksojen määräksi, esim. N=2 15 min hinnoilla = 8 jaksoa."""
+    return int(hours_n) * 60 // int(resolution_minutes) if hours_n > 0 else 0
+
+def find_cheapest_window(prices, length):
+    """
+    Etsii halvimman yhtenäisen length jakson ikkunan aikajärjestyksessä olevasta
+    hintalistasta liukuvalla summalla (O(n)). Ikkuna ei saa sisältää puuttuvaa
+    hintaa (None). Palauttaa (alkuindeksi, hintojen summa) tai None.
+    """
+    if length <= 0 or length > len(prices): return None
+    best = None
+    window_sum, valid_run = 0.0, 0
+    for index, price in enumerate(prices):
+        if price is None: window_sum, valid_run = 0.0, 0; continue
+        window_sum += price; valid_run += 1
+        if valid_run > length: window_sum -= prices[index - length]; valid_run = length
+        if valid_run == length and (best is None or window_sum < best[1]): best = (index - length + 1, window_sum)
+    return best
+
+# Päätöksen syykoodit (control_schedule.json tallentaa koodin, teksti muotoillaan pinnin rajoilla)
+REASON_NO_PRICE = 0
+REASON_ABOVE_UPPER = 1
+REASON_BELOW_LOWER = 2
+REASON_CHEAPEST = 3
+REASON_NOT_CHEAPEST = 4
+REASON_BETWEEN_N0 = 5
+REASON_OVERRIDE_ON = 6
+REASON_OVERRIDE_OFF = 7
+REASON_NO_SCHEDULE = 8
+REASON_HYSTERESIS_HOLD = 9
+REASON_SWITCH_HOLD_ON = 10
+REASON_SWITCH_HOLD_OFF = 11
+REASON_POWER_CAP_OFF = 12
+REASON_POWER_CAP_ON = 13
+
+REASON_TEXTS = {
+    REASON_NO_PRICE: "Hintatieto puuttuu",
+    REASON_ABOVE_UPPER: "Hinta > Yläraja ({upper} ct/kWh)",
+    REASON_BELOW_LOWER: "Hinta <= Alaraja ({lower} ct/kWh)",
+    REASON_CHEAPEST: "Hinta välillä ({lower} - {upper}] ct/kWh, kuuluu {n} halvimpaan tuntiin",
+    REASON_NOT_CHEAPEST: "Hinta välillä ({lower} - {upper}] ct/kWh, EI kuulu {n} halvimpaan tuntiin",
+    REASON_BETWEEN_N0: "Hinta välillä ({lower} - {upper}] ct/kWh, N=0, ei tarkistusta",
+    REASON_OVERRIDE_ON: "Manuaalinen ohitus (ON)",
+    REASON_OVERRIDE_OFF: "Manuaalinen ohitus (OFF)",
+    REASON_NO_SCHEDULE: "Aikataulusta ei löytynyt merkintää, turvallinen OFF",
+    REASON_HYSTERESIS_HOLD: "Hystereesi: ON säilyy (rajat + {hysteresis} ct/kWh)",
+    REASON_SWITCH_HOLD_ON: "Kytkentärajoitus: ON (vähimmäisaika tai päivän kytkentäbudjetti)",
+    REASON_SWITCH_HOLD_OFF: "Kytkentärajoitus: OFF (vähimmäisaika tai päivän kytkentäbudjetti)",
+    REASON_POWER_CAP_OFF: "Sivuston tehoraja: OFF (jakso siirretty tai teho ei riitä)",
+    REASON_POWER_CAP_ON: "Sivuston tehoraja: ON (siirretty halvimpaan vapaaseen jaksoon)",
+}
+
+def decide_slot(price_ct_kwh, lower_limit_ct, upper_limit_ct, n, in_cheapest):
+    """
+    Yhden jakson päätös paikallisesti (sama logiikka kuin hourly_control.py:n API-tarkistuksissa).
+    Palauttaa (tila True/False, syykoodi).
+    """
+    limit_result = classify_price(price_ct_kwh, lower_limit_ct, upper_limit_ct)
+    if limit_result is None: return False, REASON_NO_PRICE
+    if limit_result == LIMIT_ABOVE_UPPER: return False, REASON_ABOVE_UPPER
+    if limit_result == LIMIT_BELOW_LOWER: return True, REASON_BELOW_LOWER
+    if n <= 0: return False, REASON_BETWEEN_N0
+    if in_cheapest: return True, REASON_CHEAPEST
+    return False, REASON_NOT_CHEAPEST
+
+def decide_slot_with_hysteresis(price_ct_kwh, lower_limit_ct, upper_limit_ct, n, in_cheapest, previous_state, hysteresis_ct_kwh):
+    """
+    Kuten decide_slot, mutta hystereesillä: jos pinni oli edellisellä jaksolla ON,
+    molempia rajoja nostetaan hysteresis_ct_kwh verran, joten pinni pysyy päällä
+    pidempään hinnan heiluessa rajan tuntumassa. Koska rajojen nosto voi vain
+    lisätä ON-päätöksiä, tila on aina joko hystereesitön päätös tai edellinen tila.
+    """
+    state, reason_code = decide_slot(price_ct_kwh, lower_limit_ct, upper_limit_ct, n, in_cheapest)
+    if state or not previous_state or hysteresis_ct_kwh <= 0 or reason_code == REASON_NO_PRICE: return state, reason_code
+    held_state, _ = decide_slot(price_ct_kwh, float(lower_limit_ct) + hysteresis_ct_kwh, float(upper_limit_ct) + hysteresis_ct_kwh, n, in_cheapest)
+    if held_state: return True, REASON_HYSTERESIS_HOLD
+    return state, reason_code
+
+# --- Kytkentöjen rajoitus ---
+
+def count_toggles(states, initial_state=False):
+    """Laskee tilan vaihdot aikajärjestyksessä olevasta tilasarjasta (ensimmäinen jakso verrataan initial_state-tilaan)."""
+    toggles, previous = 0, bool(initial_state)
+    for state in states:
+        if bool(state) != previous: toggles += 1; previous = bool(state)
+    return toggles
+
+def minutes_to_slots(minutes, resolution_minutes):
+    """Muuntaa keston minuuteista jaksoiksi (pyöristys ylöspäin)."""
+    return -(-int(minutes) // int(resolution_minutes)) if minutes > 0 else 0
+
+def trailing_run_minutes(states, resolution_minutes):
+    """Tilasarjan viimeisen yhtenäisen tilan kesto minuutteina (seuraavan päivän alkutilanne vähimmäisajoille)."""
+    if not states: return 0
+    last, run = states[-1], 0
+    for state in reversed(states):
+        if state != last: break
+        run += 1
+    return run * int(resolution_minutes)
+
+def _switching_ok(states, min_on_slots, min_off_slots, budget, state, run, forced):
+    """Täyttääkö tilasarja vähimmäisajat ja kytkentäbudjetin (pakotettu vaihto on aina sallittu)."""
+    used = 0
+    for index, new_state in enumerate(states):
+        force = forced[index] if forced else None
+        if force is not None and new_state != force: return False
+        if new_state != state and force is None:
+            if run < (min_on_slots if state else min_off_slots): return False
+            used += 1
+            if budget is not None and used > budget: return False
+        run = run + 1 if new_state == state else 1
+        state = new_state
+    return True
+
+_INF = float('inf')
+SWITCH_MISMATCH_COST = 1e-6       # Poikkeama toivotusta tilasta (tasatilanteiden ratkaisu, pienempi kuin hintojen tarkkuus)
+SWITCH_CACHE_SIZE = 256           # Muistettujen limit_switching-tulosten määrä
+_switch_cache = {}
+
+def _cheapest_limited(desired, on_costs, reward, min_on_slots, min_off_slots, budget, initial_state, start_run, run_cap, forced):
+    """
+    Yksi limit_switching-kierros: halvin rajoitukset täyttävä sarja, kun ON-jakso maksaa on_costs[jakso] - reward
+    ja poikkeama toivotusta SWITCH_MISMATCH_COST. Tilat ovat listoja jakson kestoittain (indeksi = kesto - 1,
+    viimeinen = vähintään run_cap), ja käytettyjen vaihtojen ulottuvuus on vain, jos budget on annettu.
+    ON-tilojen arvot tallennetaan suhteessa kertyneeseen ON-kustannukseen (sama kaikille ON-tiloille),
+    joten jakson käsittely on pelkkiä viipalointeja ja minimejä. Palauttaa tilalistan.
+    """
+    layers = 1 if budget is None else budget + 1
+    last = run_cap - 1
+    inf_row = [_INF] * run_cap
+    off = [list(inf_row) for _ in range(layers)]
+    on = [list(inf_row) for _ in range(layers)]
+    (on if initial_state else off)[0][start_run - 1] = 0.0
+    off_from, on_from = max(min_off_slots, 1) - 1, max(min_on_slots, 1) - 1   # Pienin kestoindeksi, josta saa vaihtaa
+    history, accrued = [], 0.0   # accrued: ON-tilojen yhteinen kertynyt kustannus (tosi arvo = tallennettu + accrued)
+    for index, wanted in enumerate(desired):
+        force = forced[index] if forced else None
+        history.append((off, on, accrued))
+        # Poikkeamat = toivotut ON-jaksot + ON-jaksot, joita ei toivottu - toivotut ON-jaksot, joten OFF-tila ei maksa mitään
+        cost_on = on_costs[index] - reward + (-SWITCH_MISMATCH_COST if wanted else SWITCH_MISMATCH_COST)
+        new_off, new_on = [], []
+        # Vaihto samalta kerrokselta (ei budjettia tai pakotettu vaihto, joka ei kuluta budjettia) tai edelliseltä
+        shift = 0 if force is not None or budget is None else 1
+        switch_off = [min(row if force is not None else row[on_from:]) + accrued for row in on]
+        switch_on = [min(row if force is not None else row[off_from:]) - accrued for row in off]
+        for used in range(layers):
+            source = used - shift
+            if force is True: new_off.append(inf_row)
+            else:
+                row, switch = off[used], switch_off[source] if source >= 0 else _INF
+                if last == 0: new_off.append([switch if switch < row[0] else row[0]])
+                else:
+                    new_row = [switch, *row[:last]]
+                    if row[last] < new_row[last]: new_row[last] = row[last]
+                    new_off.append(new_row)
+            if force is False: new_on.append(inf_row)
+            else:
+                row, switch = on[used], switch_on[source] if source >= 0 else _INF
+                if last == 0: new_on.append([switch if switch < row[0] else row[0]])
+                else:
+                    new_row = [switch, *row[:last]]
+                    if row[last] < new_row[last]: new_row[last] = row[last]
+                    new_on.append(new_row)
+        off, on = new_off, new_on
+        accrued += cost_on
+    states = [False] * len(desired)
+    if not desired: return states
+    best, key = _INF, None
+    for used in range(layers):
+        for state, rows, offset in ((False, off, 0.0), (True, on, accrued)):
+            run = min(range(run_cap), key=rows[used].__getitem__)
+            if rows[used][run] + offset < best: best, key = rows[used][run] + offset, (state, used, run)
+    for index in range(len(desired) - 1, -1, -1):
+        state, used, run = key
+        states[index] = state
+        previous_off, previous_on, accrued = history[index]
+        row, other_rows = (previous_on[used], previous_off) if state else (previous_off[used], previous_on)
+        if run == last and last > 0: key = (state, used, last - 1 if row[last - 1] <= row[last] else last); continue
+        if run > 0: key = (state, used, run - 1); continue
+        force = forced[index] if forced else None
+        source = used if force is not None or budget is None else used - 1
+        first = 0 if force is not None else (on_from if not state else off_from)
+        other_row = other_rows[source] if source >= 0 else None
+        switch_run = min(range(first, run_cap), key=other_row.__getitem__) if other_row is not None else None
+        if last == 0:
+            # Sama tila jatkuu vai vaihto: verrataan tosiarvoja (ON-arvoihin lisätään kertynyt kustannus)
+            stay = row[0] + (accrued if state else 0.0)
+            switch = _INF if switch_run is None else other_row[switch_run] + (0.0 if state else accrued)
+            if stay <= switch: key = (state, used, 0); continue
+        key = (not state, source, switch_run)
+    return states
+
+def limit_switching(desired, prices=None, min_on_slots=0, min_off_slots=0, max_toggles=None,
+                    initial_state=False, initial_run_slots=None, forced=None):
+    """
+    Tilallinen kytkentöjen rajoitus. Toivottu tilasarja (desired, esim. hystereesipäätökset)
+    palautetaan sellaisenaan, jos
+      * ON-tila kestää vähintään min_on_slots ja OFF-tila min_off_slots jaksoa ennen vaihtoa ja
+      * tilan vaihtoja on enintään max_toggles (None = rajaton; ensimmäistä jaksoa verrataan initial_state-tilaan).
+    Muuten valitaan rajoitukset täyttävä sarja, jossa ON-jaksoja on vähintään yhtä monta kuin toivotussa
+    (pinnin käyntiaika säilyy, jos se on mahdollista) halvimmissa kohdissa, eli tarvittavat ON-jaksot
+    ryhmitellään vähintään min_on_slots pituisiksi lohkoiksi. Tasatilanteessa valitaan sarja, joka poikkeaa
+    toivotusta harvimmassa jaksossa. Jakso ilman hintaa maksaa päivän kalleimman hinnan.
+    initial_run_slots: montako jaksoa initial_state on jo kestänyt (None = riittävästi).
+    forced: pakotetut tilat jaksoittain (manuaalinen ohitus, None = vapaa); pakotettu vaihto ei
+    odota vähimmäisaikaa eikä kuluta budjettia, joten ratkaisu on aina olemassa.
+
+    ON-jaksojen määrä on Lagrangen ehto: jokainen ON-jakso saa palkkion, ja pienin palkkio, jolla
+    ON-jaksoja on tarpeeksi, haetaan taitekohdista (yleensä muutama kierros). Kierros on dynaaminen ohjelmointi tiloilla
+    (tila, kesto enintään max(min_on, min_off)) ja käytettyjen vaihtojen ulottuvuus lisätään vain,
+    jos budjetti ylittyy ilman sitä. Tulokset muistetaan (SWITCH_CACHE_SIZE). Palauttaa listan bool-tiloja.
+    """
+    run_cap = max(min_on_slots, min_off_slots, 1)
+    budget = None if max_toggles is None else max(0, int(max_toggles))
+    start_run = run_cap if initial_run_slots is None else max(1, min(int(initial_run_slots), run_cap))
+    desired = [bool(wanted) for wanted in desired]
+    if _switching_ok(desired, min_on_slots, min_off_slots, budget, bool(initial_state), start_run, forced): return desired
+    cache_key = (tuple(desired), tuple(prices) if prices else None, min_on_slots, min_off_slots, budget, bool(initial_state),
+                 start_run, tuple(forced) if forced else None)
+    cached = _switch_cache.get(cache_key)
+    if cached is not None: return list(cached)
+    known_prices = [price for price in (prices or []) if price is not None]
+    missing_cost = max(known_prices) if known_prices else 0.0
+    on_costs = [missing_cost if not prices or prices[index] is None else prices[index] for index in range(len(desired))]
+    target = sum(desired)
+
+    def solve(reward):
+        states = _cheapest_limited(desired, on_costs, reward, min_on_slots, min_off_slots, None, initial_state, start_run, run_cap, forced)
+        if budget is None or _switching_ok(states, min_on_slots, min_off_slots, budget, bool(initial_state), start_run, forced): return states
+        return _cheapest_limited(desired, on_costs, reward, min_on_slots, min_off_slots, budget, initial_state, start_run, run_cap, forced)
+
+    def cost(states):
+        return (sum(on_costs[index] for index, state in enumerate(states) if state)
+                + SWITCH_MISMATCH_COST * sum(1 for state, wanted in zip(states, desired) if state != wanted))
+
+    low = best = solve(0.0)
+    if sum(low) < target:
+        # Palkkio, jolla jokainen ON-jakso on kannattava; riittämättömällä haetaan suurin mahdollinen ON-määrä
+        best = solve(max(on_costs) - min(min(on_costs), 0.0) + 1.0)
+        if sum(best) < target: best = solve(sum(abs(cost) for cost in on_costs) + len(on_costs) + 1.0)
+        # Taitekohtahaku: palkkio, jolla low- ja best-sarjat maksavat saman; parempi sarja tällä palkkiolla korvaa toisen
+        while sum(best) > target:
+            low_cost, best_cost = cost(low), cost(best)
+            reward = (best_cost - low_cost) / (sum(best) - sum(low))
+            states = solve(reward)
+            if cost(states) - reward * sum(states) >= best_cost - reward * sum(best) - SWITCH_MISMATCH_COST / 2: break
+            if sum(states) >= target: best = states
+            else: low = states
+    if len(_switch_cache) >= SWITCH_CACHE_SIZE: _switch_cache.clear()
+    _switch_cache[cache_key] = tuple(best)
+    return best
+
+# --- Sivuston tehoraja ---
+
+def fit_under_cap(states, power_kw, headroom, prices, allowed, forced=None):
+    """
+    Sovittaa yhden pinnin ON-jaksot sivuston jäljellä olevaan tehovaraan (headroom, kW per jakso).
+    ON-jakso säilyy, jos teho mahtuu; muut siirretään halvimpiin jaksoihin, joissa pinni saa olla
+    päällä (allowed), tehoa on vapaana eikä tila ole pakotettu. Pakotetut tilat (forced, manuaalinen
+    ohitus) säilyvät aina, ja niiden teho on jo vähennetty headroom-listasta.
+    Palauttaa uudet tilat (jos vapaita jaksoja ei ole tarpeeksi, ON-jaksoja jää vähemmän). headroom-listaa ei muuteta.
+    """
+    new_states, displaced = list(states), 0
+    for index, state in enumerate(states):
+        if state and not (forced and forced[index] is not None) and headroom[index] < power_kw: new_states[index] = False; displaced += 1
+    if not displaced: return new_states
+    candidates = ((prices[index], index) for index in range(len(states))
+                  if not new_states[index] and not states[index] and allowed[index] and prices[index] is not None
+                  and headroom[index] >= power_kw and not (forced and forced[index] is not None))
+    for _price, index in heapq.nsmallest(displaced, candidates): new_states[index] = True
+    return new_states
+
+def format_reason(reason_code, lower_limit_ct=None, upper_limit_ct=None, n=None, hysteresis_ct_kwh=None):
+    """Muotoilee syykoodin luettavaksi tekstiksi pinnin asetuksilla."""
+    template = REASON_TEXTS.get(reason_code)
+    if template is None: return f"Tuntematon syykoodi ({reason_code})"
+    return template.format(lower=lower_limit_ct, upper=upper_limit_ct, n=n, hysteresis=hysteresis_ct_kwh)
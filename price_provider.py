@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+price_provider.py
+
+Hintalähteet yhteisen rajapinnan takana. Sekä Sahkotin /prices että
+api.spot-hinta.fi /TodayAndDayForward muunnetaan samaan muotoon: PriceSeries
+(aikaleimat epoch-sekunteina, hinnat ct/kWh sis. ALV), joka jaetaan päivien
+jaksotaulukoiksi kuten ennenkin (price_slots.split_epoch_prices).
+
+fetch_prices() hakee hinnat suojatuilla pyynnöillä (hedged requests):
+  * Ensisijaiselta lähteeltä pyydetään heti. Jos se ei ole vastannut
+    HEDGE_DELAY_S sekunnissa (tai vastasi virheellä), sama haku lähetetään
+    seuraavalle lähteelle. Ensimmäinen kelvollinen vastaus käytetään.
+  * Koko haulla on aikaraja DEADLINE_S, ja jokaisen pyynnön aikakatkaisu on
+    sama, joten hidas lähde ei pidä ajoa 15 sekuntia.
+  * Jos molemmat ovat vastanneet, niiden yhteiset jaksot verrataan; yli
+    CROSS_CHECK_TOLERANCE_CT_KWH poikkeama kirjataan varoituksena ja mittariin.
+  * Jos mikään lähde ei vastaa ajoissa, palautetaan None ja kutsuja
+    (price_cache.ensure_prices) käyttää viimeisintä välimuistissa olevaa dataa.
+
+Lähteiden järjestys ja aikarajat: config.json "price_sources"
+("sahkotin,spot_hinta"), "price_hedge_delay_seconds" ja "price_deadline_seconds".
+"""
+
+import json
+import logging
+import time
+import datetime
+from concurrent.futures import wait, FIRST_COMPLETED
+import requests
+import api_client
+import app_config
+import metrics
+from price_slots import PriceSeries, parse_price_json, iso_to_epoch, local_day_bounds_utc
+
+# --- Konfiguraatio ---
+HEDGE_DELAY_S = app_config.get_number('price_hedge_delay_seconds', 0.3)   # Odotus ennen seuraavan lähteen kutsua
+DEADLINE_S = app_config.get_number('price_deadline_seconds', 1.0)         # Koko haun (ja yksittäisen pyynnön) aikaraja
+CROSS_CHECK_TOLERANCE_CT_KWH = 0.5   # Suurin sallittu ero lähteiden välillä samalle jaksolle
+SOURCE_ORDER = [name.strip() for name in str(app_config.get('price_sources', 'sahkotin,spot_hinta')).split(',') if name.strip()]
+
+# --- Lähteet ---
+
+class PriceSource:
+    """Hintalähde: URL haulle ja vastauksen jäsennys PriceSeriesiksi (ct/kWh sis. ALV)."""
+
+    name = 'base'
+
+    def url(self, start_date, local_tz):
+        raise NotImplementedError
+
+    def parse(self, content):
+        """Jäsentää vastauksen. Palauttaa PriceSeries tai None (odottamaton muoto). Virhe: ValueError."""
+        raise NotImplementedError
+
+    def covers(self, start_date, local_tz):
+        """Voiko lähde palauttaa hinnat annetusta päivästä alkaen."""
+        return True
+
+    def series_from(self, future, url):
+        """Lukee valmiin pyynnön (api_client-Future) tuloksen. Palauttaa PriceSeries tai None (virhe kirjataan lokiin)."""
+        try:
+            response = future.result()
+            if response.status_code == 429: logging.error(f"API VIRHE: HTTP 429 kutsussa {url}. Liikaa pyyntöjä."); return None
+            response.raise_for_status()
+            series = self.parse(response.content)
+            if not series: logging.error(f"API VIRHE: Odottamaton vastaus ({self.name}): {response.content[:200]!r}"); return None
+            logging.info(f"API VASTAUS: {len(series)} hintapistettä ({self.name})")
+            return series
+        except requests.exceptions.Timeout: logging.error(f"API VIRHE: Aikakatkaisu kutsussa {url}")
+        except requests.exceptions.ConnectionError: logging.error(f"API VIRHE: Yhteysvirhe kutsussa {url}")
+        except requests.exceptions.HTTPError as e: logging.error(f"API VIRHE: HTTP Virhe {e.response.status_code} kutsussa {url}.")
+        except requests.exceptions.RequestException as e: logging.error(f"API VIRHE: Yleinen Request-virhe kutsussa {url}: {e}")
+        except ValueError: logging.error(f"API VIRHE: Vastaus ei ollut JSONia ({url})")
+        return None
+
+    def fetch(self, start_date, local_tz, timeout=api_client.DEFAULT_TIMEOUT):
+        """Hakee hinnat tältä lähteeltä ilman varalähdettä. Palauttaa PriceSeries tai None."""
+        url = self.url(start_date, local_tz)
+        logging.info(f"API-KUTSU: {url} ({self.name})")
+        return self.series_from(api_client.submit(url, timeout=timeout), url)
+
+class SahkotinSource(PriceSource):
+    """Sahkotin /prices?fix&vat: hinnat ct/kWh sis. ALV annetun päivän alusta alkaen (tänään + huominen, jos julkaistu)."""
+
+    name = 'sahkotin'
+
+    def __init__(self, api_url=None):
+        self.api_url = (api_url or app_config.get('sahkotin_api_url')).rstrip('/')
+
+    def url(self, start_date, local_tz):
+        start_utc, _ = local_day_bounds_utc(start_date, local_tz)
+        return f"{self.api_url}?fix&vat&start={start_utc.strftime('%Y-%m-%dT%H:%M:%S.000Z')}"
+
+    def parse(self, content):
+        return parse_price_json(content)
+
+class SpotHintaSource(PriceSource):
+    """api.spot-hinta.fi /TodayAndDayForward: kuluva ja seuraava päivä, PriceWithTax €/kWh -> ct/kWh."""
+
+    name = 'spot_hinta'
+
+    def __init__(self, api_url=None):
+        self.api_url = (api_url or app_config.get('spot_hinta_api_url')).rstrip('/')
+
+    def url(self, start_date, local_tz):
+        return f"{self.api_url}/TodayAndDayForward"
+
+    def covers(self, start_date, local_tz):
+        return start_date >= datetime.datetime.now(local_tz).date()
+
+    def parse(self, content):
+        rows = json.loads(content)
+        if not isinstance(rows, list): return None
+        series, day_epochs = PriceSeries(), {}
+        for row in sorted(rows, key=lambda r: str(r.get('DateTime', '')) if isinstance(r, dict) else ''):
+            try: series.append(iso_to_epoch(row['DateTime'], day_epochs), round(float(row['PriceWithTax']) * 100, 4))
+            except (KeyError, TypeError, ValueError): continue
+        return series
+
+SOURCES = {source.name: source for source in (SahkotinSource, SpotHintaSource)}
+
+def configured_sources():
+    """Lähteet config.json:n järjestyksessä (tuntemattomat nimet ohitetaan varoituksella)."""
+    sources = []
+    for name in SOURCE_ORDER:
+        if name in SOURCES: sources.append(SOURCES[name]())
+        else: logging.warning(f"Tuntematon hintalähde '{name}' (vaihtoehdot: {', '.join(sorted(SOURCES))})")
+    return sources or [SahkotinSource()]
+
+# --- Suojattu haku ---
+
+def cross_check(reference, other):
+    """Suurin hintaero (ct/kWh) kahden PriceSeriesin yhteisillä aikaleimoilla ja yhteisten jaksojen määrä."""
+    reference_prices = dict(zip(reference.epochs, reference.values))
+    differences = [abs(value - reference_prices[epoch]) for epoch, value in zip(other.epochs, other.values) if epoch in reference_prices]
+    return (max(differences) if differences else 0.0), len(differences)
+
+def fetch_prices(start_date, local_tz, sources=None, hedge_delay_s=None, deadline_s=None):
+    """
+    Hakee hinnat annetun päivän alusta suojatuilla pyynnöillä (ks. moduulin kuvaus).
+    Palauttaa (PriceSeries, lähteen nimi) tai (None, None).
+    """
+    hedge_delay_s = HEDGE_DELAY_S if hedge_delay_s is None else hedge_delay_s
+    deadline_s = DEADLINE_S if deadline_s is None else deadline_s
+    sources = [source for source in (sources or configured_sources()) if source.covers(start_date, local_tz)]
+    if not sources: return None, None
+    started = time.monotonic()
+    deadline = started + deadline_s
+    futures, results = {}, {}   # Future -> (lähde, url); lähteen nimi -> PriceSeries tai None
+
+    def launch(source):
+        url = source.url(start_date, local_tz)
+        logging.info(f"API-KUTSU: {url} (hinnat, lähde {source.name})")
+        futures[api_client.submit(url, timeout=deadline_s)] = (source, url)
+        if len(futures) > 1: metrics.inc('price_hedged_requests_total', source=source.name)
+
+    def collect(done):
+        for future in done:
+            source, url = futures[future]
+            if source.name in results: continue
+            results[source.name] = series = source.series_from(future, url)
+            metrics.inc('price_source_results_total', source=source.name, result='ok' if series else 'error')
+
+    launch(sources[0])
+    while not any(results.values()):
+        now = time.monotonic()
+        if now >= deadline: break
+        pending = [future for future, (source, _url) in futures.items() if source.name not in results]
+        can_hedge = len(futures) < len(sources)
+        hedge_at = started + hedge_delay_s * len(futures)
+        if can_hedge and (not pending or now >= hedge_at): launch(sources[len(futures)]); continue
+        if not pending: break
+        done, _ = wait(pending, timeout=(min(deadline, hedge_at) if can_hedge else deadline) - now, return_when=FIRST_COMPLETED)
+        collect(done)
+    collect([future for future in futures if future.done()])
+
+    elapsed = time.monotonic() - started
+    answered = [source for source in sources if results.get(source.name)]
+    if not answered:
+        metrics.inc('price_fetch_failed_total')
+        logging.error(f"Hintoja ei saatu yhdeltäkään lähteeltä ({', '.join(s.name for s in sources[:len(futures)])}) {elapsed:.2f} s:ssa.")
+        return None, None
+    chosen = answered[0]
+    for other in answered[1:]:
+        difference, compared = cross_check(results[chosen.name], results[other.name])
+        if difference > CROSS_CHECK_TOLERANCE_CT_KWH:
+            metrics.inc('price_source_mismatch_total')
+            logging.warning(f"Hintalähteet eroavat: {chosen.name} vs {other.name} enintään {difference:.2f} ct/kWh ({compared} jaksoa). Käytetään lähdettä {chosen.name}.")
+        else: logging.info(f"Hintalähteet täsmäävät: {chosen.name} vs {other.name} ({compared} jaksoa, ero enintään {difference:.3f} ct/kWh)")
+    if len(futures) > 1: logging.info(f"Hinnat lähteestä {chosen.name} {elapsed:.2f} s:ssa ({len(futures)} lähdettä kysytty)")
+    return results[chosen.name], chosen.name
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+price_slots.py
+
+Resoluutiosta riippumaton päivän hintamalli. Paikallisen päivän hinnat ovat
+kiinteän mittaisessa taulukossa (array('d')), jossa on yksi alkio jokaista
+jaksoa kohden: 15 min jaksoilla 96, kesäaikaan siirtymisen päivänä 92 ja
+talviaikaan siirtymisen päivänä 100 (tunnin jaksoilla 24 / 23 / 25).
+Puuttuva hinta on NaN.
+
+Jakson indeksi lasketaan aikaleimasta (epoch-sekunnit) vakioajassa:
+(aikaleima - päivän alku) // jakson pituus. Aikavyöhykemuunnos tehdään vain
+päivän rajoille (ja kellonaikojen nimille kerran päivää kohden), ei jokaiselle
+hinnalle tai ajokerralle.
+
+API-vastaus jäsennetään suoraan tavuista tyypitettyihin taulukoihin
+(PriceSeries) yhdellä säännöllisellä lausekkeella; aikaleima lasketaan
+kokonaislukuina päivämäärän välimuistista ilman datetime-olioita.
+"""
+
+import re
+import json
+import math
+import datetime
+from array import array
+
+NAN = float('nan')
+
+# --- Aikavyöhykeapurit ---
+
+def localize(naive_dt, local_tz):
+    """Liittää aikavyöhykkeen naiiviin aikaan (zoneinfo ja pytz)."""
+    if hasattr(local_tz, 'localize'): return local_tz.localize(naive_dt)
+    return naive_dt.replace(tzinfo=local_tz)
+
+def local_day_bounds_utc(target_date, local_tz):
+    """Palauttaa paikallisen päivän alun ja lopun UTC-aikoina."""
+    start_local = localize(datetime.datetime.combine(target_date, datetime.time.min), local_tz)
+    end_local = localize(datetime.datetime.combine(target_date + datetime.timedelta(days=1), datetime.time.min), local_tz)
+    return start_local.astimezone(datetime.timezone.utc), end_local.astimezone(datetime.timezone.utc)
+
+def _utc_offset_seconds(epoch, local_tz):
+    return int(datetime.datetime.fromtimestamp(epoch, local_tz).utcoffset().total_seconds())
+
+# --- Päivän hinnat ---
+
+class DayPrices:
+    """Yhden paikallisen päivän hinnat jaksotaulukkona (ks. moduulin kuvaus)."""
+
+    __slots__ = ('date', 'start_epoch', 'resolution_minutes', 'prices')
+
+    def __init__(self, date, start_epoch, resolution_minutes, prices):
+        self.date = date
+        self.start_epoch = int(start_epoch)
+        self.resolution_minutes = int(resolution_minutes)
+        self.prices = prices
+
+    @classmethod
+    def empty(cls, target_date, local_tz, resolution_minutes=60):
+        """Luo päivän taulukon, jossa kaikki hinnat puuttuvat (NaN)."""
+        start_utc, end_utc = local_day_bounds_utc(target_date, local_tz)
+        start_epoch = int(start_utc.timestamp())
+        slot_count = (int(end_utc.timestamp()) - start_epoch) // (resolution_minutes * 60)
+        return cls(target_date, start_epoch, resolution_minutes, array('d', [NAN]) * slot_count)
+
+    @property
+    def slot_seconds(self):
+        return self.resolution_minutes * 60
+
+    @property
+    def end_epoch(self):
+        return self.start_epoch + len(self.prices) * self.slot_seconds
+
+    def __len__(self):
+        return len(self.prices)
+
+    def index_at(self, epoch):
+        """Jakson indeksi aikaleimalle (epoch-sekunnit) tai None, jos aika ei osu päivään. O(1)."""
+        index = (int(epoch) - self.start_epoch) // self.slot_seconds
+        return index if 0 <= index < len(self.prices) else None
+
+    def price(self, index):
+        """Jakson hinta indeksillä tai None, jos hinta puuttuu."""
+        value = self.prices[index]
+        return None if value != value else value
+
+    def price_at(self, epoch):
+        """Hinta aikaleimalle tai None."""
+        index = self.index_at(epoch)
+        return None if index is None else self.price(index)
+
+    def slot_start_epoch(self, index):
+        return self.start_epoch + index * self.slot_seconds
+
+    def valid_count(self):
+        return sum(1 for value in self.prices if value == value)
+
+    def is_complete(self):
+        """Onko jokaiselle jaksolle hinta."""
+        return len(self.prices) > 0 and not any(math.isnan(value) for value in self.prices)
+
+    def by_index(self):
+        """Hinnat muodossa {indeksi: hinta tai None} (price_logic-funktioille; indeksit aikajärjestyksessä)."""
+        return {index: (None if value != value else value) for index, value in enumerate(self.prices)}
+
+    def labels(self, local_tz):
+        """
+        Jaksojen paikalliset kellonajat "HH:MM". UTC-poikkeama haetaan päivän
+        alussa ja lopussa; jos ne eroavat (kesäaikasiirtymä), vaihtokohta
+        etsitään puolitushaulla. Talviaikasiirtymän toistuva tunti saa saman nimen.
+        """
+        slot_count = len(self.prices)
+        if slot_count == 0: return []
+        start_offset = _utc_offset_seconds(self.start_epoch, local_tz)
+        end_offset = _utc_offset_seconds(self.slot_start_epoch(slot_count - 1), local_tz)
+        switch_index = slot_count
+        if start_offset != end_offset:
+            low, high = 0, slot_count - 1
+            while low < high:
+                middle = (low + high) // 2
+                if _utc_offset_seconds(self.slot_start_epoch(middle), local_tz) == end_offset: high = middle
+                else: low = middle + 1
+            switch_index = low
+        labels = []
+        for index in range(slot_count):
+            local_seconds = self.slot_start_epoch(index) + (start_offset if index < switch_index else end_offset)
+            minute_of_day = (local_seconds // 60) % 1440
+            labels.append(f"{minute_of_day // 60:02d}:{minute_of_day % 60:02d}")
+        return labels
+
+    def as_mapping(self, local_tz):
+        """Hinnat muodossa {"HH:MM": hinta} (päivän siirto toiselle päivälle, ks. fake_price_server.py). Toistuvan tunnin ensimmäinen hinta säilyy."""
+        mapping = {}
+        for label, value in zip(self.labels(local_tz), self.prices):
+            if value == value: mapping.setdefault(label, value)
+        return mapping
+
+    def to_json(self):
+        """JSON-muoto välimuistiin: alku (epoch), resoluutio ja hintalista (null = puuttuu)."""
+        return {"start": self.start_epoch, "resolution_minutes": self.resolution_minutes,
+                "prices": [None if value != value else value for value in self.prices]}
+
+    @classmethod
+    def from_json(cls, target_date, data, local_tz):
+        """Lukee to_json-muodon. Vanha {"HH:MM": hinta} -muoto muunnetaan from_mapping-funktiolla."""
+        prices = data.get('prices')
+        if isinstance(prices, dict): return cls.from_mapping(target_date, prices, local_tz)
+        return cls(target_date, data['start'], data['resolution_minutes'],
+                   array('d', (NAN if value is None else float(value) for value in prices)))
+
+    @classmethod
+    def from_mapping(cls, target_date, mapping, local_tz):
+        """Muuntaa {"HH:MM": hinta} -muodon (vanha hinta-arkisto ja välimuisti) taulukoksi."""
+        resolution_minutes = 15 if any(not key.endswith(':00') for key in mapping) else 60
+        day = cls.empty(target_date, local_tz, resolution_minutes)
+        for key, value in mapping.items():
+            if value is None: continue
+            slot_local = localize(datetime.datetime.combine(target_date, datetime.time(int(key[:2]), int(key[3:5]))), local_tz)
+            index = day.index_at(slot_local.timestamp())
+            if index is not None and math.isnan(day.prices[index]): day.prices[index] = float(value)
+        return day
+
+# --- Raakahintojen jäsennys ---
+
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+_ENTRY_PATTERN = re.compile(
+    rb'"date"\s*:\s*"(\d{4}-\d\d-\d\d)T(\d\d):(\d\d)(?::(\d\d))?(?:\.\d*)?(Z|[+-]\d\d:?\d\d)?"'
+    rb'\s*,\s*"value"\s*:\s*(-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|null)')
+
+class PriceSeries:
+    """Aikajärjestyksessä olevat hinnat kahtena rinnakkaisena taulukkona: aikaleimat (array('q'), epoch-sekunnit) ja hinnat (array('d'))."""
+
+    __slots__ = ('epochs', 'values')
+
+    def __init__(self, epochs=None, values=None):
+        self.epochs = epochs if epochs is not None else array('q')
+        self.values = values if values is not None else array('d')
+
+    def __len__(self):
+        return len(self.epochs)
+
+    def append(self, epoch, value):
+        self.epochs.append(epoch); self.values.append(value)
+
+def _offset_seconds(offset):
+    """Muuntaa aikavyöhykeosan ("", "Z", "+03:00" tai "+0300") sekunneiksi."""
+    if not offset or offset == 'Z': return 0
+    digits = offset[1:].replace(':', '')
+    seconds = int(digits[:2]) * 3600 + int(digits[2:4]) * 60
+    return -seconds if offset[0] == '-' else seconds
+
+def _day_epoch(date_text, day_epochs):
+    """UTC-päivän alun aikaleima "VVVV-KK-PP"-tekstille; tulos muistetaan day_epochs-dictiin."""
+    day_epoch = day_epochs.get(date_text)
+    if day_epoch is None:
+        year, month, day = int(date_text[0:4]), int(date_text[5:7]), int(date_text[8:10])
+        day_epoch = day_epochs[date_text] = (datetime.date(year, month, day).toordinal() - _EPOCH_ORDINAL) * 86400
+    return day_epoch
+
+def iso_to_epoch(timestamp, day_epochs=None):
+    """
+    Muuntaa ISO 8601 -aikaleiman ("2025-01-01T22:00:00.000Z") epoch-sekunneiksi
+    kokonaislukulaskennalla. Muut muodot jäsennetään fromisoformat-funktiolla.
+    """
+    day_epochs = {} if day_epochs is None else day_epochs
+    if len(timestamp) >= 16 and timestamp[10] == 'T' and timestamp[13] == ':':
+        try:
+            tail = timestamp[16:]
+            seconds = 0
+            if tail[:1] == ':': seconds = int(tail[1:3]); tail = tail[3:]
+            if tail[:1] == '.': tail = tail.lstrip('.0123456789')
+            return _day_epoch(timestamp[:10], day_epochs) + int(timestamp[11:13]) * 3600 + int(timestamp[14:16]) * 60 + seconds - _offset_seconds(tail)
+        except (ValueError, IndexError): pass
+    if timestamp.endswith('Z'): timestamp = timestamp[:-1] + '+00:00'
+    parsed = datetime.datetime.fromisoformat(timestamp)
+    if parsed.tzinfo is None: parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return int(parsed.timestamp())
+
+def parse_price_entries(prices_raw):
+    """Muuntaa raakahinnat (lista dictejä: 'date' UTC ISO 8601, 'value' ct/kWh) PriceSeriesiksi. Virheelliset ohitetaan."""
+    series, day_epochs = PriceSeries(), {}
+    for price_entry in prices_raw or []:
+        try:
+            timestamp_str = price_entry.get('date'); value = price_entry.get('value')
+            if timestamp_str is None or value is None: continue
+            series.append(iso_to_epoch(timestamp_str, day_epochs), float(value))
+        except (ValueError, TypeError, AttributeError): continue
+    return series
+
+def parse_price_json(content):
+    """
+    Jäsentää Sahkotin /prices -vastauksen (bytes tai str) suoraan PriceSeriesiksi
+    ilman välivaiheen dict-listaa. Jos lauseke ei tunnista jokaista hintapistettä
+    (odottamaton muotoilu), jäsennetään json-moduulilla. Palauttaa None, jos
+    vastauksessa ei ole 'prices'-listaa. Virhe: ValueError (ei JSONia).
+    """
+    if isinstance(content, str): content = content.encode('utf-8')
+    if b'"prices"' not in content: return None
+    matches = _ENTRY_PATTERN.findall(content)
+    if len(matches) != content.count(b'"date"'):
+        data = json.loads(content)
+        if not isinstance(data, dict) or not isinstance(data.get('prices'), list): return None
+        return parse_price_entries(data['prices'])
+    epochs, values = array('q'), array('d')
+    day_epochs = {}
+    for date_text, hour, minute, second, offset, value in matches:
+        if value == b'null': continue
+        epochs.append(_day_epoch(date_text, day_epochs) + int(hour) * 3600 + int(minute) * 60
+                      + (int(second) if second else 0) - (_offset_seconds(offset.decode('ascii')) if offset and offset != b'Z' else 0))
+        values.append(float(value))
+    return PriceSeries(epochs, values)
+
+# --- Raakahintojen jako päiviin ---
+
+def detect_epoch_resolution(epochs):
+    """Päättelee resoluution aikaleimoista: 15 min, jos jokin hinta alkaa muulloin kuin tasatunnilla, muuten 60 min."""
+    return 15 if any(epoch % 3600 for epoch in epochs) else 60
+
+def split_epoch_prices(series, local_tz):
+    """
+    Jakaa PriceSeriesin paikallisiin päiviin. Päivän rajat (ja siten
+    UTC-poikkeaman muutokset) lasketaan vain, kun aikaleima siirtyy uudelle
+    päivälle; muuten paikka on pelkkää kokonaislukulaskentaa. Resoluutio
+    päätellään päiväkohtaisesti. Saman jakson toistuvista hinnoista ensimmäinen
+    säilyy. Palauttaa {päivä_str: DayPrices}.
+    """
+    epochs, values = series.epochs, series.values
+    order = range(len(epochs))
+    if any(epochs[i] > epochs[i + 1] for i in range(len(epochs) - 1)): order = sorted(order, key=epochs.__getitem__)
+    grouped = {}
+    day_start, day_end, day_indices = 0, 0, None
+    for position in order:
+        epoch = epochs[position]
+        if day_indices is None or not day_start <= epoch < day_end:
+            day_date = datetime.datetime.fromtimestamp(epoch, local_tz).date()
+            start_utc, end_utc = local_day_bounds_utc(day_date, local_tz)
+            day_start, day_end = int(start_utc.timestamp()), int(end_utc.timestamp())
+            day_indices = grouped.setdefault(day_date, [])
+        day_indices.append(position)
+    days = {}
+    for day_date, positions in grouped.items():
+        day = DayPrices.empty(day_date, local_tz, detect_epoch_resolution(epochs[position] for position in positions))
+        slot_seconds, start_epoch, prices = day.slot_seconds, day.start_epoch, day.prices
+        for position in positions:
+            index = (epochs[position] - start_epoch) // slot_seconds
+            if 0 <= index < len(prices) and prices[index] != prices[index]: prices[index] = values[position]
+        days[day_date.isoformat()] = day
+    return days
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+schedule_builder.py
+
+Aikataulun rakentaja (ks. SUUNNITELMA_V2.md). Lukee kohdepäivän hinnat
+hintavälimuistista (price_cache.py), pinnien asetukset settings.json-tiedostosta
+ja manuaaliset ohitukset manual_override.json-tiedostosta, ja laskee valmiin
+ON/OFF-aikataulun kaikille pinneille ja jaksoille.
+
+Tulos tallennetaan DATA_DIR/control_schedule.json -tiedostoon tiiviissä
+taulukkomuodossa: jokaiselle pinnille yksi tilamerkkijono ("0"/"1" per jakso)
+ja yksi syykoodimerkkijono (yksi merkki per jakso, ks. price_logic.REASON_*).
+Jaksot vastaavat hintojen resoluutiota (15 tai 60 min); päivän alku (epoch)
+tallennetaan, joten kuluvan jakson indeksi lasketaan suoraan kellonajasta.
+hourly_control.py lukee tästä taulukosta tilan ilman verkkokutsuja tai hintalogiikkaa.
+
+Pinnin tila päätetään ensin säännöillä (rajat, N halvinta, hystereesi), minkä
+jälkeen vähimmäis-ON/OFF-ajat ja päivän kytkentäbudjetti (min_on_minutes,
+min_off_minutes, max_toggles_per_day) sovitetaan price_logic.limit_switching-
+funktiolla. Edellisen päivän viimeinen tila ja sen kesto jatkuvat päivän rajan
+yli. Pinnin tietoihin tallennetaan kytkentöjen määrä ja säästetyt kytkennät
+(toggles, toggles_saved) verrattuna tilattomaan päätökseen (ei hystereesiä eikä rajoituksia);
+kokonaan poistuneita ON-jaksoja ei lasketa säästetyiksi (saved_toggles).
+
+Jos sivustolla on tehoraja (config.json "max_power_kw"), pinnien ON-jaksot
+sovitetaan lopuksi yhdessä rajan alle (apply_power_cap): pinnit käsitellään
+prioriteettijärjestyksessä (priority, sitten suurin power_kw), pinni säilyttää
+jaksonsa, joissa tehoa on vapaana, ja loput siirretään halvimpiin vapaisiin
+jaksoihin, joissa hinta ei ylitä pinnin ylärajaa. Näin ON-jaksojen määrä (esim.
+N halvinta) säilyy aina kun mahdollista; vajaaksi jääneet jaksot tallennetaan
+pinnin kenttään cap_unmet. Manuaaliset ohitukset ohittavat tehorajan.
+
+Ajo: kerran päivässä (cron, esim. klo 14:30 --tomorrow) sekä tarvittaessa
+manuaalisesti asetusten muuttamisen jälkeen (--today, --tomorrow, --date VVVV-KK-PP).
+"""
+
+import json
+import logging
+import os
+import sys
+import datetime
+import argparse
+import app_config
+import pin_settings
+import price_cache
+from price_logic import (decide_slot, decide_slot_with_hysteresis, find_cheapest_intervals_with_startup_cost, format_reason, cheapest_slot_count,
+                         limit_switching, minutes_to_slots, count_toggles, trailing_run_minutes, fit_under_cap,
+                         REASON_OVERRIDE_ON, REASON_OVERRIDE_OFF, REASON_NO_SCHEDULE, REASON_SWITCH_HOLD_ON, REASON_SWITCH_HOLD_OFF,
+                         REASON_POWER_CAP_ON, REASON_POWER_CAP_OFF)
+
+# --- Konfiguraatio ja Polut ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SETTINGS_FILE = os.path.join(SCRIPT_DIR, 'settings.json')
+DATA_DIR = os.path.expanduser('~/gpio_pricer_data')
+SCHEDULE_FILE = os.path.join(DATA_DIR, 'control_schedule.json')
+OVERRIDE_FILE = os.path.join(SCRIPT_DIR, 'manual_override.json')
+SCHEDULE_KEEP_DAYS = 1   # Montako mennyttä päivää aikataulussa säilytetään
+SCHEDULE_VERSION = 1
+
+# --- Syykoodien koodaus (yksi merkki per jakso) ---
+
+def encode_reason(reason_code):
+    """Koodaa syykoodin yhdeksi merkiksi (0-9, a-z)."""
+    return "0123456789abcdefghijklmnopqrstuvwxyz"[reason_code]
+
+def decode_reason(reason_char):
+    """Purkaa yhden merkin syykoodiksi."""
+    return int(reason_char, 36)
+
+# --- Tiedostojen käsittely ---
+
+def load_schedule(schedule_file=SCHEDULE_FILE):
+    """Lukee koko aikataulutiedoston. Palauttaa tyhjän rakenteen, jos tiedostoa ei ole tai se on virheellinen."""
+    empty_schedule = {"version": SCHEDULE_VERSION, "days": {}}
+    if not os.path.exists(schedule_file): return empty_schedule
+    try:
+        with open(schedule_file, 'r', encoding='utf-8') as f: schedule = json.load(f)
+        if not isinstance(schedule, dict) or not isinstance(schedule.get('days'), dict):
+            logging.error(f"Aikataulutiedosto '{schedule_file}' on virheellisessä muodossa."); return empty_schedule
+        return schedule
+    except (json.JSONDecodeError, IOError) as e:
+        logging.error(f"Aikataulutiedoston '{schedule_file}' lukeminen epäonnistui: {e}"); return empty_schedule
+
+def load_day(target_date, schedule_file=SCHEDULE_FILE):
+    """Palauttaa yhden päivän aikataulun tai None, jos päivää ei löydy tai se on vanhaa muotoa (ilman jaksotaulukon alkua)."""
+    day_schedule = load_schedule(schedule_file)['days'].get(target_date.isoformat())
+    if day_schedule is not None and 'start' not in day_schedule: return None
+    return day_schedule
+
+def save_day(target_date, day_schedule, schedule_file=SCHEDULE_FILE):
+    """
+    Tallentaa päivän aikataulun atomisesti ja karsii päivät, jotka ovat yli SCHEDULE_KEEP_DAYS päivää
+    vanhempia kuin kohdepäivä tai tämä päivä (myöhäisempi). Tallennettua päivää ei karsita, vaikka se olisi mennyt.
+    """
+    schedule = load_schedule(schedule_file)
+    schedule['days'][target_date.isoformat()] = day_schedule
+    oldest_kept = (max(target_date, datetime.date.today()) - datetime.timedelta(days=SCHEDULE_KEEP_DAYS)).isoformat()
+    for day in [d for d in schedule['days'] if d < oldest_kept and d != target_date.isoformat()]: del schedule['days'][day]
+    tmp_path = f"{schedule_file}.tmp"
+    try:
+        os.makedirs(os.path.dirname(schedule_file), exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(schedule, f, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        os.replace(tmp_path, schedule_file)
+        return True
+    except (IOError, OSError) as e:
+        logging.error(f"Aikataulun tallennus tiedostoon '{schedule_file}' epäonnistui: {e}"); return False
+
+def load_overrides(target_date, override_file=OVERRIDE_FILE):
+    """
+    Lukee kohdepäivän manuaaliset ohitukset muodossa
+    {päivä_str: {tunniste: {"HH:MM": "ON"/"OFF"}}}. Palauttaa {tunniste: {"HH:MM": bool}}.
+    """
+    if not os.path.exists(override_file): return {}
+    try:
+        with open(override_file, 'r', encoding='utf-8') as f: overrides = json.load(f)
+        day_overrides = overrides.get(target_date.isoformat(), {}) if isinstance(overrides, dict) else {}
+        return {identifier: {slot: str(state).upper() == "ON" for slot, state in slots.items()}
+                for identifier, slots in day_overrides.items() if isinstance(slots, dict)}
+    except (json.JSONDecodeError, IOError, AttributeError) as e:
+        logging.error(f"Ohitustiedoston '{override_file}' lukeminen epäonnistui: {e}. Ohituksia ei käytetä."); return {}
+
+def add_overrides(new_overrides, override_file=OVERRIDE_FILE):
+    """
+    Lisää tai päivittää ohitukset {päivä_str: {tunniste: {"HH:MM": "ON"/"OFF"}}}
+    manual_override.json-tiedostoon atomisesti. Palauttaa True onnistuessaan.
+    """
+    overrides = {}
+    if os.path.exists(override_file):
+        try:
+            with open(override_file, 'r', encoding='utf-8') as f: overrides = json.load(f)
+            if not isinstance(overrides, dict): overrides = {}
+        except (json.JSONDecodeError, IOError) as e:
+            logging.error(f"Ohitustiedoston '{override_file}' lukeminen epäonnistui: {e}. Ei tallenneta."); return False
+    for day_str, identifiers in new_overrides.items():
+        for identifier, slots in identifiers.items():
+            overrides.setdefault(day_str, {}).setdefault(identifier, {}).update(slots)
+    tmp_path = f"{override_file}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(overrides, f, indent=4, ensure_ascii=False, sort_keys=True)
+        os.replace(tmp_path, override_file)
+        return True
+    except (IOError, OSError) as e:
+        logging.error(f"Ohitusten tallennus tiedostoon '{override_file}' epäonnistui: {e}"); return False
+
+# --- Aikataulun laskenta ---
+
+def last_states(day_schedule):
+    """Palauttaa päivän aikataulun viimeisen jakson tilat {tunniste: bool} (hystereesin alkutila seuraavalle päivälle)."""
+    if not day_schedule: return {}
+    return {identifier: entry['states'][-1] == "1" for identifier, entry in day_schedule.get('pins', {}).items() if entry.get('states')}
+
+def last_runs(day_schedule):
+    """Palauttaa päivän aikataulun viimeisen tilan keston minuutteina {tunniste: min} (vähimmäisaikojen alkutilanne seuraavalle päivälle)."""
+    if not day_schedule: return {}
+    resolution_minutes = int(day_schedule.get('resolution_minutes', 60))
+    return {identifier: trailing_run_minutes(entry['states'], resolution_minutes)
+            for identifier, entry in day_schedule.get('pins', {}).items() if entry.get('states')}
+
+def apply_switching_limits(rule, states, prices, resolution_minutes, initial_state=False, initial_run_minutes=None, forced=None):
+    """
+    Sovittaa pinnin (PinRule) vähimmäisajat ja kytkentäbudjetin tilasarjaan (price_logic.limit_switching).
+    Sama funktio aikataululle ja simulaattorille. Palauttaa rajoitetun tilalistan.
+    """
+    return limit_switching(states, prices, minutes_to_slots(rule.min_on_minutes, resolution_minutes),
+                           minutes_to_slots(rule.min_off_minutes, resolution_minutes), rule.max_toggles_per_day, initial_state,
+                           None if initial_run_minutes is None else initial_run_minutes // resolution_minutes, forced)
+
+def saved_toggles(stateless_states, states, initial_state=False):
+    """
+    Montako kytkentää aikataulu säästi tilattomaan päätökseen verrattuna. Tilattoman päätöksen
+    ON-jaksot, joista aikatauluun ei jäänyt yhtään ON-jaksoa (esim. tehoraja tai siirto
+    halvempaan lohkoon), eivät ole säästettyjä kytkentöjä, joten ne jätetään vertailusta pois.
+    """
+    reference, start = list(stateless_states), None
+    for index, state in enumerate(list(stateless_states) + [False]):
+        if state and start is None: start = index
+        elif not state and start is not None:
+            if not any(states[start:index]): reference[start:index] = [False] * (index - start)
+            start = None
+    return max(0, count_toggles(reference, initial_state) - count_toggles(states, initial_state))
+
+def site_max_power_kw(value=None):
+    """Sivuston tehoraja kW (oletuksena config.json:n max_power_kw). Palauttaa None, jos rajaa ei ole."""
+    value = app_config.get('max_power_kw') if value is None else value
+    try: value = float(value or 0)
+    except (ValueError, TypeError): logging.warning(f"max_power_kw ({value}) ei kelpaa, tehorajaa ei käytetä."); return None
+    return value if value > 0 else None
+
+def apply_power_cap(settings_list, states_by_pin, prices, max_power_kw, resolution_minutes, forced_by_pin=None,
+                    initial_states=None, initial_runs=None):
+    """
+    Sovittaa kaikkien pinnien ON-jaksot yhdessä sivuston tehorajan alle (ks. moduulin kuvaus).
+    states_by_pin: {tunniste: [bool per jakso]}, forced_by_pin: {tunniste: pakotetut tilat tai None}.
+    Pinnin vähimmäisajat ja kytkentäbudjetti sovitetaan uudelleen siirron jälkeen; jaksot, joihin
+    teho ei mahdu, ovat silloin pakotettuja OFF-tiloja. Sama funktio aikataululle ja simulaattorille.
+    Palauttaa ({tunniste: uudet tilat}, {tunniste: sijoittamatta jääneet ON-jaksot}).
+    """
+    forced_by_pin = forced_by_pin or {}
+    initial_states = initial_states or {}
+    initial_runs = initial_runs or {}
+    slot_indices = range(len(prices))
+    headroom = [max_power_kw] * len(prices)
+    for rule in settings_list:
+        forced = forced_by_pin.get(rule.identifier)
+        if not forced or rule.power_kw <= 0: continue
+        for index in slot_indices:
+            if forced[index]: headroom[index] -= rule.power_kw
+    if any(value < 0 for value in headroom): logging.warning(f"Manuaaliset ohitukset ylittävät sivuston tehorajan {max_power_kw} kW.")
+    capped, unmet = {}, {}
+    order = sorted(range(len(settings_list)), key=lambda position: (-settings_list[position].priority, -settings_list[position].power_kw, position))
+    for position in order:
+        rule = settings_list[position]
+        identifier, power_kw = rule.identifier, rule.power_kw
+        states = states_by_pin[identifier]
+        if power_kw <= 0: capped[identifier] = states; unmet[identifier] = 0; continue
+        forced = forced_by_pin.get(identifier)
+        allowed = [price is not None and price <= rule.upper_limit_ct_kwh for price in prices]
+        new_states = fit_under_cap(states, power_kw, headroom, prices, allowed, forced)
+        if new_states != states and rule.has_switching_limits():
+            blocked = [forced[index] if forced and forced[index] is not None else (False if headroom[index] < power_kw else None) for index in slot_indices]
+            new_states = apply_switching_limits(rule, new_states, prices, resolution_minutes, initial_states.get(identifier, False),
+                                                initial_runs.get(identifier), blocked)
+        for index in slot_indices:
+            if new_states[index] and not (forced and forced[index] is not None): headroom[index] -= power_kw
+        capped[identifier] = new_states
+        unmet[identifier] = max(0, sum(states) - sum(new_states))
+    return capped, unmet
+
+def build_day_schedule(settings_list, day_prices, overrides=None, initial_states=None, local_tz=None, initial_runs=None, max_power_kw=None):
+    """
+    Laskee päivän aikataulun kaikille pinneille. day_prices on päivän jaksotaulukko
+    (price_slots.DayPrices, 92-100 tai 23-25 jaksoa). initial_states ({tunniste: bool})
+    on edellisen päivän viimeinen tila hystereesiä varten ja initial_runs ({tunniste: min})
+    sen kesto vähimmäisaikoja varten (puuttuva = riittävän pitkä). Ohitukset kohdistetaan
+    jaksoihin kellonajan "HH:MM" mukaan. max_power_kw: sivuston tehoraja (None = ei rajaa).
+    Palauttaa päivän aikataulurakenteen (ks. moduulin kuvaus).
+    """
+    overrides = overrides or {}
+    initial_states = initial_states or {}
+    initial_runs = initial_runs or {}
+    local_tz = local_tz or price_cache.ZoneInfo(price_cache.LOCAL_TIMEZONE_STR)
+    slots = day_prices.labels(local_tz)
+    prices_by_index = day_prices.by_index()
+    slot_indices = range(len(slots))
+    price_list = [prices_by_index[index] for index in slot_indices]
+    cheapest_slot_sets = {}
+    computed = {}   # tunniste -> (tilat, syykoodit, tilaton vertailu, pakotetut)
+    for rule in settings_list:
+        identifier = rule.identifier
+        lower_limit, upper_limit, rank_n = rule.lower_limit_ct_kwh, rule.upper_limit_ct_kwh, rule.cheapest_hours_n
+        hysteresis, startup_factor = rule.hysteresis_ct_kwh, rule.startup_factor
+        previous_state = initial_state = initial_states.get(identifier, False)
+        slot_n = cheapest_slot_count(rank_n, day_prices.resolution_minutes)   # N on tunteja, valinta tehdään jaksoina
+        cheapest_key = (slot_n, startup_factor, previous_state) if startup_factor > 1.0 else (slot_n, 1.0, False)
+        if cheapest_key not in cheapest_slot_sets:
+            cheapest_slot_sets[cheapest_key] = find_cheapest_intervals_with_startup_cost(prices_by_index, slot_n, startup_factor, previous_state)
+        cheapest_set = cheapest_slot_sets[cheapest_key]
+        pin_overrides = overrides.get(identifier, {})
+        forced = [pin_overrides.get(label) for label in slots] if pin_overrides else None
+        states, reason_codes = [], []
+        for index in slot_indices:
+            override = forced[index] if forced else None
+            if override is not None:
+                state = override
+                reason_code = REASON_OVERRIDE_ON if state else REASON_OVERRIDE_OFF
+            else:
+                state, reason_code = decide_slot_with_hysteresis(price_list[index], lower_limit, upper_limit, rank_n, index in cheapest_set, previous_state, hysteresis)
+            previous_state = state
+            states.append(state)
+            reason_codes.append(reason_code)
+        # Säästettyjen kytkentöjen vertailukohta: tilaton päätös (ei hystereesiä, ei rajoituksia)
+        stateless_states = states
+        if hysteresis > 0:
+            stateless_states = [forced[index] if forced and forced[index] is not None else
+                                decide_slot(price_list[index], lower_limit, upper_limit, rank_n, index in cheapest_set)[0] for index in slot_indices]
+        if rule.has_switching_limits():
+            limited = apply_switching_limits(rule, states, price_list, day_prices.resolution_minutes, initial_state, initial_runs.get(identifier), forced)
+            for index in slot_indices:
+                if limited[index] != states[index]: reason_codes[index] = REASON_SWITCH_HOLD_ON if limited[index] else REASON_SWITCH_HOLD_OFF
+            states = limited
+        computed[identifier] = (states, reason_codes, stateless_states, forced)
+    unmet = {}
+    if max_power_kw:
+        capped, unmet = apply_power_cap(settings_list, {identifier: entry[0] for identifier, entry in computed.items()}, price_list,
+                                        max_power_kw, day_prices.resolution_minutes, {identifier: entry[3] for identifier, entry in computed.items()},
+                                        initial_states, initial_runs)
+        for identifier, (states, reason_codes, stateless_states, forced) in computed.items():
+            new_states = capped[identifier]
+            for index in slot_indices:
+                if new_states[index] != states[index]: reason_codes[index] = REASON_POWER_CAP_ON if new_states[index] else REASON_POWER_CAP_OFF
+            computed[identifier] = (new_states, reason_codes, stateless_states, forced)
+    pins = {}
+    for rule in settings_list:
+        identifier = rule.identifier
+        states, reason_codes, stateless_states, _forced = computed[identifier]
+        initial_state = initial_states.get(identifier, False)
+        toggles = count_toggles(states, initial_state)
+        pins[identifier] = {"pin": rule.gpio_pin, "lower": rule.lower_limit_ct_kwh, "upper": rule.upper_limit_ct_kwh, "n": rule.cheapest_hours_n,
+                            "hysteresis": rule.hysteresis_ct_kwh,
+                            "states": "".join("1" if state else "0" for state in states), "reasons": "".join(encode_reason(code) for code in reason_codes),
+                            "toggles": toggles, "toggles_saved": saved_toggles(stateless_states, states, initial_state)}
+        if max_power_kw: pins[identifier]["cap_unmet"] = unmet[identifier]
+    day_schedule = {"built": datetime.datetime.now(datetime.timezone.utc).astimezone().isoformat(),
+                    "start": day_prices.start_epoch, "resolution_minutes": day_prices.resolution_minutes,
+                    "slots": slots, "pins": pins}
+    if max_power_kw: day_schedule["max_power_kw"] = max_power_kw
+    return day_schedule
+
+def build_and_save(settings_list, target_date, now=None, schedule_file=SCHEDULE_FILE):
+    """Hakee päivän hinnat välimuistista (enintään yksi verkkokutsu), laskee ja tallentaa aikataulun. Palauttaa päivän aikataulun tai None."""
+    day_prices = price_cache.ensure_prices(target_date, now=now)
+    if day_prices is None:
+        logging.critical(f"Päivän {target_date.isoformat()} hintoja ei saatu välimuistista. Aikataulua ei voitu luoda."); return None
+    previous_day = load_day(target_date - datetime.timedelta(days=1), schedule_file)
+    max_power_kw = site_max_power_kw()
+    day_schedule = build_day_schedule(settings_list, day_prices, load_overrides(target_date), last_states(previous_day),
+                                      initial_runs=last_runs(previous_day), max_power_kw=max_power_kw)
+    save_day(target_date, day_schedule, schedule_file)
+    if max_power_kw:
+        unmet = {identifier: entry['cap_unmet'] for identifier, entry in day_schedule['pins'].items() if entry['cap_unmet']}
+        if unmet: logging.warning(f"Tehoraja {max_power_kw} kW: ON-jaksoja jäi sijoittamatta ({', '.join(f'{identifier}: {count}' for identifier, count in unmet.items())})")
+    toggles_saved = sum(entry['toggles_saved'] for entry in day_schedule['pins'].values())
+    logging.info(f"Aikataulu luotu päivälle {target_date.isoformat()}: {len(day_schedule['pins'])} pinniä, "
+                 f"{len(day_schedule['slots'])} jaksoa ({day_schedule['resolution_minutes']} min), "
+                 f"kytkentöjä {sum(entry['toggles'] for entry in day_schedule['pins'].values())} (säästetty {toggles_saved})")
+    return day_schedule
+
+# --- Ajonaikainen haku ---
+
+def slot_index_at(day_schedule, epoch):
+    """Jakson indeksi aikaleimalle (epoch-sekunnit) päivän aikataulussa tai None. O(1)."""
+    try:
+        index = (int(epoch) - int(day_schedule['start'])) // (int(day_schedule['resolution_minutes']) * 60)
+        return index if 0 <= index < len(day_schedule['slots']) else None
+    except (KeyError, TypeError, ValueError): return None
+
+def lookup_states(day_schedule, slot_index):
+    """
+    Hakee kaikkien pinnien tilan annetulle jaksoindeksille (ks. slot_index_at) valmiista aikataulusta.
+    Palauttaa listan (tunniste, pinni, tila, syyteksti). Jos jaksoa ei löydy, tila on OFF.
+    """
+    results = []
+    for identifier, entry in sorted(day_schedule.get('pins', {}).items()):
+        if slot_index is None or slot_index >= len(entry['states']):
+            state, reason_code = False, REASON_NO_SCHEDULE
+        else:
+            state, reason_code = entry['states'][slot_index] == "1", decode_reason(entry['reasons'][slot_index])
+        reason = format_reason(reason_code, entry.get('lower'), entry.get('upper'), entry.get('n'), entry.get('hysteresis'))
+        results.append((identifier, entry['pin'], state, reason))
+    return results
+
+# --- Itsenäinen ajo ---
+
+def main(target_date):
+    """Rakentaa ja tallentaa aikataulun annetulle päivälle."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stderr)
+    settings_list = pin_settings.load_settings(SETTINGS_FILE)
+    if not settings_list: logging.critical(f"Ei kelvollisia asetuksia tiedostossa '{os.path.abspath(SETTINGS_FILE)}'."); sys.exit(1)
+    day_schedule = build_and_save(settings_list, target_date)
+    if day_schedule is None: sys.exit(1)
+    print(f"Aikataulu tallennettu: {os.path.abspath(SCHEDULE_FILE)} ({target_date.isoformat()})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rakentaa valmiin ohjausaikataulun (control_schedule.json).")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--today", action="store_true", help="Rakenna kuluvalle päivälle (oletus)")
+    group.add_argument("--tomorrow", action="store_true", help="Rakenna seuraavalle päivälle")
+    group.add_argument("--date", type=str, help="Rakenna tietylle päivälle (VVVV-KK-PP)")
+    args = parser.parse_args()
+    if args.date:
+        try: build_date = datetime.date.fromisoformat(args.date)
+        except ValueError: print(f"VIRHE: Päivämäärämuoto '{args.date}'? Käytä VVVV-KK-PP.", file=sys.stderr); sys.exit(1)
+    elif args.tomorrow: build_date = datetime.date.today() + datetime.timedelta(days=1)
+    else: build_date = datetime.date.today()
+    main(build_date)
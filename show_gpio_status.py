@@ -7,12 +7,17 @@ show_gpio_status.py
 Lukee viimeisimmän GPIO-tilatiedon JSON-tiedostosta, jonka 
 hourly_control.py on luonut DATA_DIR-hakemistoon, ja tulostaa sen 
 selkeässä taulukkomuodossa.
+
+--costs tulostaa lisäksi kuluvan kuukauden kustannukset pinneittäin
+(cost_rollups.py: ON-tunnit, kWh, € ja ON-ajan keskihinta).
 """
 
+import argparse
 import json
 import os
 import sys
 import datetime
+import io_spool
 # Aikavyöhykkeitä varten (varmistetaan olemassaolo)
 try:
     from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
@@ -103,8 +108,14 @@ def display_status_table(status_data, run_timestamp_str="N/A"):
         max_state_len = max(max_state_len, len(state_str))
         max_reason_len = max(max_reason_len, len(reason_str))
 
-    # Tulosta otsikkotiedot
+    # Tulosta otsikkotiedot (jakso: tunti tai 15 min hintojen resoluution mukaan)
     print(f"--- GPIO Tilatiedot (Viimeisin ajo: {run_timestamp_str}) ---")
+    first_entry = next(iter(status_data.values()))
+    if first_entry.get('slot'):
+        resolution_minutes = int(first_entry.get('resolution_minutes', 60))
+        slot_start = datetime.datetime.strptime(first_entry['slot'], '%H:%M')
+        slot_end = slot_start + datetime.timedelta(minutes=resolution_minutes)
+        print(f"Jakso: {first_entry['slot']}-{slot_end.strftime('%H:%M')} ({resolution_minutes} min)")
     header = (f"{'Pin':<{max_pin_len}} | {'Tunniste':<{max_id_len}} | "
               f"{'Tila':<{max_state_len}} | {'Syy':<{max_reason_len}}")
     print(header)
@@ -121,6 +132,9 @@ def display_status_table(status_data, run_timestamp_str="N/A"):
     print("-" * len(separator)) 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Näyttää GPIO-pinnien viimeisimmän tilan.")
+    parser.add_argument("--costs", action="store_true", help="Näytä myös kuluvan kuukauden kustannukset pinneittäin (cost_rollups.py)")
+    args = parser.parse_args()
     # Varmistetaan, että datahakemisto on olemassa ennen lukuyritystä
     # (vaikka lukufunktio tarkistaakin tiedoston, tämä voi auttaa selkeyttämään virhettä)
     if not os.path.isdir(DATA_DIR):
@@ -128,8 +142,14 @@ if __name__ == "__main__":
          print("Aja 'hourly_control.py' ainakin kerran luodaksesi hakemiston ja tilatiedoston.", file=sys.stderr)
          sys.exit(1)
          
-    status_data, timestamp = read_status_file(STATUS_FILE)
+    # Tuorein tila on kirjoituspuskurissa (io_spool.py), pysyvä kopio päivittyy vain tilan muuttuessa
+    status_data, timestamp = read_status_file(io_spool.get_spool().status_path(STATUS_FILE))
     if status_data is not None: 
         display_status_table(status_data, timestamp)
+        if args.costs:
+            import cost_rollups
+            cost_rollups.update_rollups()
+            print()
+            cost_rollups.print_month(cost_rollups.CostRollups(), datetime.datetime.now(cost_rollups.ZoneInfo(cost_rollups.LOCAL_TIMEZONE_STR)).strftime('%Y-%m'))
     else:
         sys.exit(1)
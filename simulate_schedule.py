@@ -8,7 +8,12 @@ Simuloi Raspberry Pi GPIO-pinnien ohjausta sähkön spot-hinnan perusteella
 käyttäen Sahkotin /prices API:n tulevia hintatietoja (ct/kWh) ja paikallisia asetuksia. 
 Tulostaa simuloidun ON/OFF-aikataulun taulukkona tiedostoon DATA_DIR-hakemistoon.
 Asetukset (kokonaisluvut ct/kWh) luetaan skriptin omasta hakemistosta.
-Hyväksyy komentoriviparametrit --today, --tomorrow, --date VVVV-KK-PP.
+Hyväksyy komentoriviparametrit --today, --tomorrow, --date VVVV-KK-PP sekä
+aikavälin --from VVVV-KK-PP [--to VVVV-KK-PP]. Aikaväli haetaan enintään
+FETCH_PAGE_DAYS päivän sivuina ja päivien taulukot kirjoitetaan samaan
+tiedostoon sitä mukaa kuin ne lasketaan, joten muistissa on kerrallaan vain
+yksi sivu hintoja ja yksi päivä aikataulua. Tiedosto korvataan vasta, kun
+kaikki päivät on kirjoitettu.
 
 # HUOM (V1 Arkkitehtuuri): Tämä skripti käyttää Sahkotin /prices APIa ja
 # suorittaa kaiken päätöksentekologiikan paikallisesti. Se eroaa 
@@ -20,6 +25,13 @@ Hyväksyy komentoriviparametrit --today, --tomorrow, --date VVVV-KK-PP.
 """
 
 import requests
+import api_client
+import app_config
+import price_cache
+import pin_settings
+from price_slots import parse_price_json
+from price_logic import decide_slot_with_hysteresis, find_cheapest_intervals_with_startup_cost, trailing_run_minutes, cheapest_slot_count
+from schedule_builder import apply_switching_limits, apply_power_cap, site_max_power_kw
 import json
 import datetime
 import os
@@ -42,47 +54,26 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 SETTINGS_FILE = os.path.join(SCRIPT_DIR, 'settings.json') 
 DATA_DIR = os.path.expanduser('~/gpio_pricer_data') 
 OUTPUT_FILE = os.path.join(DATA_DIR, 'simulation_schedule.txt') 
-SAHKOTIN_API_URL = 'https://sahkotin.fi/prices' 
+SAHKOTIN_API_URL = app_config.get('sahkotin_api_url') 
 API_TIMEOUT = 15 
+FETCH_PAGE_DAYS = 31   # Montako päivää haetaan yhdellä API-kutsulla (--from/--to)
 LOCAL_TIMEZONE_STR = "Europe/Helsinki"
 
 # --- Funktiot ---
 
 def load_settings(settings_file_path):
-    """Lataa pinnikohtaiset ohjausasetukset JSON-tiedostosta ja varmistaa rajojen olevan kokonaislukuja."""
+    """Lataa ja validoi pinnikohtaiset asetukset (pin_settings.py, sama validointi kuin ohjauksessa). Palauttaa listan PinRule-olioita tai None."""
     abs_path = os.path.abspath(settings_file_path)
     print(f"Ladataan asetukset tiedostosta: {abs_path}")
-    if not os.path.exists(abs_path): print(f"VIRHE: Asetustiedostoa '{abs_path}' ei löydy.", file=sys.stderr); return None
-    try:
-        with open(abs_path, 'r', encoding='utf-8') as f:
-            settings_list = json.load(f)
-            if not isinstance(settings_list, list): print(f"VIRHE: Asetustiedosto '{abs_path}' ei sisältänyt listaa.", file=sys.stderr); return None
-            valid_settings = []
-            required_keys = {'gpio_pin', 'upper_limit_ct_kwh', 'lower_limit_ct_kwh', 'cheapest_hours_n'}
-            for i, item in enumerate(settings_list):
-                 is_valid = False
-                 if isinstance(item, dict) and required_keys.issubset(item.keys()):
-                      try:
-                           item['upper_limit_ct_kwh'] = int(item['upper_limit_ct_kwh'])
-                           item['lower_limit_ct_kwh'] = int(item['lower_limit_ct_kwh'])
-                           n_value = int(item['cheapest_hours_n'])
-                           if 0 <= n_value <= 24: 
-                                if 'identifier' not in item or not item['identifier']: item['identifier'] = f"Pin_{item['gpio_pin']}"
-                                valid_settings.append(item); is_valid = True
-                           else: print(f"VAROITUS: Ohitetaan rivi {i+1}, 'cheapest_hours_n' ({n_value}) ei välillä 0-24: {item}")
-                      except (ValueError, TypeError, KeyError): print(f"VAROITUS: Ohitetaan rivi {i+1} virheellisen arvon vuoksi: {item}")
-                 if not is_valid and isinstance(item, dict): 
-                      if not required_keys.issubset(item.keys()): missing = required_keys - item.keys(); print(f"VAROITUS: Ohitetaan rivi {i+1} puuttuvien avainten vuoksi ({missing}): {item}")
-            if not valid_settings: print(f"VIRHE: Ei kelvollisia asetuksia tiedostossa '{abs_path}'.", file=sys.stderr); return None
-            print(f"Löytyi {len(valid_settings)} kelvollista pinnin asetusta.")
-            return valid_settings
-    except json.JSONDecodeError as e: print(f"VIRHE: Asetustiedosto '{abs_path}' on virheellinen JSON: {e}", file=sys.stderr); return None
-    except IOError as e: print(f"VIRHE: Asetustiedoston '{abs_path}' lukeminen epäonnistui: {e}", file=sys.stderr); return None
-    except Exception as e: print(f"VIRHE: Odottamaton virhe asetuksia ladatessa: {e}", file=sys.stderr); return None
-
-def fetch_price_data(api_base_url, target_date, local_timezone_str, timeout):
-    """Hakee hintadataa Sahkotin /prices API:sta annetulle päivälle."""
-    print(f"Valmistellaan API-kutsua päivälle {target_date.isoformat()}...")
+    settings_list = pin_settings.load_settings(abs_path)
+    if not settings_list: print(f"VIRHE: Ei kelvollisia asetuksia tiedostossa '{abs_path}'.", file=sys.stderr); return None
+    print(f"Löytyi {len(settings_list)} kelvollista pinnin asetusta.")
+    return settings_list
+
+def fetch_price_data(api_base_url, target_date, local_timezone_str, timeout, end_date=None):
+    """Hakee hintadataa Sahkotin /prices API:sta annetusta päivästä alkaen (end_date: viimeinen haettava päivä, oletus ei rajaa)."""
+    range_text = f"{target_date.isoformat()} - {end_date.isoformat()}" if end_date else target_date.isoformat()
+    print(f"Valmistellaan API-kutsua päivälle {range_text}...")
     prices_raw = None 
     try:
         local_tz = ZoneInfo(local_timezone_str)
@@ -92,15 +83,15 @@ def fetch_price_data(api_base_url, target_date, local_timezone_str, timeout):
         utc_start_aware = local_start_aware.astimezone(datetime.timezone.utc)
         start_param = utc_start_aware.strftime('%Y-%m-%dT%H:%M:%S.000Z')
         url = f"{api_base_url}?fix&vat&start={start_param}"
+        if end_date: url += f"&end={price_cache.local_day_bounds_utc(end_date, local_tz)[1].strftime('%Y-%m-%dT%H:%M:%S.000Z')}"
         print(f"Haetaan hintadataa osoitteesta: {url}")
-        response = requests.get(url, timeout=timeout)
+        response = api_client.get(url, timeout=timeout)
         response.raise_for_status() 
-        data = response.json()
-        if "prices" in data and isinstance(data["prices"], list):
-             prices_raw = data["prices"] 
+        prices_raw = parse_price_json(response.content)
+        if prices_raw is not None:
              print(f"Hintadata haettu onnistuneesti ({len(prices_raw)} hintapistettä).")
              return prices_raw
-        else: print(f"VIRHE: Odottamaton JSON API:sta (puuttuu 'prices'): {str(data)[:200]}...", file=sys.stderr); return None
+        else: print(f"VIRHE: Odottamaton JSON API:sta (puuttuu 'prices'): {response.content[:200]!r}...", file=sys.stderr); return None
     except (ZoneInfoNotFoundError, Exception) as e: print(f"VIRHE: API-kutsun valmistelu/suoritus: {e}", file=sys.stderr); return None
     except requests.exceptions.Timeout: print(f"VIRHE: API-aikakatkaisu", file=sys.stderr); return None
     except requests.exceptions.ConnectionError: print(f"VIRHE: Yhteysvirhe APIin", file=sys.stderr); return None
@@ -108,50 +99,45 @@ def fetch_price_data(api_base_url, target_date, local_timezone_str, timeout):
     except requests.exceptions.RequestException as e: print(f"VIRHE: Yleinen API-virhe: {e}", file=sys.stderr); return None
     except json.JSONDecodeError: print(f"VIRHE: API-vastaus ei JSONia.", file=sys.stderr); return None
 
-def filter_and_prepare_prices(prices_raw, target_date, local_timezone_str):
+def iter_range_prices(start_date, end_date, local_timezone_str):
+    """
+    Hakee hinnat väliltä [start_date, end_date] FETCH_PAGE_DAYS päivän sivuina ja
+    jakaa kunkin sivun päiviin yhdellä läpikäynnillä. Tuottaa aikajärjestyksessä
+    (päivä, {päivä_str: DayPrices}) jokaiselle välin päivälle; sivu vapautuu,
+    kun sen päivät on käsitelty. Epäonnistunut haku tuottaa tyhjän dictin.
+    """
+    local_tz = ZoneInfo(local_timezone_str)
+    page_start = start_date
+    while page_start <= end_date:
+        page_end = min(page_start + datetime.timedelta(days=FETCH_PAGE_DAYS - 1), end_date)
+        prices_raw = fetch_price_data(SAHKOTIN_API_URL, page_start, local_timezone_str, API_TIMEOUT, end_date=page_end)
+        prices_by_day = price_cache.split_prices_by_day(prices_raw, local_tz) if prices_raw else {}
+        day = page_start
+        while day <= page_end:
+            yield day, prices_by_day
+            day += datetime.timedelta(days=1)
+        page_start = page_end + datetime.timedelta(days=1)
+
+def filter_and_prepare_prices(prices_by_day, target_date, local_timezone_str):
     """
-    Suodattaa raakadatan hinnat tietylle päivälle ja muuntaa muotoon 
-    {tunti (int 0-23): hinta (float, ct/kWh)}.
-    Olettaa prices_raw olevan lista dictejä,
-    joissa avaimet 'value' (ct/kWh!) ja 'date' (UTC ISO 8601).
+    Poimii päiviin jaetuista hinnoista ({päivä_str: DayPrices}, ks. iter_range_prices)
+    annetun päivän jaksotaulukon (price_slots.DayPrices: tunti- tai 15 min jaksot,
+    23-25 / 92-100 jaksoa kesäaikasiirtymät huomioiden) ja varoittaa puuttuvista
+    jaksoista. Hinnat ovat ct/kWh. Palauttaa DayPrices tai None.
     """
-    daily_prices = {}
     print(f"Suodatetaan ja valmistellaan hintoja päivälle: {target_date.isoformat()}")
-    if not prices_raw: print("VAROITUS: Raaka hintadata tyhjä.", file=sys.stderr); return {}
     try: local_tz = ZoneInfo(local_timezone_str)
-    except Exception as e: print(f"VIRHE: Aikavyöhykevirhe: {e}", file=sys.stderr); return {} 
-    processed_hours = set()
-    for entry_index, price_entry in enumerate(prices_raw): 
-        try:
-            timestamp_str = price_entry.get('date')   
-            price_ct_kwh_val = price_entry.get('value') # Value ON JO ct/kWh
-
-            if timestamp_str is None or price_ct_kwh_val is None: continue 
-            original_timestamp_str = timestamp_str 
-            if timestamp_str.endswith('Z'): timestamp_str = timestamp_str[:-1] + '+00:00' 
-            try:
-                dt_object_aware = datetime.datetime.fromisoformat(timestamp_str) 
-                dt_local = dt_object_aware.astimezone(local_tz) 
-            except ValueError: 
-                 if entry_index < 5 or entry_index % 50 == 0: print(f"VAROITUS (filter): Virheellinen aikaleima '{original_timestamp_str}', ohitetaan.", file=sys.stderr)
-                 continue 
-            if dt_local.date() == target_date:
-                hour = dt_local.hour
-                if hour not in processed_hours:
-                     try:
-                         # EI ENÄÄ JAKOLASKUA - ARVO ON JO ct/kWh
-                         price_ct_kwh = float(price_ct_kwh_val) 
-                         daily_prices[hour] = price_ct_kwh
-                         processed_hours.add(hour)
-                     except (ValueError, TypeError): print(f"VAROITUS (filter): Virheellinen hinta '{price_ct_kwh_val}', ohitetaan tunti {hour}.", file=sys.stderr); continue
-        except Exception as e: print(f"VAROITUS (filter): Odottamaton virhe alkiolla {entry_index}: {e}", file=sys.stderr); continue 
-    missing_hours = set(range(24)) - processed_hours
-    if missing_hours: print(f"VAROITUS: Hinta puuttuu tunneilta {sorted(list(missing_hours))} päivälle {target_date.isoformat()}. Tilaksi tulee 'N/A'.")
-    print(f"Löytyi ja valmisteltiin {len(daily_prices)} hintaa päivälle {target_date.isoformat()}.")
-    return daily_prices
+    except Exception as e: print(f"VIRHE: Aikavyöhykevirhe: {e}", file=sys.stderr); return None
+    day_prices = prices_by_day.get(target_date.isoformat())
+    if day_prices is None or not day_prices.valid_count(): print(f"VAROITUS: Ei hintoja päivälle {target_date.isoformat()}.", file=sys.stderr); return None
+    labels = day_prices.labels(local_tz)
+    missing_slots = [labels[index] for index in range(len(day_prices)) if day_prices.price(index) is None]
+    if missing_slots: print(f"VAROITUS: Hinta puuttuu jaksoilta {missing_slots} päivälle {target_date.isoformat()}. Tilaksi tulee 'N/A'.")
+    print(f"Löytyi ja valmisteltiin {day_prices.valid_count()} hintaa ({day_prices.resolution_minutes} min jaksot) päivälle {target_date.isoformat()}.")
+    return day_prices
 
 def find_cheapest_hours(daily_prices_dict, n):
-    """Etsii N halvinta tuntia annetusta {tunti: hinta} dictistä. Palauttaa set."""
+    """Etsii N halvinta jaksoa annetusta {jakso: hinta} dictistä. Palauttaa set."""
     if n <= 0 or not daily_prices_dict: return set()
     price_hour_list = [(price, hour) for hour, price in daily_prices_dict.items() if price is not None]
     if not price_hour_list: return set()
@@ -162,73 +148,126 @@ def find_cheapest_hours(daily_prices_dict, n):
     cheapest_entries = price_hour_list[:n]
     return {hour for price, hour in cheapest_entries} 
 
-def simulate_pin_state(pin_setting, hour, hourly_price_ct_kwh, cheapest_hours_set):
-    """Simuloi yhden pinnin tilan paikallisen logiikan perusteella."""
-    if hourly_price_ct_kwh is None: return None 
-    try:
-        upper_limit = int(pin_setting['upper_limit_ct_kwh']) 
-        lower_limit = int(pin_setting['lower_limit_ct_kwh']) 
-        n = int(pin_setting['cheapest_hours_n']) 
-    except (KeyError, ValueError, TypeError): return False
-    current_price = float(hourly_price_ct_kwh) 
-    if current_price > upper_limit: return False 
-    elif current_price < lower_limit: return True 
-    else: 
-        if n > 0: return hour in cheapest_hours_set 
-        else: return False 
+def simulate_pin_state(pin_rule, slot, slot_price_ct_kwh, cheapest_slots_set, previous_state=False):
+    """Simuloi yhden pinnin (PinRule) tilan samalla logiikalla kuin aikataulu (price_logic), hystereesi mukaan lukien."""
+    if slot_price_ct_kwh is None: return None 
+    state, _reason_code = decide_slot_with_hysteresis(slot_price_ct_kwh, pin_rule.lower_limit_ct_kwh, pin_rule.upper_limit_ct_kwh, pin_rule.cheapest_hours_n,
+                                                      slot in cheapest_slots_set, bool(previous_state), pin_rule.hysteresis_ct_kwh)
+    return state
+
+# --- Simulointi ja tulostus ---
+
+def simulate_day(settings_list, day_prices, local_tz, initial_states=None, initial_runs=None, max_power_kw=None):
+    """
+    Simuloi yhden päivän pinnien (PinRule-lista, ks. pin_settings.py) tilat. initial_states: {tunniste: edellisen
+    päivän viimeinen tila} ja initial_runs: {tunniste: sen kesto minuutteina} (ks. carry_over), jolloin
+    hystereesi, käynnistyskerroin, vähimmäisajat ja kytkentäbudjetti jatkuvat päivän rajan yli
+    samoin kuin aikataulussa. max_power_kw: sivuston tehoraja (schedule_builder.apply_power_cap, None = ei rajaa).
+    Palauttaa (schedule {tunniste: {jakso: tila}}, jaksojen nimet).
+    """
+    initial_states = initial_states or {}
+    initial_runs = initial_runs or {}
+    daily_prices_dict = day_prices.by_index()
+    slot_labels = day_prices.labels(local_tz)
+    schedule = defaultdict(dict)
+    cheapest_hours_sets = {}
+    for rule in settings_list:
+        n, startup_factor = cheapest_slot_count(rule.cheapest_hours_n, day_prices.resolution_minutes), rule.startup_factor
+        initially_on = bool(initial_states.get(rule.identifier)) and startup_factor > 1.0
+        key = (n, startup_factor, initially_on)
+        if n > 0 and key not in cheapest_hours_sets:
+            if startup_factor > 1.0:
+                cheapest_hours_sets[key] = find_cheapest_intervals_with_startup_cost(daily_prices_dict, n, startup_factor, initially_on)
+                print(f"Lasketut N={rule.cheapest_hours_n} h ({n} jaksoa) halvimmat jaksot (käynnistyskerroin {startup_factor}): {[slot_labels[i] for i in sorted(cheapest_hours_sets[key])]}")
+            else: cheapest_hours_sets[key] = find_cheapest_hours(daily_prices_dict, n); print(f"Lasketut N={rule.cheapest_hours_n} h ({n} jaksoa) halvimmat jaksot: {[slot_labels[i] for i in sorted(cheapest_hours_sets[key])]}")
+        current_cheapest_set = cheapest_hours_sets.get(key, set())
+        previous_state = bool(initial_states.get(rule.identifier))
+        pin_schedule = schedule[rule.identifier]
+        for slot in range(len(slot_labels)):
+            price_for_slot = daily_prices_dict.get(slot) 
+            pin_schedule[slot] = previous_state = simulate_pin_state(rule, slot, price_for_slot, current_cheapest_set, previous_state)
+        if rule.has_switching_limits():
+            desired = [bool(pin_schedule[slot]) for slot in range(len(slot_labels))]
+            limited = apply_switching_limits(rule, desired, [daily_prices_dict.get(slot) for slot in range(len(slot_labels))], day_prices.resolution_minutes,
+                                             bool(initial_states.get(rule.identifier)), initial_runs.get(rule.identifier))
+            for slot, state in enumerate(limited):
+                if state != desired[slot]: pin_schedule[slot] = state
+    if max_power_kw:
+        slot_range = range(len(slot_labels))
+        desired = {rule.identifier: [bool(schedule[rule.identifier][slot]) for slot in slot_range] for rule in settings_list}
+        capped, _unmet = apply_power_cap(settings_list, desired, [daily_prices_dict.get(slot) for slot in slot_range], max_power_kw,
+                                         day_prices.resolution_minutes, initial_states=initial_states, initial_runs=initial_runs)
+        for identifier, states in capped.items():
+            for slot, state in enumerate(states):
+                if state != desired[identifier][slot]: schedule[identifier][slot] = state
+    return schedule, slot_labels
+
+def carry_over(schedule, slot_count, resolution_minutes):
+    """Palauttaa päivän viimeiset tilat ja niiden kestot ({tunniste: tila}, {tunniste: min}) seuraavan päivän simulointiin."""
+    last_states = {identifier: states.get(slot_count - 1) for identifier, states in schedule.items()}
+    last_runs = {identifier: trailing_run_minutes([bool(states.get(slot)) for slot in range(slot_count)], resolution_minutes)
+                 for identifier, states in schedule.items()}
+    return last_states, last_runs
+
+def write_day_table(f, target_date, sorted_identifiers, schedule, slot_labels):
+    """Kirjoittaa yhden päivän aikataulutaulukon avoimeen tiedostoon."""
+    f.write(f"Päivämäärä: {target_date.isoformat()}\n")
+    hour_col_width = 7
+    max_id_len = max(len(id) for id in sorted_identifiers) if sorted_identifiers else 0
+    state_col_width = max(5, max_id_len) + 2 
+    header = f"{'Jakso':<{hour_col_width}}|"; 
+    for identifier in sorted_identifiers: header += f"{identifier:<{state_col_width}}|" 
+    f.write(header + "\n"); separator = "-" * hour_col_width + "+"; 
+    for _ in sorted_identifiers: separator += "-" * state_col_width + "+"
+    f.write(separator + "\n")
+    for slot, slot_label in enumerate(slot_labels):
+         row_str = f"  {slot_label}{'':<{hour_col_width-7}}|" 
+         for identifier in sorted_identifiers: 
+             state = schedule[identifier].get(slot); state_str = "ON" if state is True else "OFF" if state is False else "N/A" 
+             row_str += f"{state_str:<{state_col_width}}|"
+         f.write(row_str + "\n")
+    f.write("\n")
 
 # --- Pääohjelma ---
-def main(target_date):
-    """Pääfunktio: lataa datan, simuloi ja kirjoittaa taulukon tiedostoon."""
+def main(target_date, end_date=None):
+    """Pääfunktio: hakee hinnat, simuloi päivä kerrallaan ja kirjoittaa taulukot tiedostoon."""
+    end_date = end_date or target_date
+    range_text = target_date.isoformat() if end_date == target_date else f"{target_date.isoformat()} - {end_date.isoformat()}"
     print("-" * 50); print(f"--- GPIO Ohjauksen Simulaattori (Sahkotin /prices API) ---") 
-    print(f"Simuloidaan aikataulu päivälle: {target_date.isoformat()}"); print("-" * 50)
+    print(f"Simuloidaan aikataulu päivälle: {range_text}"); print("-" * 50)
     try: os.makedirs(DATA_DIR, exist_ok=True); print(f"Varmistettu datahakemiston olemassaolo: {DATA_DIR}")
     except OSError as e: print(f"KRIITTINEN VIRHE datahakemiston luonnissa: {e}", file=sys.stderr); sys.exit(1)
     settings_list = load_settings(SETTINGS_FILE); 
     if not settings_list: sys.exit(1)
-    raw_prices = fetch_price_data(SAHKOTIN_API_URL, target_date, LOCAL_TIMEZONE_STR, API_TIMEOUT); 
-    if raw_prices is None: sys.exit(1)
-    daily_prices_dict = filter_and_prepare_prices(raw_prices, target_date, LOCAL_TIMEZONE_STR);
-    if not daily_prices_dict and target_date >= datetime.date.today(): 
-         print(f"Hintatietoja päivälle {target_date.isoformat()} ei löytynyt/julkaistu.", file=sys.stderr)
-         if target_date > datetime.date.today(): print("Yritä myöhemmin.", file=sys.stderr)
-         sys.exit(1 if target_date == datetime.date.today() else 0) 
-    print("Simuloidaan pinnien tilat...")
-    schedule = defaultdict(dict)
-    pin_identifiers = [s['identifier'] for s in settings_list] 
-    unique_n_values = {s.get('cheapest_hours_n', 0) for s in settings_list}
-    cheapest_hours_sets = {}
-    for n in unique_n_values:
-        if n > 0: cheapest_hours_sets[n] = find_cheapest_hours(daily_prices_dict, n); print(f"Lasketut N={n} halvimmat tunnit: {sorted(list(cheapest_hours_sets[n]))}")
-    for setting in settings_list:
-        identifier = setting['identifier']; rank_n = setting.get('cheapest_hours_n', 0)
-        current_cheapest_set = cheapest_hours_sets.get(rank_n, set()) 
-        for hour in range(24):
-            price_for_hour = daily_prices_dict.get(hour) 
-            schedule[identifier][hour] = simulate_pin_state(setting, hour, price_for_hour, current_cheapest_set)
-    print("Simulointi valmis.")
+    local_tz = ZoneInfo(LOCAL_TIMEZONE_STR)
+    sorted_identifiers = sorted(rule.identifier for rule in settings_list)
     output_abs_path = os.path.abspath(OUTPUT_FILE) 
     print(f"Kirjoitetaan aikataulutaulukko tiedostoon: {output_abs_path}")
+    simulated_days, last_states, last_runs = 0, {}, {}
+    max_power_kw = site_max_power_kw()
+    if max_power_kw: print(f"Sivuston tehoraja: {max_power_kw} kW")
     try:
-        with open(output_abs_path, 'w', encoding='utf-8') as f:
+        with open(f"{output_abs_path}.tmp", 'w', encoding='utf-8') as f:
             f.write(f"--- Simuloitu GPIO Aikataulu (Data: Sahkotin /prices API) ---\n") 
-            f.write(f"Päivämäärä: {target_date.isoformat()}\n"); f.write(f"Luotu: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-            hour_col_width = 7; sorted_identifiers = sorted(pin_identifiers) 
-            max_id_len = max(len(id) for id in sorted_identifiers) if sorted_identifiers else 0
-            state_col_width = max(5, max_id_len) + 2 
-            header = f"{'Tunti':<{hour_col_width}}|"; 
-            for identifier in sorted_identifiers: header += f"{identifier:<{state_col_width}}|" 
-            f.write(header + "\n"); separator = "-" * hour_col_width + "+"; 
-            for _ in sorted_identifiers: separator += "-" * state_col_width + "+"
-            f.write(separator + "\n")
-            for hour in range(24):
-                 row_str = f"  {hour:02d}:00{'':<{hour_col_width-7}}|" 
-                 for identifier in sorted_identifiers: 
-                     state = schedule[identifier].get(hour); state_str = "ON" if state is True else "OFF" if state is False else "N/A" 
-                     row_str += f"{state_str:<{state_col_width}}|"
-                 f.write(row_str + "\n")
-            print(f"Aikataulutaulukko kirjoitettu onnistuneesti: {output_abs_path}")
-    except Exception as e: print(f"VIRHE taulukon kirjoituksessa: {e}", file=sys.stderr)
+            f.write(f"Aikaväli: {range_text}\n"); f.write(f"Luotu: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+            for day, prices_by_day in iter_range_prices(target_date, end_date, LOCAL_TIMEZONE_STR):
+                day_prices = filter_and_prepare_prices(prices_by_day, day, LOCAL_TIMEZONE_STR)
+                if day_prices is None:
+                    if end_date == target_date and day >= datetime.date.today():
+                        print(f"Hintatietoja päivälle {day.isoformat()} ei löytynyt/julkaistu.", file=sys.stderr)
+                        if day > datetime.date.today(): print("Yritä myöhemmin.", file=sys.stderr)
+                        f.close(); os.remove(f"{output_abs_path}.tmp")
+                        sys.exit(1 if day == datetime.date.today() else 0)
+                    f.write(f"Päivämäärä: {day.isoformat()}\nEi hintatietoja.\n\n"); last_states, last_runs = {}, {}; continue
+                print(f"Simuloidaan pinnien tilat ({day.isoformat()})...")
+                schedule, slot_labels = simulate_day(settings_list, day_prices, local_tz, last_states, last_runs, max_power_kw)
+                write_day_table(f, day, sorted_identifiers, schedule, slot_labels)
+                last_states, last_runs = carry_over(schedule, len(slot_labels), day_prices.resolution_minutes)
+                simulated_days += 1
+        os.replace(f"{output_abs_path}.tmp", output_abs_path)
+        print(f"Aikataulutaulukko kirjoitettu onnistuneesti: {output_abs_path} ({simulated_days} päivää)")
+    except OSError as e: print(f"VIRHE taulukon kirjoituksessa: {e}", file=sys.stderr)
+    api_client.close()
     print("-" * 50); print("--- Simulaattori Valmis ---"); print("-" * 50)
 
 # --- Komentoriviparametrien Käsittely ---
@@ -238,13 +277,23 @@ if __name__ == "__main__":
     group.add_argument("--today", action="store_true", help="Simuloi kuluvalle päivälle (oletus)")
     group.add_argument("--tomorrow", action="store_true", help="Simuloi seuraavalle päivälle")
     parser.add_argument("--date", type=str, help="Simuloi tietylle päivälle (VVVV-KK-PP)") 
+    parser.add_argument("--from", dest="date_from", type=str, help="Aikavälin alkupäivä (VVVV-KK-PP)") 
+    parser.add_argument("--to", dest="date_to", type=str, help="Aikavälin loppupäivä (VVVV-KK-PP, oletus huominen)") 
     args = parser.parse_args()
-    if args.date:
+    end_date = None
+    if args.date_from:
+        try:
+            sim_date = datetime.date.fromisoformat(args.date_from)
+            end_date = datetime.date.fromisoformat(args.date_to) if args.date_to else datetime.date.today() + datetime.timedelta(days=1)
+        except ValueError: print(f"VIRHE: Päivämäärämuoto? Käytä VVVV-KK-PP.", file=sys.stderr); sys.exit(1)
+        if end_date < sim_date: print("VIRHE: --to on ennen --from-päivää.", file=sys.stderr); sys.exit(1)
+        print(f"Käytetään aikaväliä: {sim_date.isoformat()} - {end_date.isoformat()}")
+    elif args.date_to: print("VIRHE: --to vaatii --from-päivän.", file=sys.stderr); sys.exit(1)
+    elif args.date:
         try: sim_date = datetime.date.fromisoformat(args.date); print(f"Käytetään annettua päivämäärää: {sim_date.isoformat()}")
         except ValueError: print(f"VIRHE: Päivämäärämuoto '{args.date}'? Käytä VVVV-KK-PP.", file=sys.stderr); sys.exit(1)
     elif args.tomorrow: sim_date = datetime.date.today() + datetime.timedelta(days=1); print(f"Käytetään huomista päivämäärää: {sim_date.isoformat()}")
     else: sim_date = datetime.date.today(); print(f"Käytetään tätä päivää: {sim_date.isoformat()}")
     settings_path_abs = os.path.abspath(SETTINGS_FILE) 
     if not os.path.exists(settings_path_abs): print(f"KRIITTINEN VIRHE: Asetustiedostoa '{settings_path_abs}' ei löydy.", file=sys.stderr); sys.exit(1)
-    main(sim_date)
-
+    main(sim_date, end_date)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+transition_sequencer.py
+
+Jakson rajan kytkentäsarja. Kun moni suuri kuorma kytkeytyy päälle samalla
+sekunnilla, releiden käynnistysvirrat summautuvat ja jännite notkahtaa.
+Sekvensseri ottaa yhden päätöskierroksen kaikki tilamuutokset ja:
+  * kytkee ensin kaikki OFF-muutokset yhtenä eränä,
+  * kytkee sen jälkeen ON-muutokset porrastetusti: peräkkäisten ON-kytkentöjen
+    väli on vähintään SWITCH_ON_STAGGER_S, ja käynnistysvirtoja on yhtä aikaa
+    enintään MAX_CONCURRENT_INRUSH (0 = ei rajaa). Pinnin käynnistysvirran kesto
+    on sen inrush_seconds-asetus (oletus DEFAULT_INRUSH_S),
+  * kytkee ON-muutokset prioriteettijärjestyksessä (priority, suurin ensin) ja
+    tasatilanteessa pinnin numeron mukaan.
+Saman hetken kytkennät kirjoitetaan yhtenä ajurin set_states-eränä. Ajoitus
+lasketaan sarjan alusta monotonisella kellolla (time.monotonic), joten
+seinäkellon siirrot eivät vaikuta. Sarjan kesto ja suurin myöhästyminen
+suunnitellusta hetkestä kirjataan lokiin ja mittareihin.
+
+Oletusasetuksilla (viiveet 0, ei rajaa) ON-muutokset kirjoitetaan yhtenä eränä
+heti OFF-erän jälkeen. Asetukset: config.json "switch_on_stagger_seconds",
+"max_concurrent_inrush" ja "inrush_seconds".
+"""
+
+import heapq
+import logging
+import time
+import app_config
+import metrics
+
+# --- Konfiguraatio ---
+SWITCH_ON_STAGGER_S = app_config.get_number('switch_on_stagger_seconds', 0.0)    # Vähimmäisväli peräkkäisten ON-kytkentöjen välillä
+MAX_CONCURRENT_INRUSH = app_config.get_number('max_concurrent_inrush', 0, int)    # Samanaikaiset käynnistysvirrat (0 = ei rajaa)
+DEFAULT_INRUSH_S = app_config.get_number('inrush_seconds', 0.5)                   # Käynnistysvirran kesto, jos pinnillä ei ole inrush_seconds-asetusta
+
+# --- Suunnittelu ---
+
+def is_staggered(changes):
+    """Porrastetaanko muutokset (yli yksi ON-muutos ja porrastus tai käynnistysvirtaraja käytössä)."""
+    return (SWITCH_ON_STAGGER_S > 0 or MAX_CONCURRENT_INRUSH > 0) and sum(1 for _pin, state, _identifier in changes if state) > 1
+
+def plan_sequence(changes, rules_by_pin=None, stagger_s=None, max_concurrent=None, default_inrush_s=None):
+    """
+    Laskee kytkentäsarjan. changes: lista (pinni, tila, tunniste); rules_by_pin: {pinni: PinRule}
+    prioriteettia ja käynnistysvirran kestoa varten. Palauttaa listan (hetki s sarjan alusta,
+    {pinni: tila}) aikajärjestyksessä: OFF-muutokset hetkellä 0, sitten ON-muutokset.
+    """
+    stagger_s = SWITCH_ON_STAGGER_S if stagger_s is None else stagger_s
+    max_concurrent = MAX_CONCURRENT_INRUSH if max_concurrent is None else max_concurrent
+    default_inrush_s = DEFAULT_INRUSH_S if default_inrush_s is None else default_inrush_s
+    rules_by_pin = rules_by_pin or {}
+    steps = []
+    off_batch = {pin: False for pin, state, _identifier in changes if not state}
+    if off_batch: steps.append((0.0, off_batch))
+
+    def order(pin):
+        rule = rules_by_pin.get(pin)
+        return (-(rule.priority if rule else 0), pin)
+
+    inrush_free_at = [0.0] * max_concurrent   # Keko: milloin kukin käynnistysvirtapaikka vapautuu
+    previous_start = None
+    for pin in sorted((pin for pin, state, _identifier in changes if state), key=order):
+        start = 0.0 if previous_start is None else previous_start + stagger_s
+        if max_concurrent > 0:
+            start = max(start, heapq.heappop(inrush_free_at))
+            rule = rules_by_pin.get(pin)
+            inrush_s = rule.inrush_seconds if rule is not None and rule.inrush_seconds is not None else default_inrush_s
+            heapq.heappush(inrush_free_at, start + inrush_s)
+        if steps and steps[-1][0] == start and steps[-1][1] is not off_batch: steps[-1][1][pin] = True
+        else: steps.append((start, {pin: True}))
+        previous_start = start
+    return steps
+
+# --- Suoritus ---
+
+def run_sequence(backend, steps, clock=time.monotonic, sleep=time.sleep):
+    """
+    Suorittaa kytkentäsarjan ajurilla (gpio_backends.GpioBackend) monotonisen kellon mukaan.
+    Palauttaa (onnistuneet pinnit, kesto s, suurin myöhästyminen s).
+    """
+    written, max_lateness = set(), 0.0
+    started = clock()
+    for offset, batch in steps:
+        target = started + offset
+        remaining = target - clock()
+        if remaining > 0: sleep(remaining)
+        max_lateness = max(max_lateness, clock() - target)
+        written |= backend.set_states(batch)
+    return written, clock() - started, max_lateness
+
+def apply_transitions(backend, changes, rules_by_pin=None):
+    """Suunnittelee ja suorittaa päätöskierroksen muutokset (ks. moduulin kuvaus). Palauttaa onnistuneet pinnit."""
+    if not changes: return set()
+    steps = plan_sequence(changes, rules_by_pin)
+    written, duration_s, max_lateness_s = run_sequence(backend, steps)
+    on_count = sum(1 for _pin, state, _identifier in changes if state)
+    metrics.observe('gpio_sequence_seconds', duration_s)
+    metrics.set_gauge('gpio_sequence_steps', len(steps))
+    metrics.set_gauge('gpio_sequence_max_lateness_seconds', round(max_lateness_s, 6))
+    if len(steps) > 2 or steps[-1][0] > 0:
+        logging.info(f"Kytkentäsarja: {len(changes) - on_count} OFF, {on_count} ON {len(steps)} vaiheessa, "
+                     f"kesto {duration_s:.3f} s (suunniteltu {steps[-1][0]:.3f} s), suurin myöhästyminen {max_lateness_s * 1000:.1f} ms")
+    return written